@@ -0,0 +1,288 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'piecewise_smooth_streamlines'))
+
+import numpy as np
+
+import argparse
+import importlib.util
+import json
+import platform
+import subprocess
+import tempfile
+import tracemalloc
+
+import streamlines as streamlines
+import piecewise_smooth_field as pws
+import profiling as profiling
+
+# Benchmarks
+#
+# Every workload plots one of the systems of the repository, the dipole of
+# streamlines.main, the buck converter of piecewise_smooth_field.main and the
+# bridge converter of example.py, at a grid step scaled from the step of the
+# system and at a streamline density. The whole pipeline is run, and its stages
+# are timed by the profiler it reports them to, taking the best of the repeated
+# runs; a last run under tracemalloc records the peak memory of every stage.
+#
+# The import of the modules is timed too, each in a fresh interpreter, together
+# with the heavy modules it loads; these must only be loaded by the stages that
+# use them, so any of them loaded on import is a regression.
+#
+# Results are saved as JSON. When a baseline saved by an earlier run is given, any
+# stage of a workload slower or larger than its baseline by more than the
+# threshold is reported as a regression, and the benchmark exits with status 1.
+
+BENCHMARK_VERSION = 1
+
+# Changes below these floors are measurement noise, whatever the threshold
+MIN_SECONDS_CHANGE = 0.01
+MIN_BYTES_CHANGE = 1 << 20
+
+# Modules whose import is timed, and the modules they must not load on import
+IMPORTED_MODULES = ['datastructures', 'streamlines', 'piecewise_smooth_field']
+LAZY_MODULES = ['matplotlib', 'scipy', 'bitstring', 'numba']
+
+_IMPORT_SCRIPT = '''
+import sys, time, json
+sys.path.insert(0, {path!r})
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{'seconds' : seconds, 'lazy_modules' : [name for name in {lazy_modules!r} if name in sys.modules]}}))
+'''
+
+def load_example():
+	filename = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'example.py')
+	spec = importlib.util.spec_from_file_location('example', filename)
+	example = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(example)
+	
+	return example
+
+# Stage profiler of the pipelines that also records the peak memory of every
+# stage while tracemalloc traces; the peak since the last stage event is the peak
+# of every stage still running, so stages run within others count in both
+class BenchmarkProfiler(profiling.StageProfiler):
+	def __init__(self, trace_memory=False):
+		super().__init__()
+		self.trace_memory = trace_memory
+		self.peak_bytes = {}
+		self.__running_stages = []
+	
+	def __record_peak(self):
+		peak = tracemalloc.get_traced_memory()[1]
+		for name in self.__running_stages:
+			self.peak_bytes[name] = max(self.peak_bytes.get(name, 0), peak)
+		tracemalloc.reset_peak()
+	
+	def start_stage(self, name):
+		if self.trace_memory:
+			self.__record_peak()
+		self.__running_stages.append(name)
+		super().start_stage(name)
+	
+	def stop_stage(self, name, **counts):
+		super().stop_stage(name, **counts)
+		if self.trace_memory:
+			self.__record_peak()
+		self.__running_stages.remove(name)
+
+def _scale_step(step, step_scale):
+	return tuple(s * step_scale for s in step)
+
+def run_field_workload(system, step_scale, density, engine, directory, profiler):
+	vector_field, min_value, max_value, step = system
+	meshgrid_generator = streamlines.IsoMeshgridGenerator(min_value, max_value, _scale_step(step, step_scale))
+	
+	streamplot = streamlines.generate_streamplot(vector_field, meshgrid_generator, density=density, engine=engine, profiler=profiler)
+	streamlines.write_streamplot(directory, streamplot, profiler=profiler)
+	
+	counts = profiler.stages['integration']['counts']
+	return {'lines' : counts['lines'], 'vertices' : counts['points']}
+
+def run_piecewise_workload(system, step_scale, density, engine, directory, profiler):
+	piecewise_bifield, min_value, max_value, step = system
+	meshgrid_generator = pws.IsoPiecewiseBifieldMeshgridGenerator(min_value, max_value, _scale_step(step, step_scale))
+	
+	bifield_streamplot = pws.generate_streamplot(piecewise_bifield, meshgrid_generator, stream_density=density, stream_engine=engine, manifold_refine=True, profiler=profiler)
+	pws.write_streamplot(directory, bifield_streamplot, profiler=profiler)
+	
+	counts = profiler.stages['filtering']['counts']
+	crossing_counts = profiler.stages['crossings']['counts'] if 'crossings' in profiler.stages else {}
+	return {'lines' : counts['lines'], 'vertices' : counts['points'], 'crossings' : crossing_counts.get('crossings', 0)}
+
+# Workloads by name: the function running them, the system, the scale of its grid
+# step, the streamline density and the streamline engine. Only the matplotlib
+# engine stitches segments into lines, so the dipole is also plotted with it
+def get_workloads(quick=False):
+	example = load_example()
+	systems = [
+		('dipole', run_field_workload, streamlines.get_dipole_system(), [1, 0.5], 'native'),
+		('dipole-matplotlib', run_field_workload, streamlines.get_dipole_system(), [1, 0.5], 'matplotlib'),
+		('buck', run_piecewise_workload, pws.get_buck_converter_system(), [4, 2], 'native'),
+		('bridge', run_piecewise_workload, example.get_bridge_converter_system(), [40, 20], 'native'),
+	]
+	densities = [1, 2]
+	
+	workloads = {}
+	for name, run, system, step_scales, engine in systems:
+		for step_scale in (step_scales[:1] if quick else step_scales):
+			for density in (densities[:1] if quick else densities):
+				workloads[f'{name}-step{step_scale:g}-density{density:g}'] = (run, system, step_scale, density, engine)
+	
+	return workloads
+
+# The stages and their counts are those reported by the pipeline to the profiler;
+# the seconds of the whole run are from the start of its first stage to the end
+# of its last one
+def run_workload(workload, repeat=1):
+	run, system, step_scale, density, engine = workload
+	
+	stages = {}
+	seconds = None
+	with tempfile.TemporaryDirectory() as directory:
+		for iteration in range(repeat):
+			profiler = BenchmarkProfiler()
+			counts = run(system, step_scale, density, engine, os.path.join(directory, f'timed_{iteration}'), profiler)
+			for name, stage in profiler.stages.items():
+				stage_seconds = min(stage['seconds'], stages[name]['seconds']) if name in stages else stage['seconds']
+				stages[name] = {'seconds' : stage_seconds, 'counts' : stage['counts']}
+			seconds = profiler.get_total_seconds() if seconds is None else min(seconds, profiler.get_total_seconds())
+		
+		profiler = BenchmarkProfiler(trace_memory=True)
+		tracemalloc.start()
+		try:
+			run(system, step_scale, density, engine, os.path.join(directory, 'traced'), profiler)
+		finally:
+			tracemalloc.stop()
+		for name, peak_bytes in profiler.peak_bytes.items():
+			stages[name]['peak_bytes'] = peak_bytes
+	
+	return {
+		'parameters' : {'step_scale' : step_scale, 'density' : density, 'engine' : engine},
+		'counts' : counts,
+		'stages' : stages,
+		'seconds' : seconds,
+		'peak_bytes' : max(stage['peak_bytes'] for stage in stages.values())
+	}
+
+# Imports module in a fresh interpreter, keeping the best time of the repeated
+# imports and the lazy modules loaded by the import
+def run_import(module, repeat=1):
+	path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'piecewise_smooth_streamlines')
+	script = _IMPORT_SCRIPT.format(path=path, module=module, lazy_modules=LAZY_MODULES)
+	
+	runs = []
+	for iteration in range(repeat):
+		output = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, check=True).stdout
+		runs.append(json.loads(output))
+	
+	return {
+		'seconds' : min(run['seconds'] for run in runs),
+		'lazy_modules' : sorted({name for run in runs for name in run['lazy_modules']})
+	}
+
+def run_benchmarks(workloads, repeat=1, log=None, modules=IMPORTED_MODULES):
+	imports = {}
+	for module in modules:
+		imports[module] = run_import(module, repeat)
+		if log is not None:
+			loaded = ', '.join(imports[module]['lazy_modules']) or 'no lazy modules'
+			log(f"import {module}: {imports[module]['seconds']:.3f} s, {loaded}")
+	
+	results = {}
+	for name, workload in workloads.items():
+		results[name] = run_workload(workload, repeat)
+		if log is not None:
+			log(f"{name}: {results[name]['seconds']:.3f} s, {results[name]['peak_bytes'] / 2**20:.1f} MiB")
+	
+	return {
+		'version' : BENCHMARK_VERSION,
+		'python' : platform.python_version(),
+		'numpy' : np.__version__,
+		'machine' : platform.machine(),
+		'imports' : imports,
+		'workloads' : results
+	}
+
+# Lazy modules loaded on import, as pairs (module, lazy module)
+def get_eager_imports(results):
+	return [(module, name) for module, result in results.get('imports', {}).items() for name in result['lazy_modules']]
+
+def _exceeds(value, baseline_value, threshold, min_change):
+	return value > baseline_value * (1 + threshold) and value - baseline_value > min_change
+
+# Rows (workload, stage, measure, value, baseline value, regression) for every
+# stage measured both in the results and in the baseline
+def compare_results(results, baseline, threshold):
+	rows = []
+	for module, result in results.get('imports', {}).items():
+		baseline_result = baseline.get('imports', {}).get(module)
+		if baseline_result is not None:
+			value = result['seconds']
+			baseline_value = baseline_result['seconds']
+			rows.append(('import', module, 'seconds', value, baseline_value, _exceeds(value, baseline_value, threshold, MIN_SECONDS_CHANGE)))
+	
+	for workload, result in results['workloads'].items():
+		baseline_result = baseline['workloads'].get(workload)
+		if baseline_result is None:
+			continue
+		
+		for stage, measures in result['stages'].items():
+			baseline_measures = baseline_result['stages'].get(stage)
+			if baseline_measures is None:
+				continue
+			
+			for measure, min_change in [('seconds', MIN_SECONDS_CHANGE), ('peak_bytes', MIN_BYTES_CHANGE)]:
+				value = measures[measure]
+				baseline_value = baseline_measures[measure]
+				rows.append((workload, stage, measure, value, baseline_value, _exceeds(value, baseline_value, threshold, min_change)))
+	
+	return rows
+
+def format_comparison(rows):
+	lines = [f"{'workload':<28} {'stage':<12} {'measure':<10} {'value':>12} {'baseline':>12} {'change':>8}"]
+	for workload, stage, measure, value, baseline_value, regression in rows:
+		change = (value / baseline_value - 1) * 100 if baseline_value > 0 else 0.0
+		flag = '  REGRESSION' if regression else ''
+		lines.append(f"{workload:<28} {stage:<12} {measure:<10} {value:>12.4g} {baseline_value:>12.4g} {change:>+7.1f}%{flag}")
+	
+	return "\n".join(lines)
+
+def main():
+	parser = argparse.ArgumentParser(description='Benchmark the stages of the streamplot pipeline')
+	parser.add_argument('--output', default='benchmark.json', help='file the results are saved to')
+	parser.add_argument('--baseline', help='results of an earlier run to compare against')
+	parser.add_argument('--threshold', type=float, default=0.2, help='relative increase reported as a regression')
+	parser.add_argument('--repeat', type=int, default=3, help='timed runs of every workload, the best one is kept')
+	parser.add_argument('--quick', action='store_true', help='run only the coarsest grid and lowest density of every system')
+	parser.add_argument('--workload', nargs='*', help='prefixes of the names of the workloads to run')
+	parser.add_argument('--imports-only', action='store_true', help='only time the imports of the modules')
+	arguments = parser.parse_args()
+	
+	workloads = {} if arguments.imports_only else get_workloads(arguments.quick)
+	if arguments.workload:
+		workloads = {name : workload for name, workload in workloads.items() if any(name.startswith(prefix) for prefix in arguments.workload)}
+	
+	results = run_benchmarks(workloads, arguments.repeat, log=print)
+	with open(arguments.output, 'w') as file:
+		json.dump(results, file, indent=1)
+	
+	eager_imports = get_eager_imports(results)
+	for module, name in eager_imports:
+		print(f"REGRESSION: importing {module} loads {name}")
+	
+	if arguments.baseline is None:
+		return 1 if eager_imports else 0
+	
+	with open(arguments.baseline) as file:
+		baseline = json.load(file)
+	rows = compare_results(results, baseline, arguments.threshold)
+	print(format_comparison(rows))
+	
+	return 1 if eager_imports or any(regression for *_, regression in rows) else 0
+
+if __name__ == '__main__':
+	sys.exit(main())
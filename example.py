@@ -1,16 +1,22 @@
-import piecewise_smooth_streamlines.piecewise_smooth_field as pws
-import piecewise_smooth_streamlines.streamlines as streamlines
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'piecewise_smooth_streamlines'))
+
+import piecewise_smooth_field as pws
 
 def bridge_converter(L, C, n, v_in, R):
 	def converter_controller(u):
 		def f(i_L, v_C):
-			D_i_L = (1/L)*(-n*(u(2) - u(3))*v_C + (u(0) - u(1))*v_in)
-			D_v_C = (1/C)*((1/n)*(u(2)-u(3))*i_L - v_C/R)
+			D_i_L = (1/L)*(-n*(u[2] - u[3])*v_C + (u[0] - u[1])*v_in)
+			D_v_C = (1/C)*((1/n)*(u[2]-u[3])*i_L - v_C/R)
 			return (D_i_L, D_v_C)
 		return f
 	return converter_controller
 
-def main():
+# Bridge converter with a sliding mode controller, and the box and grid step it is
+# plotted on
+def get_bridge_converter_system():
 	C = 114.7e-6
 	L = 5.25e-6
 	n = 10/50
@@ -28,9 +34,24 @@ def main():
 	u_out = n*v_out/(n*v_out + v_in)
 	alpha= 1/2
 	
-	manifold = lambda x : (1/(n*C))*(1-u_out)*x(0) + (alpha - 1/(R*C))*x(1) - alpha*v_out
+	manifold = lambda i_L, v_C : (1/(n*C))*(1-u_out)*i_L + (alpha - 1/(R*C))*v_C - alpha*v_out
+	
+	piecewise_bifield = pws.PiecewiseBifield(vector_field_0, vector_field_1, manifold)
+	
+	min_value = (-23*P/v_out, -3*v_out)
+	max_value = (25*P/v_out, 5*v_out)
+	step = (0.001*2*P/v_out, 0.001*2*v_out)
+	
+	return (piecewise_bifield, min_value, max_value, step)
+
+def main():
+	piecewise_bifield, min_value, max_value, step = get_bridge_converter_system()
+	
+	# The fine grid does not fit in memory, it is sampled tile by tile instead
+	meshgrid_generator = pws.TiledPiecewiseBifieldMeshgridGenerator(min_value=min_value, max_value=max_value, step=step)
 	
-	pws.FilipovPlanarField(vector_field_0, vector_field_1, manifold)
+	bifield_streamplot = pws.generate_streamplot(piecewise_bifield, meshgrid_generator, stream_density=1.2)
+	pws.write_streamplot('streamplot', bifield_streamplot)
 
 if __name__ == '__main__':
 	main()
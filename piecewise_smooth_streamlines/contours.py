@@ -0,0 +1,220 @@
+import numpy as np
+
+import streamlines as streamlines
+import datastructures as struct
+import crossings as crossings
+import tiles as tiles
+
+# Marching squares
+#
+# Corners of a cell are numbered counterclockwise from the bottom left, (j, i),
+# (j, i+1), (j+1, i+1), (j+1, i), and so are its edges: bottom, right, top, left.
+# A corner is above the level when its value is greater than the level. Segments
+# are oriented with the region above the level on their left, so that the segments
+# of neighbouring cells chain through the identifiers of the edges they share.
+
+def _get_cell_segment_table():
+	# table[center_above, case, slot] = (edge of segment start, edge of segment end)
+	table = np.full((2, 16, 2, 2), -1, dtype=np.int64)
+	
+	for case in range(16):
+		above = [(case >> corner) & 1 for corner in range(4)]
+		# Going counterclockwise, an edge is left when going from above to below
+		# the level and entered when going from below to above
+		exits = [edge for edge in range(4) if above[edge] and not above[(edge + 1) % 4]]
+		entries = [edge for edge in range(4) if not above[edge] and above[(edge + 1) % 4]]
+		
+		for center_above in range(2):
+			for slot, exit_edge in enumerate(exits):
+				following_entries = sorted(entries, key=lambda entry : (entry - exit_edge) % 4)
+				entry_edge = following_entries[0] if center_above or len(entries) == 1 else following_entries[-1]
+				table[center_above, case, slot] = (exit_edge, entry_edge)
+	
+	return table
+
+_CELL_SEGMENT_TABLE = _get_cell_segment_table()
+
+def _get_edge_crossings(X, Y, S, level, manifold, tolerance):
+	ny, nx = S.shape
+	
+	above = S > level
+	valid = ~np.isnan(S)
+	
+	# Horizontal edges join (j, i) to (j, i+1), vertical edges join (j, i) to (j+1, i)
+	horizontal = (above[:,:-1] != above[:,1:]) & valid[:,:-1] & valid[:,1:]
+	vertical = (above[:-1,:] != above[1:,:]) & valid[:-1,:] & valid[1:,:]
+	
+	j_h, i_h = np.nonzero(horizontal)
+	j_v, i_v = np.nonzero(vertical)
+	j_0 = np.concatenate((j_h, j_v))
+	i_0 = np.concatenate((i_h, i_v))
+	j_1 = np.concatenate((j_h, j_v + 1))
+	i_1 = np.concatenate((i_h + 1, i_v))
+	
+	P_0 = np.stack((X[j_0, i_0], Y[j_0, i_0]), axis=1)
+	P_1 = np.stack((X[j_1, i_1], Y[j_1, i_1]), axis=1)
+	S_0 = S[j_0, i_0] - level
+	S_1 = S[j_1, i_1] - level
+	
+	if manifold is None:
+		t = S_0 / (S_0 - S_1)
+		points = P_0 + t[:,np.newaxis] * (P_1 - P_0)
+	else:
+		# Sub-cell refinement against the analytic manifold
+		def level_manifold(x, y):
+			return manifold(x, y) - level
+		points = crossings.get_crossing_points(level_manifold, P_0, P_1, S_0, S_1, tolerance)
+	
+	# Identifiers of the crossed edges, in increasing order, and their crossing points
+	n_horizontal = ny * (nx - 1)
+	edge_ids = np.concatenate((j_h * (nx - 1) + i_h, n_horizontal + j_v * nx + i_v))
+	
+	return (edge_ids, points)
+
+def _get_cell_segments(S, level):
+	ny, nx = S.shape
+	above = S > level
+	valid = ~np.isnan(S)
+	
+	# Only the cells with corners on both sides of the level are classified
+	a = above[:-1,:-1]
+	b = above[:-1,1:]
+	c = above[1:,1:]
+	d = above[1:,:-1]
+	crossed = ((a != b) | (b != c) | (c != d)) & valid[:-1,:-1] & valid[:-1,1:] & valid[1:,1:] & valid[1:,:-1]
+	j, i = np.nonzero(crossed)
+	
+	corner_above = np.stack((a[j, i], b[j, i], c[j, i], d[j, i])).astype(np.int64)
+	case = corner_above[0] + 2*corner_above[1] + 4*corner_above[2] + 8*corner_above[3]
+	corners = np.stack((S[j, i], S[j, i+1], S[j+1, i+1], S[j+1, i]))
+	center_above = (np.mean(corners, axis=0) > level).astype(np.int64)
+	
+	# Identifiers of the bottom, right, top and left edges of every cell
+	n_horizontal = ny * (nx - 1)
+	cell_edge_ids = np.stack((
+		j * (nx - 1) + i,
+		n_horizontal + j * nx + i + 1,
+		(j + 1) * (nx - 1) + i,
+		n_horizontal + j * nx + i
+	), axis=1)
+	
+	start_ids = []
+	end_ids = []
+	for slot in range(2):
+		start_edge, end_edge = _CELL_SEGMENT_TABLE[center_above, case, slot].T
+		has_segment = start_edge >= 0
+		cells = np.flatnonzero(has_segment)
+		start_ids.append(cell_edge_ids[cells, start_edge[has_segment]])
+		end_ids.append(cell_edge_ids[cells, end_edge[has_segment]])
+	
+	return (np.concatenate(start_ids), np.concatenate(end_ids))
+
+# Converts the edge identifiers of a block of nodes starting at node (j_0, i_0) to
+# the identifiers of the same edges in the whole grid
+def _get_grid_edge_ids(block_edge_ids, block_shape, j_0, i_0, grid_shape):
+	block_ny, block_nx = block_shape
+	ny, nx = grid_shape
+	
+	block_n_horizontal = block_ny * (block_nx - 1)
+	horizontal = block_edge_ids < block_n_horizontal
+	vertical_ids = block_edge_ids - block_n_horizontal
+	
+	j = np.where(horizontal, block_edge_ids // (block_nx - 1), vertical_ids // block_nx) + j_0
+	i = np.where(horizontal, block_edge_ids % (block_nx - 1), vertical_ids % block_nx) + i_0
+	
+	return np.where(horizontal, j * (nx - 1) + i, ny * (nx - 1) + j * nx + i)
+
+def _get_block_segments(X, Y, S, level, manifold, tolerance, j_0, i_0, grid_shape):
+	edge_ids, edge_points = _get_edge_crossings(X, Y, S, level, manifold, tolerance)
+	start_ids, end_ids = _get_cell_segments(S, level)
+	
+	segments = np.stack((edge_points[np.searchsorted(edge_ids, start_ids)], edge_points[np.searchsorted(edge_ids, end_ids)]), axis=1)
+	start_ids = _get_grid_edge_ids(start_ids, S.shape, j_0, i_0, grid_shape)
+	end_ids = _get_grid_edge_ids(end_ids, S.shape, j_0, i_0, grid_shape)
+	
+	return (segments, start_ids, end_ids)
+
+# Blocks of nodes covering the cells of the grid; the blocks of tiled arrays follow
+# their tiles and overlap by a row and a column of nodes, so that every cell
+# belongs to exactly one block
+def _get_blocks(S):
+	ny, nx = S.shape
+	if not isinstance(S, tiles.TiledArray):
+		yield (0, ny, 0, nx)
+		return
+	
+	for j_0, j_1, i_0, i_1 in tiles.get_tile_bounds(S):
+		yield (j_0, min(j_1 + 1, ny), i_0, min(i_1 + 1, nx))
+
+# Extracts the level set S = level of a sampled field on a structured grid as
+# joined polylines. When the analytic manifold is given, the crossing points on
+# the grid edges are refined against it instead of being linearly interpolated.
+# Tiled fields are contoured tile by tile, and the segments are joined through the
+# edges the tiles share. The extraction holds no global state and is safe to run
+# from several threads.
+def get_level_contour(X, Y, S, level=0.0, manifold=None, tolerance=crossings.DEFAULT_TOLERANCE):
+	X = np.asarray(X, dtype=np.float64)
+	Y = np.asarray(Y, dtype=np.float64)
+	if not isinstance(S, tiles.TiledArray):
+		S = np.asarray(S, dtype=np.float64)
+	
+	ny, nx = S.shape
+	if ny < 2 or nx < 2:
+		return struct.PolylineSet.empty()
+	
+	block_segments = []
+	for j_0, j_1, i_0, i_1 in _get_blocks(S):
+		if j_1 - j_0 < 2 or i_1 - i_0 < 2:
+			continue
+		block_segments.append(_get_block_segments(
+			X[j_0:j_1,i_0:i_1],
+			Y[j_0:j_1,i_0:i_1],
+			np.asarray(S[j_0:j_1,i_0:i_1], dtype=np.float64),
+			level, manifold, tolerance, j_0, i_0, (ny, nx)
+		))
+	
+	segments, start_ids, end_ids = [np.concatenate(parts) for parts in zip(*block_segments)]
+	if len(start_ids) == 0:
+		return struct.PolylineSet.empty()
+	
+	vertices, offsets = streamlines.chain_segments_into_polylines(segments, start_ids, end_ids)
+	
+	return struct.PolylineSet(vertices, offsets)
+
+def get_switching_manifold_contour(piecewiseBifieldMeshgrid, manifold=None, tolerance=crossings.DEFAULT_TOLERANCE):
+	return get_level_contour(
+		piecewiseBifieldMeshgrid.X,
+		piecewiseBifieldMeshgrid.Y,
+		piecewiseBifieldMeshgrid.S,
+		0.0, manifold, tolerance
+	)
+
+def test():
+	circle = lambda x, y : 1 - x**2 - y**2
+	two_circles = lambda x, y : np.maximum(0.25 - (x + 1)**2 - y**2, 0.25 - (x - 1)**2 - y**2)
+	x = np.linspace(-2, 2, 81)
+	y = np.linspace(-1.5, 1.5, 61)
+	X, Y = np.meshgrid(x, y)
+	
+	test_results = []
+	for manifold, line_count in [(circle, 1), (two_circles, 2)]:
+		contour = get_level_contour(X, Y, manifold(X, Y), manifold=manifold)
+		lines = list(contour)
+		test_results.append(len(lines) == line_count)
+		test_results.append(all(np.array_equal(line[0], line[-1]) for line in lines))
+		test_results.append(bool(np.all(np.abs(manifold(contour.vertices[:,0], contour.vertices[:,1])) <= 1e-10)))
+		
+		# Tiles are joined through the edges they share
+		S = tiles.sample_tiled(lambda X, Y : (manifold(X, Y),), x, y, tile_shape=(16, 16))[0]
+		tiled_contour = get_level_contour(X, Y, S, manifold=manifold)
+		test_results.append(len(tiled_contour) == line_count and tiled_contour.vertex_count() == contour.vertex_count())
+	
+	# The linearly interpolated circle is inside the circle through the nodes
+	contour = get_level_contour(X, Y, circle(X, Y))
+	radii = np.hypot(contour.vertices[:,0], contour.vertices[:,1])
+	test_results.append(bool(np.all((radii <= 1) & (radii > 0.99))))
+	
+	return all(test_results)
+
+if __name__ == '__main__':
+	print(test())
@@ -0,0 +1,126 @@
+import numpy as np
+
+DEFAULT_TOLERANCE = 1e-12
+DEFAULT_MAX_ITERATIONS = 64
+
+# Evaluates manifold(x, y) over arrays of points in a single call; returns None
+# for manifolds that do not accept NumPy arrays
+def try_evaluate_manifold(manifold, X, Y):
+	X = np.asarray(X, dtype=np.float64)
+	Y = np.asarray(Y, dtype=np.float64)
+	
+	try:
+		S = np.asarray(manifold(X, Y), dtype=np.float64)
+	except (TypeError, ValueError):
+		return None
+	
+	if S.shape == X.shape:
+		return S
+	elif S.ndim == 0:
+		return np.full(X.shape, S)
+	else:
+		return None
+
+# Evaluates manifold(x, y) over arrays of points; manifolds that do not accept
+# NumPy arrays are evaluated point by point
+def evaluate_manifold(manifold, X, Y):
+	S = try_evaluate_manifold(manifold, X, Y)
+	if S is not None:
+		return S
+	
+	X = np.asarray(X, dtype=np.float64)
+	Y = np.asarray(Y, dtype=np.float64)
+	S = [manifold(x, y) for x, y in zip(X.ravel().tolist(), Y.ravel().tolist())]
+	return np.asarray(S, dtype=np.float64).reshape(X.shape)
+
+# Solves manifold(x_0 + t*(x_1 - x_0)) = 0 for t in [0, 1] on every row of X_0, X_1,
+# assuming that the manifold changes sign between the two points. The Illinois
+# variant of regula falsi is used, which is exact after the first step for affine
+# manifolds and never leaves the bracketing interval.
+def get_crossing_parameters(manifold, X_0, X_1, S_0=None, S_1=None,
+		tolerance=DEFAULT_TOLERANCE, max_iterations=DEFAULT_MAX_ITERATIONS):
+	X_0 = np.asarray(X_0, dtype=np.float64).reshape(-1, 2)
+	X_1 = np.asarray(X_1, dtype=np.float64).reshape(-1, 2)
+	dX = X_1 - X_0
+	
+	if S_0 is None:
+		S_0 = evaluate_manifold(manifold, X_0[:,0], X_0[:,1])
+	if S_1 is None:
+		S_1 = evaluate_manifold(manifold, X_1[:,0], X_1[:,1])
+	
+	a = np.zeros(len(X_0))
+	b = np.ones(len(X_0))
+	f_a = np.array(S_0, dtype=np.float64)
+	f_b = np.array(S_1, dtype=np.float64)
+	# Side of the bracket replaced in the last iteration
+	side = np.zeros(len(X_0), dtype=np.int8)
+	
+	scale = np.maximum(np.abs(f_a), np.abs(f_b))
+	t = np.full(len(X_0), 0.5)
+	active = f_a != f_b
+	
+	for _ in range(max_iterations):
+		if not active.any():
+			break
+		
+		idx = np.flatnonzero(active)
+		t_idx = (a[idx] * f_b[idx] - b[idx] * f_a[idx]) / (f_b[idx] - f_a[idx])
+		t_idx = np.clip(t_idx, a[idx], b[idx])
+		t[idx] = t_idx
+		
+		x = X_0[idx] + t_idx[:,np.newaxis] * dX[idx]
+		f_t = evaluate_manifold(manifold, x[:,0], x[:,1])
+		
+		converged = (np.abs(f_t) <= tolerance * scale[idx]) | (b[idx] - a[idx] <= tolerance)
+		
+		replace_b = ~converged & (np.sign(f_t) == np.sign(f_b[idx]))
+		replace_a = ~converged & ~replace_b
+		
+		idx_b = idx[replace_b]
+		b[idx_b] = t_idx[replace_b]
+		f_b[idx_b] = f_t[replace_b]
+		f_a[idx_b[side[idx_b] == -1]] *= 0.5
+		side[idx_b] = -1
+		
+		idx_a = idx[replace_a]
+		a[idx_a] = t_idx[replace_a]
+		f_a[idx_a] = f_t[replace_a]
+		f_b[idx_a[side[idx_a] == 1]] *= 0.5
+		side[idx_a] = 1
+		
+		active[idx[converged]] = False
+	
+	return t
+
+def get_crossing_points(manifold, X_0, X_1, S_0=None, S_1=None,
+		tolerance=DEFAULT_TOLERANCE, max_iterations=DEFAULT_MAX_ITERATIONS):
+	X_0 = np.asarray(X_0, dtype=np.float64).reshape(-1, 2)
+	X_1 = np.asarray(X_1, dtype=np.float64).reshape(-1, 2)
+	
+	t = get_crossing_parameters(manifold, X_0, X_1, S_0, S_1, tolerance, max_iterations)
+	
+	return X_0 + t[:,np.newaxis] * (X_1 - X_0)
+
+def test():
+	circle = lambda x, y : x**2 + y**2 - 1
+	X_0 = np.array([[0.0, 0.0], [0.0, 0.0], [0.2, -0.3], [2.0, 2.0]])
+	X_1 = np.array([[2.0, 0.0], [1.0, 1.0], [-1.5, 1.5], [0.1, 0.0]])
+	t = get_crossing_parameters(circle, X_0, X_1)
+	X = get_crossing_points(circle, X_0, X_1)
+	
+	test_results = []
+	test_results.append(bool(np.all((t >= 0) & (t <= 1))))
+	test_results.append(bool(np.all(np.abs(circle(X[:,0], X[:,1])) <= 1e-10)))
+	test_results.append(np.isclose(t[0], 0.5) and np.isclose(t[1], np.sqrt(0.5)))
+	
+	# Affine manifolds are exact after the first step, and manifolds taking
+	# scalars only are evaluated point by point
+	line = lambda x, y : float(2*x - y - 0.5)
+	t = get_crossing_parameters(line, X_0, X_1, max_iterations=1)
+	X = X_0 + t[:,np.newaxis] * (X_1 - X_0)
+	test_results.append(bool(np.all(np.abs(2*X[:,0] - X[:,1] - 0.5) <= 1e-12)))
+	
+	return all(test_results)
+
+if __name__ == '__main__':
+	print(test())
@@ -1,3 +1,5 @@
+import numpy as np
+
 class _Node:
 	def __init__(self, data, prev, next):
 		self.data = data
@@ -100,6 +102,83 @@ class Dequeue:
 			self.pop_back()
 		return ls
 
+class PolylineSet:
+	def __init__(self, vertices, offsets):
+		self.vertices = np.asarray(vertices, dtype=np.float64).reshape(-1, 2)
+		self.offsets = np.asarray(offsets, dtype=np.int64)
+	
+	@staticmethod
+	def empty():
+		return PolylineSet(np.empty((0, 2)), np.zeros(1, dtype=np.int64))
+	
+	@staticmethod
+	def from_lines(lines):
+		if isinstance(lines, PolylineSet):
+			return lines
+		
+		lines = [np.asarray(line, dtype=np.float64).reshape(-1, 2) for line in lines]
+		if not lines:
+			return PolylineSet.empty()
+		
+		offsets = np.zeros(len(lines) + 1, dtype=np.int64)
+		np.cumsum([len(line) for line in lines], out=offsets[1:])
+		
+		return PolylineSet(np.concatenate(lines), offsets)
+	
+	@staticmethod
+	def concatenate(polyline_sets):
+		polyline_sets = [PolylineSet.from_lines(polyline_set) for polyline_set in polyline_sets]
+		if not polyline_sets:
+			return PolylineSet.empty()
+		
+		vertices = np.concatenate([polyline_set.vertices for polyline_set in polyline_sets])
+		vertex_counts = np.cumsum([0] + [len(polyline_set.vertices) for polyline_set in polyline_sets])
+		offsets = np.concatenate(
+			[[0]] + [polyline_set.offsets[1:] - polyline_set.offsets[0] + vertex_count
+				for polyline_set, vertex_count in zip(polyline_sets, vertex_counts)]
+		)
+		
+		return PolylineSet(vertices, offsets)
+	
+	def __len__(self):
+		return len(self.offsets) - 1
+	
+	def __iter__(self):
+		vertices = self.vertices
+		offsets = self.offsets.tolist()
+		for begin, end in zip(offsets[:-1], offsets[1:]):
+			yield vertices[begin:end]
+	
+	def __getitem__(self, key):
+		if isinstance(key, slice):
+			start, stop, step = key.indices(len(self))
+			if step != 1:
+				return PolylineSet.from_lines([self[idx] for idx in range(start, stop, step)])
+			stop = max(start, stop)
+			
+			offsets = self.offsets[start:stop + 1]
+			vertices = self.vertices[offsets[0]:offsets[-1]]
+			return PolylineSet(vertices, offsets - offsets[0])
+		
+		n = len(self)
+		if key < -n or key >= n:
+			raise IndexError(f"Polyline index {key} out of range for {n} polylines")
+		key = key % n
+		
+		return self.vertices[self.offsets[key]:self.offsets[key + 1]]
+	
+	def __add__(self, other):
+		return PolylineSet.concatenate([self, other])
+	
+	def line_sizes(self):
+		return np.diff(self.offsets)
+	
+	def vertex_count(self):
+		return len(self.vertices)
+	
+	def nbytes(self):
+		return self.vertices.nbytes + self.offsets.nbytes
+
 def main():
 	test_results = []
 	
@@ -122,6 +201,16 @@ def main():
 	dequeue.push_front(1)
 	dequeue.push_back(2)
 	test_results.append(dequeue.front() == 1 and dequeue.back() == 2)
+	
+	polylines = PolylineSet.from_lines([[[0.0, 0.0], [1.0, 0.0]], [[0.0, 1.0], [1.0, 1.0], [2.0, 1.0]]])
+	test_results.append(len(polylines) == 2 and polylines.vertex_count() == 5)
+	test_results.append(np.array_equal(polylines[-1][:,0], [0.0, 1.0, 2.0]))
+	
+	polylines = polylines + polylines[1:]
+	test_results.append(np.array_equal(polylines.offsets, [0, 2, 5, 8]))
+	test_results.append([len(line) for line in polylines] == [2, 3, 3])
+	
+	return all(test_results)
 
 if __name__ == '__main__':
 	import unittest
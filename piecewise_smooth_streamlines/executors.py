@@ -0,0 +1,192 @@
+import concurrent.futures
+import multiprocessing
+import itertools
+import math
+import os
+
+class UnknownExecutor(Exception):
+	def __init__(self, unknown_executor, *args):
+		super().__init__(*args)
+		self.unknown_executor = unknown_executor
+	
+	def __str__(self):
+		return f"The executor {self.unknown_executor} is not one of 'serial', 'threads' or 'processes'"
+
+# Functions mapped by forked worker processes; closures and lambdas cannot be
+# pickled, so the workers inherit them from the parent process instead. Every map
+# registers its function under a key of its own, so that concurrent maps of the
+# same function do not remove each other's
+_forked_functions = {}
+_forked_function_keys = itertools.count()
+
+# Processes can only run the closures mapped by the callers when they are forked;
+# where they cannot be, processes are replaced by threads
+def _can_fork():
+	return 'fork' in multiprocessing.get_all_start_methods()
+
+def _resolve_executor(executor):
+	if executor not in ['serial', 'threads', 'processes']:
+		raise UnknownExecutor(executor)
+	if executor == 'processes' and not _can_fork():
+		return 'threads'
+	
+	return executor
+
+def _register_forked_function(function):
+	function_key = next(_forked_function_keys)
+	_forked_functions[function_key] = function
+	
+	return function_key
+
+def _apply_to_chunk(function, chunk):
+	return [function(item) for item in chunk]
+
+def _apply_forked_function_to_chunk(function_key, chunk):
+	return _apply_to_chunk(_forked_functions[function_key], chunk)
+
+def _split_in_chunks(items, workers, chunk_size):
+	if chunk_size is None:
+		chunk_size = max(1, math.ceil(len(items) / (4 * workers)))
+	
+	return [items[begin:begin + chunk_size] for begin in range(0, len(items), chunk_size)]
+
+# Workers worth starting for the items: a single worker, or a single item, gains
+# nothing from a pool, and processes only pay for forking and pickling when there
+# is more than one core to run them
+def _get_worker_count(executor, items, workers):
+	if executor == 'serial':
+		return 1
+	if workers is None:
+		workers = os.cpu_count() or 1
+	if executor == 'processes':
+		workers = min(workers, os.cpu_count() or 1)
+	
+	return max(1, min(workers, len(items)))
+
+def _map_chunks_in_processes(function, chunks, workers):
+	function_key = _register_forked_function(function)
+	try:
+		context = multiprocessing.get_context('fork')
+		with concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+			return list(pool.map(_apply_forked_function_to_chunk, [function_key]*len(chunks), chunks))
+	finally:
+		_forked_functions.pop(function_key)
+
+def _map_chunks_in_threads(function, chunks, workers):
+	with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+		return list(pool.map(_apply_to_chunk, [function]*len(chunks), chunks))
+
+# Applies function to every item and returns the results in the order of the items,
+# whatever the executor; items are dispatched to the workers in chunks, or mapped
+# serially when a single worker would run them
+def map_ordered(function, items, executor='serial', workers=None, chunk_size=None):
+	items = list(items)
+	executor = _resolve_executor(executor)
+	
+	workers = _get_worker_count(executor, items, workers)
+	if workers == 1:
+		return [function(item) for item in items]
+	
+	chunks = _split_in_chunks(items, workers, chunk_size)
+	if not chunks:
+		return []
+	
+	if executor == 'threads':
+		chunk_results = _map_chunks_in_threads(function, chunks, workers)
+	else:
+		chunk_results = _map_chunks_in_processes(function, chunks, workers)
+	
+	return [result for chunk_result in chunk_results for result in chunk_result]
+
+def _apply_forked_function(function_key, item):
+	return _forked_functions[function_key](item)
+
+def _yield_as_completed(pool, futures):
+	with pool:
+		for future in concurrent.futures.as_completed(futures):
+			yield (futures[future], future.result())
+
+def _yield_in_order(function, items):
+	for index, item in enumerate(items):
+		yield (index, function(item))
+
+def _yield_forked_as_completed(function, items, workers):
+	function_key = _register_forked_function(function)
+	try:
+		context = multiprocessing.get_context('fork')
+		pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers, mp_context=context)
+		futures = {pool.submit(_apply_forked_function, function_key, item) : index for index, item in enumerate(items)}
+		yield from _yield_as_completed(pool, futures)
+	finally:
+		_forked_functions.pop(function_key)
+
+# Applies function to every item and yields the pairs (index of the item, result)
+# as the results become ready, so that they can be consumed before every item is
+# done; items are dispatched to the workers one by one
+def map_as_completed(function, items, executor='serial', workers=None):
+	items = list(items)
+	executor = _resolve_executor(executor)
+	
+	workers = _get_worker_count(executor, items, workers)
+	if workers == 1:
+		return _yield_in_order(function, items)
+	
+	if executor == 'processes':
+		return _yield_forked_as_completed(function, items, workers)
+	
+	pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+	futures = {pool.submit(function, item) : index for index, item in enumerate(items)}
+	
+	return _yield_as_completed(pool, futures)
+
+def _test_function(item):
+	return (item * 7919) % 23
+
+def test():
+	global _can_fork
+	
+	items = list(range(23))
+	expected = [_test_function(item) for item in items]
+	
+	test_results = []
+	for executor in ['serial', 'threads', 'processes']:
+		test_results.append(map_ordered(_test_function, items, executor, workers=3) == expected)
+		test_results.append(map_ordered(_test_function, items, executor, workers=3, chunk_size=5) == expected)
+		test_results.append(sorted(map_as_completed(_test_function, items, executor, workers=3)) == list(enumerate(expected)))
+	
+	# The pools themselves, which single core machines map serially
+	chunks = _split_in_chunks(items, 3, None)
+	test_results.append([result for chunk in _map_chunks_in_threads(_test_function, chunks, 3) for result in chunk] == expected)
+	if _can_fork():
+		test_results.append([result for chunk in _map_chunks_in_processes(_test_function, chunks, 3) for result in chunk] == expected)
+		test_results.append(sorted(_yield_forked_as_completed(lambda item : _test_function(item), items, 3)) == list(enumerate(expected)))
+		
+		# Maps of the same function run within one another keep keys of their own
+		function = lambda item : _test_function(item)
+		as_completed = _yield_forked_as_completed(function, items, 3)
+		first = next(as_completed)
+		chunk_results = _map_chunks_in_processes(function, chunks, 3)
+		test_results.append(sorted([first, *as_completed]) == list(enumerate(expected)))
+		test_results.append([result for chunk in chunk_results for result in chunk] == expected)
+		test_results.append(_forked_functions == {})
+	
+	# Where processes cannot be forked, closures are mapped on threads
+	can_fork = _can_fork
+	_can_fork = lambda : False
+	try:
+		offset = len(items)
+		closure = lambda item : _test_function(item + offset)
+		expected_closure = [_test_function(item + offset) for item in items]
+		test_results.append(map_ordered(closure, items, 'processes', workers=3) == expected_closure)
+		test_results.append(sorted(map_as_completed(closure, items, 'processes', workers=3)) == list(enumerate(expected_closure)))
+	finally:
+		_can_fork = can_fork
+	
+	test_results.append(_get_worker_count('processes', items, 64) <= (os.cpu_count() or 1))
+	test_results.append(_get_worker_count('threads', items[:1], 8) == 1)
+	test_results.append(_get_worker_count('serial', items, 8) == 1)
+	
+	return all(test_results)
+
+if __name__ == '__main__':
+	print(test())
@@ -0,0 +1,155 @@
+import numpy as np
+
+import datastructures as struct
+import streamlines as streamlines
+import crossings as crossings
+import sliding as sliding
+
+# Hybrid integration
+#
+# Orbits of the piecewise smooth system are integrated directly: every trajectory
+# follows only the field active on its side of the switching manifold, field 0
+# where the manifold is positive and field 1 where it is negative. When a step
+# crosses the manifold the crossing is located on the step, and the trajectory
+# continues from it in the other field if that field leaves the manifold; when it
+# does not the trajectory has reached a sliding region and stops there.
+#
+# All trajectories advance together as a batch of the streamlines module.
+
+# Trajectories are integrated with field 0 on the side where the manifold is positive
+def get_active_fields(S):
+	return np.where(S >= 0, 0, 1).astype(np.int8)
+
+def _evaluate_active_fields(vector_fields, points, fields):
+	F = np.empty(points.shape)
+	for field, vector_field in enumerate(vector_fields):
+		on_field = fields == field
+		if np.any(on_field):
+			F[on_field] = sliding.evaluate_vector_field(vector_field, points[on_field])
+	
+	return F
+
+def _get_manifold_gradients(manifold, points, h):
+	offsets = [np.array([h, 0.0]), np.array([0.0, h])]
+	gradient = [
+		(crossings.evaluate_manifold(manifold, *(points + offset).T) - crossings.evaluate_manifold(manifold, *(points - offset).T)) / (2*h)
+		for offset in offsets
+	]
+	
+	return np.stack(gradient, axis=1)
+
+# Whether the trajectories leave the manifold to the side of their new active field
+def _leaves_manifold(vector_fields, manifold, points, new_fields, time_directions, h):
+	F = _evaluate_active_fields(vector_fields, points, new_fields)
+	normal_flow = time_directions * np.sum(_get_manifold_gradients(manifold, points, h) * F, axis=1)
+	
+	return np.where(new_fields == 0, normal_flow > 0, normal_flow < 0)
+
+# Integrates the orbits through the start points within the box [min_value, max_value]
+# with streamlines.integrate_trajectory_batch. Returns the orbits and, for every
+# vertex, the field of the segment starting at it, -1 at the last vertex of an orbit.
+def integrate_orbits(vector_field_0, vector_field_1, manifold, start_points, min_value, max_value,
+		integration_direction='both', tolerance=crossings.DEFAULT_TOLERANCE, **kwargs):
+	vector_fields = (vector_field_0, vector_field_1)
+	gradient_step = 1e-7 * np.max(np.asarray(max_value, dtype=np.float64) - np.asarray(min_value, dtype=np.float64))
+	
+	start_points = np.asarray(start_points, dtype=np.float64).reshape(-1, 2)
+	start_point_of_trajectory, time_direction = streamlines.get_batch_layout(len(start_points), integration_direction)
+	
+	# Manifold values at the current points of the trajectories and active fields
+	x = start_points[start_point_of_trajectory]
+	S = crossings.evaluate_manifold(manifold, x[:,0], x[:,1])
+	field = get_active_fields(S)
+	
+	def get_velocities(points, trajectories):
+		return _evaluate_active_fields(vector_fields, points, field[trajectories])
+	
+	def get_labels(trajectories):
+		return field[trajectories]
+	
+	def end_steps(trajectories, x_0, x_1):
+		S_0 = S[trajectories]
+		S_1 = crossings.evaluate_manifold(manifold, x_1[:,0], x_1[:,1])
+		crossed = np.where(field[trajectories] == 0, S_1 < 0, S_1 > 0)
+		
+		t = np.ones(len(trajectories))
+		ends = np.zeros(len(trajectories), dtype=bool)
+		S[trajectories] = S_1
+		if not np.any(crossed):
+			return (t, ends)
+		
+		c = trajectories[crossed]
+		t[crossed] = crossings.get_crossing_parameters(manifold, x_0[crossed], x_1[crossed], S_0[crossed], S_1[crossed], tolerance)
+		x_c = x_0[crossed] + t[crossed,np.newaxis] * (x_1[crossed] - x_0[crossed])
+		S[c] = 0.0
+		
+		# Crossings continue in the other field when it leaves the manifold; a
+		# crossing without progress is a tangency, where the orbit stops
+		new_field = (1 - field[c]).astype(np.int8)
+		continues = _leaves_manifold(vector_fields, manifold, x_c, new_field, time_direction[c], gradient_step)
+		continues &= t[crossed] > 0
+		field[c[continues]] = new_field[continues]
+		ends[crossed] = ~continues
+		
+		return (t, ends)
+	
+	orbits, segment_fields = streamlines.integrate_trajectory_batch(
+		get_velocities, start_points, min_value, max_value,
+		integration_direction=integration_direction,
+		end_steps=end_steps, get_labels=get_labels,
+		**kwargs
+	)
+	
+	return (orbits, segment_fields.astype(np.int8))
+
+# Splits orbits into the lines integrated with either field; the points where an
+# orbit crosses the manifold end a line of one field and start a line of the other
+def split_orbits(orbits, segment_fields):
+	orbits = struct.PolylineSet.from_lines(orbits)
+	vertices = orbits.vertices
+	split_lines = []
+	
+	for field in range(2):
+		on_field = segment_fields == field
+		edges = np.diff(np.concatenate(([False], on_field, [False])).astype(np.int8))
+		begin = np.flatnonzero(edges > 0)
+		end = np.flatnonzero(edges < 0)
+		
+		# Runs of segments hold their end point too
+		offsets = np.zeros(len(begin) + 1, dtype=np.int64)
+		np.cumsum(end - begin + 1, out=offsets[1:])
+		run_of_vertex = np.repeat(np.arange(len(begin)), end - begin + 1)
+		vertex = begin[run_of_vertex] + np.arange(offsets[-1]) - offsets[:-1][run_of_vertex]
+		
+		split_lines.append(struct.PolylineSet(vertices[vertex], offsets))
+	
+	return tuple(split_lines)
+
+def test():
+	import piecewise_smooth_field as pws
+	
+	piecewise_bifield, min_value, max_value, step = pws.get_buck_converter_system()
+	manifold = piecewise_bifield.manifold
+	start_points = np.stack(np.meshgrid(np.linspace(0.25, 9.75, 20), np.linspace(2, 73, 20)), axis=-1).reshape(-1, 2)
+	orbits, segment_fields = piecewise_bifield.integrate_orbits(start_points, min_value, max_value)
+	lines = split_orbits(orbits, segment_fields)
+	tolerance = 1e-9 * np.max(np.abs(np.subtract(max_value, min_value)))
+	
+	test_results = []
+	test_results.append(np.array_equal(get_active_fields(np.array([1.0, 0.0, -1.0])), [0, 0, 1]))
+	
+	# No line leaves the side of its field
+	for field, field_lines in enumerate(lines):
+		S = crossings.evaluate_manifold(manifold, field_lines.vertices[:,0], field_lines.vertices[:,1])
+		test_results.append(len(field_lines) > 0 and bool(np.all(S >= -tolerance) if field == 0 else np.all(S <= tolerance)))
+	
+	# Orbits change fields on the manifold, and only there
+	switches = np.flatnonzero((segment_fields[:-1] != segment_fields[1:]) & (segment_fields[:-1] >= 0) & (segment_fields[1:] >= 0)) + 1
+	switch_points = orbits.vertices[switches]
+	test_results.append(len(switches) > 0)
+	test_results.append(bool(np.all(np.abs(crossings.evaluate_manifold(manifold, switch_points[:,0], switch_points[:,1])) <= tolerance)))
+	
+	return all(test_results)
+
+if __name__ == '__main__':
+	print(test())
@@ -1,18 +1,26 @@
 import numpy as np
 import abc
 
-import matplotlib.pyplot as plt
-from scipy.optimize import fsolve
-
 from functools import reduce
 # See: tail_recursive
 
 import math
+import os
+import json
+import hashlib
+import copy
+import functools
+import types
 
 import streamlines as streamlines
 import datastructures as struct
-
-# See: https://stackoverflow.com/questions/5666056/matplotlib-extracting-data-from-contour-lines
+import executors as executors
+import crossings as crossings
+import contours as contours
+import tiles as tiles
+import sliding as sliding
+import hybrid as hybrid
+import profiling as profiling
 
 class PiecewiseBifieldMeshgrid:
 	def __init__(self, X, Y, Fx_0, Fy_0, Fx_1, Fy_1, S):
@@ -54,7 +62,211 @@ class IsoPiecewiseBifieldMeshgridGenerator(PiecewiseBifieldMeshgridGenerator):
 		
 		return PiecewiseBifieldMeshgrid(X, Y, Fx_0, Fy_0, Fx_1, Fy_1, S)
 
-def _generate_extended_stream_lines(piecewiseBifieldMeshgrid, *argv, **kwargs):
+# Adaptive sampling
+#
+# The fields are evaluated on a hierarchy of lattices of the regular fine grid,
+# from a coarse lattice of stride 2**levels down to the fine grid itself. A cell
+# of a lattice is refined when the switching manifold crosses or approaches it, or
+# when bilinear interpolation over the cell misrepresents the fields. Nodes of the
+# fine grid that are never evaluated are bilinearly interpolated from the finest
+# lattice covering them, so the integrator consumes the usual regular meshgrid.
+
+def _get_lattice_indices(n, stride):
+	indices = np.arange(0, n, stride)
+	if indices[-1] != n - 1:
+		indices = np.append(indices, n - 1)
+	
+	return indices
+
+def _interpolate_lattice_axis(values, coarse_indices, fine_indices, axis):
+	if len(coarse_indices) < 2:
+		return np.take(values, np.zeros(len(fine_indices), dtype=np.int64), axis=axis)
+	
+	k = np.clip(np.searchsorted(coarse_indices, fine_indices, side='right') - 1, 0, len(coarse_indices) - 2)
+	w = (fine_indices - coarse_indices[k]) / (coarse_indices[k+1] - coarse_indices[k])
+	
+	shape = [1] * values.ndim
+	shape[axis] = len(fine_indices)
+	w = w.reshape(shape)
+	
+	interpolated = np.take(values, k+1, axis=axis)
+	lower = np.take(values, k, axis=axis)
+	interpolated -= lower
+	interpolated *= w
+	interpolated += lower
+	
+	return interpolated
+
+def _interpolate_lattice(values, coarse_lattice, fine_lattice):
+	values = _interpolate_lattice_axis(values, coarse_lattice[0], fine_lattice[0], 1)
+	return _interpolate_lattice_axis(values, coarse_lattice[1], fine_lattice[1], 2)
+
+# Values at the corners of the cells (j, i) of a lattice, or of all of its cells
+def _get_cell_corners(node_values, j=None, i=None):
+	if j is None:
+		return np.stack((node_values[:-1,:-1], node_values[:-1,1:], node_values[1:,1:], node_values[1:,:-1]))
+	
+	return np.stack((node_values[j,i], node_values[j,i+1], node_values[j+1,i+1], node_values[j+1,i]))
+
+# Cells crossed by the switching manifold, or closer to it than manifold_band times
+# the variation of S over the cell
+def _get_manifold_cells(corners, manifold_band):
+	S_min = np.min(corners, axis=0)
+	S_max = np.max(corners, axis=0)
+	
+	crossed = (S_max > 0) & (S_min <= 0)
+	near = np.min(np.abs(corners), axis=0) <= manifold_band * (S_max - S_min)
+	
+	return crossed | near
+
+# Nodes where the interpolation error of either vector field exceeds the tolerance
+# relative to the local field magnitude; the magnitude is floored so that the
+# refinement around equilibria stays bounded
+def _get_inaccurate_nodes(errors, values, scales, tolerance):
+	inaccurate = np.zeros(values.shape[1:], dtype=bool)
+	
+	for field in range(2):
+		error = np.hypot(errors[2*field], errors[2*field+1])
+		magnitude = np.hypot(values[2*field], values[2*field+1])
+		inaccurate |= error > tolerance * np.maximum(magnitude, tolerance * scales[field])
+	
+	return inaccurate
+
+# The bilinear interpolation error at the middle of a cell is about an eighth of
+# the second difference of the field over the cell
+def _get_curvature_errors(values):
+	errors = np.zeros(values.shape)
+	errors[:,1:-1,:] = np.abs(values[:,:-2,:] - 2*values[:,1:-1,:] + values[:,2:,:]) / 8
+	errors[:,:,1:-1] = np.maximum(errors[:,:,1:-1], np.abs(values[:,:,:-2] - 2*values[:,:,1:-1] + values[:,:,2:]) / 8)
+	
+	return errors
+
+def _get_cell_corner_nodes(cell_mask):
+	node_mask = np.zeros((cell_mask.shape[0] + 1, cell_mask.shape[1] + 1), dtype=bool)
+	node_mask[:-1,:-1] |= cell_mask
+	node_mask[:-1,1:] |= cell_mask
+	node_mask[1:,1:] |= cell_mask
+	node_mask[1:,:-1] |= cell_mask
+	
+	return node_mask
+
+def _get_parent_cells(coarse_indices, fine_indices):
+	return np.clip(np.searchsorted(coarse_indices, fine_indices[:-1], side='right') - 1, 0, len(coarse_indices) - 2)
+
+class AdaptivePiecewiseBifieldMeshgridGenerator(PiecewiseBifieldMeshgridGenerator):
+	def __init__(self, min_value, max_value, step, levels=4, field_tolerance=1e-3, manifold_band=1.0):
+		self.min_value = min_value
+		self.max_value = max_value
+		self.step = step
+		self.levels = levels
+		self.field_tolerance = field_tolerance
+		self.manifold_band = manifold_band
+		# Number of points where the fields were evaluated by the last call
+		self.evaluation_count = 0
+	
+	def get_piecewise_bifiled_meshgrid(self, vector_field_0, vector_field_1, switching_manifold):
+		min_value = self.min_value
+		max_value = self.max_value
+		step = self.step
+		
+		# 1D arrays
+		x = np.arange(min_value[0], max_value[0], step[0])
+		y = np.arange(min_value[1], max_value[1], step[1])
+		
+		# Meshgrid
+		X, Y = np.meshgrid(x, y)
+		
+		def evaluate(j, i):
+			x_j = X[j, i]
+			y_j = Y[j, i]
+			
+			values = [*vector_field_0(x_j, y_j), *vector_field_1(x_j, y_j), switching_manifold(x_j, y_j)]
+			return np.stack([np.broadcast_to(np.asarray(value, dtype=np.float64), x_j.shape) for value in values])
+		
+		stride = 2**self.levels
+		lattice = (_get_lattice_indices(len(y), stride), _get_lattice_indices(len(x), stride))
+		J, I = np.meshgrid(*lattice, indexing='ij')
+		
+		values = evaluate(J, I)
+		evaluated = np.zeros(X.shape, dtype=bool)
+		evaluated[J, I] = True
+		
+		scales = [np.max(np.hypot(values[2*field], values[2*field+1]), initial=0.0) for field in range(2)]
+		
+		inaccurate = _get_inaccurate_nodes(_get_curvature_errors(values), values, scales, self.field_tolerance)
+		refined = _get_manifold_cells(_get_cell_corners(values[4]), self.manifold_band)
+		refined |= np.any(_get_cell_corners(inaccurate), axis=0)
+		
+		while stride > 1:
+			stride = stride // 2
+			fine_lattice = (_get_lattice_indices(len(y), stride), _get_lattice_indices(len(x), stride))
+			
+			interpolated = _interpolate_lattice(values, lattice, fine_lattice)
+			
+			# Only the cells of refined parent cells are candidates for refinement
+			parent_y = _get_parent_cells(lattice[0], fine_lattice[0])
+			parent_x = _get_parent_cells(lattice[1], fine_lattice[1])
+			candidates = refined[np.ix_(parent_y, parent_x)]
+			
+			J, I = np.meshgrid(*fine_lattice, indexing='ij')
+			new = _get_cell_corner_nodes(candidates) & ~evaluated[J, I]
+			
+			exact = evaluate(J[new], I[new])
+			predicted = interpolated[:,new]
+			
+			values = interpolated
+			values[:,new] = exact
+			evaluated[J[new], I[new]] = True
+			
+			# The interpolation error of the children of a cell is about a quarter
+			# of the error made at their corners by interpolating over the parent
+			inaccurate = np.zeros(new.shape, dtype=bool)
+			inaccurate[new] = _get_inaccurate_nodes(np.abs(exact - predicted) / 4, exact, scales, self.field_tolerance)
+			
+			j, i = np.nonzero(candidates)
+			refined = np.zeros(candidates.shape, dtype=bool)
+			refined[j, i] = _get_manifold_cells(_get_cell_corners(values[4], j, i), self.manifold_band)
+			refined[j, i] |= np.any(_get_cell_corners(inaccurate, j, i), axis=0)
+			
+			lattice = fine_lattice
+		
+		self.evaluation_count = int(np.count_nonzero(evaluated))
+		
+		Fx_0, Fy_0, Fx_1, Fy_1, S = values
+		
+		return PiecewiseBifieldMeshgrid(X, Y, Fx_0, Fy_0, Fx_1, Fy_1, S)
+
+# Samples the fields lazily, tile by tile, as the integrators and the contouring
+# reach them. The coordinate arrays are broadcast views of the 1D arrays, and the
+# computed tiles of all fields share a store of at most max_bytes.
+class TiledPiecewiseBifieldMeshgridGenerator(PiecewiseBifieldMeshgridGenerator):
+	def __init__(self, min_value, max_value, step, tile_shape=tiles.DEFAULT_TILE_SHAPE, max_bytes=tiles.DEFAULT_MAX_BYTES):
+		self.min_value = min_value
+		self.max_value = max_value
+		self.step = step
+		self.tile_shape = tile_shape
+		self.tile_store = tiles.TileStore(max_bytes)
+	
+	def get_piecewise_bifiled_meshgrid(self, vector_field_0, vector_field_1, switching_manifold):
+		min_value = self.min_value
+		max_value = self.max_value
+		step = self.step
+		
+		# 1D arrays
+		x = np.arange(min_value[0], max_value[0], step[0])
+		y = np.arange(min_value[1], max_value[1], step[1])
+		
+		X = np.broadcast_to(x[np.newaxis,:], (len(y), len(x)))
+		Y = np.broadcast_to(y[:,np.newaxis], (len(y), len(x)))
+		
+		def fields(X, Y):
+			return [*vector_field_0(X, Y), *vector_field_1(X, Y), switching_manifold(X, Y)]
+		
+		Fx_0, Fy_0, Fx_1, Fy_1, S = tiles.sample_tiled(fields, x, y, self.tile_shape, self.tile_store)
+		
+		return PiecewiseBifieldMeshgrid(X, Y, Fx_0, Fy_0, Fx_1, Fy_1, S)
+
+def _generate_extended_stream_lines(piecewiseBifieldMeshgrid, *argv, executor='serial', workers=None, profiler=None, **kwargs):
 	X, Y = (piecewiseBifieldMeshgrid.X, piecewiseBifieldMeshgrid.Y)
 	Fx_0, Fy_0 = (piecewiseBifieldMeshgrid.Fx_0, piecewiseBifieldMeshgrid.Fy_0)
 	Fx_1, Fy_1 = (piecewiseBifieldMeshgrid.Fx_1, piecewiseBifieldMeshgrid.Fy_1)
@@ -62,8 +274,14 @@ def _generate_extended_stream_lines(piecewiseBifieldMeshgrid, *argv, **kwargs):
 	meshgrid_0 = streamlines.Meshgrid(X, Y, Fx_0, Fy_0)
 	meshgrid_1 = streamlines.Meshgrid(X, Y, Fx_1, Fy_1)
 	
-	stream_lines_0 = streamlines.generate_stream_lines(meshgrid_0, *argv, **kwargs)
-	stream_lines_1 = streamlines.generate_stream_lines(meshgrid_1, *argv, **kwargs)
+	def generate_stream_lines(meshgrid):
+		return streamlines.generate_stream_lines(meshgrid, *argv, profiler=profiler, **kwargs)
+	
+	(stream_lines_0, stream_lines_1) = executors.map_ordered(
+		generate_stream_lines,
+		[meshgrid_0, meshgrid_1],
+		executor, workers, chunk_size=1
+	)
 	
 	return (stream_lines_0, stream_lines_1)
 
@@ -82,68 +300,194 @@ def _drop_invisible_subsequence(line, u, manifold, idx):
 def _extract_visible_subsequence(line, u, manifold, idx, visible_line_section):
 	while idx < len(line) and _control_active_on_negative(line[idx], u, manifold):
 		x = line[idx]
-		visible_line_section.push_front(x)
+		visible_line_section.append(x)
 		idx = idx + 1
 	
 	return (idx, visible_line_section)
 
-def _get_crossing_point(manifold, x_0, x_1):
-	dx = x_1 - x_0
-	
-	def linear_approximation(t):
-		return x_0 + t*dx
-	
-	def parametrized_planar_manifold(t):
-		x = linear_approximation(t)
-		return manifold(x[0], x[1])
+# Crossings of the manifold by the segments from x_0 to x_1, reported to the
+# profiler as a stage of their own
+def _solve_crossings(manifold, x_0, x_1, S_0=None, S_1=None, tolerance=crossings.DEFAULT_TOLERANCE, profiler=profiling.NULL_PROFILER):
+	profiler.start_stage('crossings')
+	x_t = crossings.get_crossing_points(manifold, x_0, x_1, S_0, S_1, tolerance)
+	profiler.stop_stage('crossings', crossings=len(x_t))
 	
-	t_0 = fsolve(parametrized_planar_manifold, 0.5)
+	return x_t
+
+def _get_crossing_point(manifold, x_0, x_1, tolerance=crossings.DEFAULT_TOLERANCE, profiler=profiling.NULL_PROFILER):
+	x_t = _solve_crossings(manifold, x_0, x_1, tolerance=tolerance, profiler=profiler)
 	
-	return linear_approximation(t_0)
+	return x_t[0]
 
-def _extend_edges_to_manifold(line, manifold, begin, end, visible_line_section):
-	if visible_line_section.empty() or not(line):
+def _extend_edges_to_manifold(line, manifold, begin, end, visible_line_section, tolerance=crossings.DEFAULT_TOLERANCE, profiler=profiling.NULL_PROFILER):
+	if not(visible_line_section) or len(line) == 0:
 		return visible_line_section
-		
+	
 	if begin > 0:
 		x_0 = line[begin-1]
-		x_1 = visible_line_section.back()
-		x_t = _get_crossing_point(manifold, x_0, x_1)
-		visible_line_section.push_back(x_t)
+		x_1 = visible_line_section[0]
+		x_t = _get_crossing_point(manifold, x_0, x_1, tolerance, profiler)
+		visible_line_section.insert(0, x_t)
 	
 	if end < len(line):
-		x_0 = visible_line_section.front()
+		x_0 = visible_line_section[-1]
 		x_1 = line[end]
-		x_t = _get_crossing_point(manifold, x_0, x_1)
-		visible_line_section.push_front(x_t)
+		x_t = _get_crossing_point(manifold, x_0, x_1, tolerance, profiler)
+		visible_line_section.append(x_t)
 	
 	return visible_line_section
 
-def _extract_continuous_visible_line_segment(line, u, manifold, idx):
-	visible_line_section = struct.Dequeue()
+def _extract_continuous_visible_line_segment(line, u, manifold, idx, tolerance=crossings.DEFAULT_TOLERANCE, profiler=profiling.NULL_PROFILER):
+	visible_line_section = []
 	begin_visible = idx
 	
 	end_visible, visible_line_section = _extract_visible_subsequence(line, u, manifold, begin_visible, visible_line_section)
-	visible_line_section = _extend_edges_to_manifold(line, manifold, begin_visible, end_visible, visible_line_section)
+	visible_line_section = _extend_edges_to_manifold(line, manifold, begin_visible, end_visible, visible_line_section, tolerance, profiler)
 	idx_section_end = _drop_invisible_subsequence(line, u, manifold, end_visible)
 	
-	return (idx_section_end, visible_line_section.to_list())
+	return (idx_section_end, visible_line_section)
 
-def filter_stream_line(line, u, manifold):
+def _filter_stream_line_pointwise(line, u, manifold, tolerance=crossings.DEFAULT_TOLERANCE, profiler=profiling.NULL_PROFILER):
 	visible_line_sections = []
 	idx = 0
 	while idx < len(line):
-		idx, visible_section = _extract_continuous_visible_line_segment(line, u, manifold, idx)
+		idx, visible_section = _extract_continuous_visible_line_segment(line, u, manifold, idx, tolerance, profiler)
 		if visible_section:
 			visible_line_sections.append(visible_section)
 	
-	return visible_line_sections
+	return struct.PolylineSet.from_lines(visible_line_sections)
+
+def _get_visible_runs(visible):
+	edges = np.diff(np.concatenate(([False], visible, [False])).astype(np.int8))
+	begin = np.flatnonzero(edges > 0)
+	end = np.flatnonzero(edges < 0)
+	
+	return (begin, end)
+
+def filter_stream_line(line, u, manifold, tolerance=crossings.DEFAULT_TOLERANCE, profiler=profiling.NULL_PROFILER):
+	points = np.asarray(line, dtype=np.float64).reshape(-1, 2)
+	if len(points) == 0:
+		return struct.PolylineSet.empty()
+	
+	S = crossings.try_evaluate_manifold(manifold, points[:,0], points[:,1])
+	if S is None:
+		return _filter_stream_line_pointwise(points, u, manifold, tolerance, profiler)
+	
+	alpha = - (2*u - 1)
+	visible = alpha * S >= 0
+	begin, end = _get_visible_runs(visible)
+	
+	# Sections entering from or leaving to the invisible side are extended to the manifold
+	entering = begin > 0
+	leaving = end < len(points)
+	idx_0 = np.concatenate((begin[entering] - 1, end[leaving] - 1))
+	idx_1 = np.concatenate((begin[entering], end[leaving]))
+	edge_points = _solve_crossings(manifold, points[idx_0], points[idx_1], S[idx_0], S[idx_1], tolerance, profiler)
+	
+	run_sizes = end - begin
+	offsets = np.zeros(len(begin) + 1, dtype=np.int64)
+	np.cumsum(run_sizes + entering + leaving, out=offsets[1:])
+	
+	vertices = np.empty((offsets[-1], 2))
+	n_entering = np.count_nonzero(entering)
+	vertices[offsets[:-1][entering]] = edge_points[:n_entering]
+	vertices[offsets[1:][leaving] - 1] = edge_points[n_entering:]
+	
+	# Visible points keep their order, shifted past the entry points
+	visible_before_run = np.cumsum(run_sizes) - run_sizes
+	shift = np.repeat(offsets[:-1] + entering - visible_before_run, run_sizes)
+	vertices[np.arange(len(shift)) + shift] = points[visible]
+	
+	return struct.PolylineSet(vertices, offsets)
+
+# Keeps the sections of the extended streamlines of either field on the side of the
+# manifold where the field is active. The crossing solves are reported to the
+# profiler, when given, as the crossings stage; solves run by worker processes
+# are not reported
+def filter_stream_lines(extended_stream_lines_0, extended_stream_lines_1, manifold, executor='serial', workers=None, profiler=None):
+	profiler = profiling.get_profiler(profiler)
+	
+	def filter_with_control_inactive(line):
+		return filter_stream_line(line, 0, manifold, profiler=profiler)
+	
+	def filter_with_control_active(line):
+		return filter_stream_line(line, 1, manifold, profiler=profiler)
+	
+	def get_invisible_line_section_remover(filter_line):
+		def remove_invisible_line_section(line_list, line):
+			filtered_lines = filter_line(line)
+			line_list.append(filtered_lines)
+			return line_list
+		
+		return remove_invisible_line_section
+	
+	def get_chunk_filter(filter_line):
+		def filter_chunk(lines):
+			return struct.PolylineSet.concatenate(reduce(get_invisible_line_section_remover(filter_line), lines, []))
+		
+		return filter_chunk
+	
+	def filter_in_chunks(filter_line, lines):
+		# Chunks are reduced independently and merged back in their original order
+		n_chunks = 4 * (workers or os.cpu_count() or 1) if executor != 'serial' else 1
+		chunk_size = max(1, math.ceil(len(lines) / n_chunks))
+		chunks = [lines[begin:begin + chunk_size] for begin in range(0, len(lines), chunk_size)]
+		
+		filtered_chunks = executors.map_ordered(get_chunk_filter(filter_line), chunks, executor, workers, chunk_size=1)
+		
+		return struct.PolylineSet.concatenate(filtered_chunks)
+	
+	stream_lines_0 = filter_in_chunks(filter_with_control_inactive, extended_stream_lines_0)
+	stream_lines_1 = filter_in_chunks(filter_with_control_active, extended_stream_lines_1)
+	
+	return (stream_lines_0, stream_lines_1)
 
 class PiecewiseBifield:
 	def __init__(self, vector_field_0, vector_field_1, manifold):
 		self.vector_field_0 = vector_field_0
 		self.vector_field_1 = vector_field_1
 		self.manifold = manifold
+	
+	# Orbits through the start points, integrating only the active field on each
+	# side of the manifold; see hybrid.integrate_orbits
+	def integrate_orbits(self, start_points, min_value, max_value, **kwargs):
+		return hybrid.integrate_orbits(
+			self.vector_field_0, self.vector_field_1, self.manifold,
+			start_points, min_value, max_value,
+			**kwargs
+		)
+	
+	# Orbits split into the lines of field 0 and the lines of field 1
+	def generate_orbit_stream_lines(self, start_points, min_value, max_value, **kwargs):
+		orbits, segment_fields = self.integrate_orbits(start_points, min_value, max_value, **kwargs)
+		
+		return hybrid.split_orbits(orbits, segment_fields)
+
+def _get_line_counts(*line_sets):
+	return {
+		'lines' : sum(len(lines) for lines in line_sets),
+		'points' : sum(lines.vertex_count() for lines in line_sets)
+	}
+
+# Points of a meshgrid, measured for enabled profilers only; the shape is read
+# rather than the size, which would compute every tile of tiled meshgrids
+def _get_meshgrid_counts(piecewiseBifieldMeshgrid, profiler):
+	if not profiler.enabled:
+		return {}
+	
+	return {'points' : math.prod(piecewiseBifieldMeshgrid.S.shape)}
+
+# Samples the manifold on the grid of a meshgrid, tile by tile for tiled meshgrids
+def _sample_manifold(piecewiseBifieldMeshgrid, manifold):
+	X, Y, S = (piecewiseBifieldMeshgrid.X, piecewiseBifieldMeshgrid.Y, piecewiseBifieldMeshgrid.S)
+	if not isinstance(S, tiles.TiledArray):
+		return crossings.evaluate_manifold(manifold, X, Y)
+	
+	def fields(X, Y):
+		return [crossings.evaluate_manifold(manifold, X, Y)]
+	
+	(S,) = tiles.sample_tiled(fields, np.asarray(X[0,:]), np.asarray(Y[:,0]), S.tile_shape, S.source.store)
+	return S
 
 class PiecewiseBifieldStreamplot:
 	def __init__(self, piecewiseBifield, piecewiseBifieldMeshgridGenerator):
@@ -153,48 +497,73 @@ class PiecewiseBifieldStreamplot:
 			piecewiseBifield.manifold
 		)
 		self.piecewise_bifield = piecewiseBifield
+		# Extended streamlines by integration arguments; they depend on the fields
+		# only, and are shared with the streamplots of the same fields for other
+		# manifolds
+		self.__extended_stream_lines = {}
 	
-	def generate_stream_lines(self, *argv, **kwargs):
-		(extended_stream_lines_0, extended_stream_lines_1) = _generate_extended_stream_lines(self.piecewise_bifield_meshgrid, *argv, **kwargs)
-		
-		def filter_with_control_inactive(line):
-			return filter_stream_line(line, 0, self.piecewise_bifield.manifold)
+	def generate_extended_stream_lines(self, *argv, executor='serial', workers=None, profiler=None, **kwargs):
+		try:
+			key = get_digest(argv, kwargs)
+		except TypeError:
+			# Arguments that cannot be hashed, such as colormaps, are not memoized
+			return _generate_extended_stream_lines(
+				self.piecewise_bifield_meshgrid, *argv,
+				executor=executor, workers=workers, profiler=profiler, **kwargs
+			)
 		
-		def filter_with_control_active(line):
-			return filter_stream_line(line, 1, self.piecewise_bifield.manifold)
+		if key not in self.__extended_stream_lines:
+			self.__extended_stream_lines[key] = _generate_extended_stream_lines(
+				self.piecewise_bifield_meshgrid, *argv,
+				executor=executor, workers=workers, profiler=profiler, **kwargs
+			)
 		
-		def get_invisible_line_section_remover(filter_line):
-			def remove_invisible_line_section(line_list, line):
-				filtered_lines = filter_line(line)
-				line_list.extend(filtered_lines)
-				return line_list
-			
-			return remove_invisible_line_section
-		
-		stream_lines_0 = reduce(
-			get_invisible_line_section_remover(filter_with_control_inactive),
-			extended_stream_lines_0,
-			[]
+		return self.__extended_stream_lines[key]
+	
+	# Streamplot of the same fields for another switching manifold; only the manifold
+	# is sampled again, and the extended streamlines integrated for either streamplot
+	# serve both
+	def with_manifold(self, manifold):
+		piecewise_bifield_streamplot = copy.copy(self)
+		piecewise_bifield_streamplot.piecewise_bifield = PiecewiseBifield(
+			self.piecewise_bifield.vector_field_0,
+			self.piecewise_bifield.vector_field_1,
+			manifold
 		)
-		stream_lines_1 = reduce(
-			get_invisible_line_section_remover(filter_with_control_active),
-			extended_stream_lines_1,
-			[]
+		
+		meshgrid = self.piecewise_bifield_meshgrid
+		piecewise_bifield_streamplot.piecewise_bifield_meshgrid = PiecewiseBifieldMeshgrid(
+			meshgrid.X, meshgrid.Y,
+			meshgrid.Fx_0, meshgrid.Fy_0,
+			meshgrid.Fx_1, meshgrid.Fy_1,
+			_sample_manifold(meshgrid, manifold)
 		)
 		
-		return (stream_lines_0, stream_lines_1)
+		return piecewise_bifield_streamplot
+	
+	def generate_stream_lines(self, *argv, executor='serial', workers=None, **kwargs):
+		(extended_stream_lines_0, extended_stream_lines_1) = self.generate_extended_stream_lines(
+			*argv,
+			executor=executor, workers=workers, **kwargs
+		)
 		
+		return filter_stream_lines(
+			extended_stream_lines_0, extended_stream_lines_1,
+			self.piecewise_bifield.manifold,
+			executor, workers
+		)
+	
 	@staticmethod
 	def generate_contour_plot(X, Y, S, level, **kwargs):
-		contours = plt.contour(X, Y, S, [level], **kwargs)
-		paths = contours.collections[0].get_paths() # single 'level' present
-		
-		contour_lines = map( lambda path : path.vertices, paths)
+		contour_lines = contours.get_level_contour(X, Y, S, level, **kwargs)
 		
 		return contour_lines
 	
-	def generate_switching_manifold(self, **kwargs):
+	def generate_switching_manifold(self, refine=False, **kwargs):
 		level = 0.0
+		if refine:
+			kwargs['manifold'] = self.piecewise_bifield.manifold
+		
 		contour_lines = PiecewiseBifieldStreamplot.generate_contour_plot(
 			self.piecewise_bifield_meshgrid.X,
 			self.piecewise_bifield_meshgrid.Y,
@@ -204,17 +573,60 @@ class PiecewiseBifieldStreamplot:
 		)
 		
 		return contour_lines
+	
+	def generate_sliding_lines(self, switching_manifold):
+		return sliding.get_sliding_lines(
+			switching_manifold,
+			self.piecewise_bifield.vector_field_0,
+			self.piecewise_bifield.vector_field_1
+		)
+	
+	# Streamplot for the keywords of generate_streamplot
+	def generate_bifield_streamplot(self, *argv, executor='serial', workers=None, profiler=None, **kwargs):
+		profiler = profiling.get_profiler(profiler)
+		(stream_kwargs, arrow_kwargs, manifold_kwargs) = get_keywords(**kwargs)
+		
+		profiler.start_stage('integration')
+		extended_stream_lines = self.generate_extended_stream_lines(
+			*argv,
+			executor=executor, workers=workers, profiler=profiler,
+			**stream_kwargs
+		)
+		profiler.stop_stage('integration', **_get_line_counts(*extended_stream_lines))
+		
+		profiler.start_stage('filtering')
+		(stream_lines_0, stream_lines_1) = filter_stream_lines(
+			*extended_stream_lines,
+			self.piecewise_bifield.manifold,
+			executor, workers, profiler
+		)
+		profiler.stop_stage('filtering', **_get_line_counts(stream_lines_0, stream_lines_1))
+		
+		profiler.start_stage('contouring')
+		switching_manifold = self.generate_switching_manifold(**manifold_kwargs)
+		profiler.stop_stage('contouring', **_get_line_counts(switching_manifold))
+		
+		return assemble_bifield_streamplot(
+			self.piecewise_bifield,
+			stream_lines_0, stream_lines_1,
+			switching_manifold,
+			profiler,
+			**arrow_kwargs
+		)
 
 class BifieldStreamplot:
 	def __init__(self,
 			  streamlines_0, streamlines_1,
 			  streamarrows_0, streamarrows_1,
-			  switching_manifold):
+			  switching_manifold,
+			  streamlines_sliding=None, streamarrows_sliding=None):
 		self.streamlines_0 = streamlines_0
 		self.streamlines_1 = streamlines_1
 		self.streamarrows_0 = streamarrows_0
 		self.streamarrows_1 = streamarrows_1
 		self.switching_manifold = switching_manifold
+		self.streamlines_sliding = streamlines_sliding if streamlines_sliding is not None else struct.PolylineSet.empty()
+		self.streamarrows_sliding = streamarrows_sliding if streamarrows_sliding is not None else np.empty((0, 3, 2))
 
 class NonConformantKeyword(Exception):
 	def __init__(self, non_conformant_keyword, *args):
@@ -236,6 +648,7 @@ def get_keywords(**kwargs):
 	keywords = {**kwargs}
 	
 	stream_kwargs = {}
+	arrow_kwargs = {}
 	manifold_kwargs = {}
 	for key in keywords:
 		parts = key.split("_", 1)
@@ -247,51 +660,433 @@ def get_keywords(**kwargs):
 		
 		if target == 'stream':
 			stream_kwargs[keyword] = keywords[key]
+		elif target == 'arrow':
+			arrow_kwargs[keyword] = keywords[key]
 		elif target == 'manifold':
 			manifold_kwargs[keyword] = keywords[key]
 		else:
 			raise UnkownTarget(target)
-		
-	return (stream_kwargs, manifold_kwargs)
+	
+	return (stream_kwargs, arrow_kwargs, manifold_kwargs)
 
-def generate_streamplot(piecewiseBifield, piecewiseBifieldMeshgridGenerator, *argv, **kwargs):
+# Completes the filtered streamlines and the switching manifold of a piecewise
+# bifield with their arrows and with the sliding motion along the manifold
+def assemble_bifield_streamplot(piecewiseBifield, stream_lines_0, stream_lines_1, switching_manifold, profiler=None, **arrow_kwargs):
+	profiler = profiling.get_profiler(profiler)
+	
+	profiler.start_stage('sliding')
+	stream_lines_sliding = sliding.get_sliding_lines(
+		switching_manifold,
+		piecewiseBifield.vector_field_0,
+		piecewiseBifield.vector_field_1
+	)
+	profiler.stop_stage('sliding', lines=len(stream_lines_sliding), points=stream_lines_sliding.vertex_count())
+	
+	profiler.start_stage('arrows')
+	stream_arrows_0 = streamlines.generate_stream_arrows(stream_lines_0, **arrow_kwargs)
+	stream_arrows_1 = streamlines.generate_stream_arrows(stream_lines_1, **arrow_kwargs)
+	stream_arrows_sliding = streamlines.generate_stream_arrows(stream_lines_sliding, **arrow_kwargs)
+	profiler.stop_stage('arrows', arrows=len(stream_arrows_0) + len(stream_arrows_1) + len(stream_arrows_sliding))
+	
+	return BifieldStreamplot(
+		stream_lines_0, stream_lines_1,
+		stream_arrows_0, stream_arrows_1,
+		switching_manifold,
+		stream_lines_sliding, stream_arrows_sliding
+	)
+
+# Stages are reported to the profiler, when given; see profiling
+def generate_streamplot(piecewiseBifield, piecewiseBifieldMeshgridGenerator, *argv, executor='serial', workers=None, cache=None, profiler=None, **kwargs):
 	try:
+		profiler = profiling.get_profiler(profiler)
 		keyword_arguments = {**kwargs}
-		(stream_kwargs, manifold_kwargs) = get_keywords(**keyword_arguments)
+		# Keywords are checked before anything is computed
+		get_keywords(**keyword_arguments)
 		
+		profiler.start_stage('meshgrid')
 		piecewise_bifield_streamplot = PiecewiseBifieldStreamplot(piecewiseBifield, piecewiseBifieldMeshgridGenerator)
-		(stream_lines_0, stream_lines_1) = piecewise_bifield_streamplot.generate_stream_lines(*argv, **stream_kwargs)
+		profiler.stop_stage('meshgrid', **_get_meshgrid_counts(piecewise_bifield_streamplot.piecewise_bifield_meshgrid, profiler))
 		
-		stream_arrows_0 = streamlines.generate_stream_arrows(stream_lines_0)
-		stream_arrows_1 = streamlines.generate_stream_arrows(stream_lines_1)
+		if cache is not None:
+			profiler.start_stage('cache')
+			cache_key = cache.get_key(piecewise_bifield_streamplot.piecewise_bifield_meshgrid, *argv, **keyword_arguments)
+			cached_streamplot = cache.load(cache_key)
+			profiler.stop_stage('cache', hits=int(cached_streamplot is not None))
+			if cached_streamplot is not None:
+				return cached_streamplot
 		
-		switching_manifold = piecewise_bifield_streamplot.generate_switching_manifold(**manifold_kwargs)
+		bifield_streamplot = piecewise_bifield_streamplot.generate_bifield_streamplot(
+			*argv,
+			executor=executor, workers=workers, profiler=profiler,
+			**keyword_arguments
+		)
 		
-		return BifieldStreamplot(
-					stream_lines_0, stream_lines_1,
-					stream_arrows_0, stream_arrows_1,
-					switching_manifold
-			   )
+		if cache is not None:
+			profiler.start_stage('cache')
+			cache.store(cache_key, bifield_streamplot)
+			profiler.stop_stage('cache')
+		
+		return bifield_streamplot
 	except NonConformantKeyword as non_conformant_keyword:
 		raise non_conformant_keyword
 	except UnkownTarget as unkown_target:
 		raise unkown_target
 
-def write_streamplot(directory, bifiled_streamplot):
+def write_streamplot(directory, bifiled_streamplot, format='text', profiler=None, exist_ok=False):
 	lines = {
 			   'streamlines_0.dat' : bifiled_streamplot.streamlines_0,
 			   'streamlines_1.dat' : bifiled_streamplot.streamlines_1,
 			   'switching_manifold.dat' : bifiled_streamplot.switching_manifold,
+			   'streamlines_sliding.dat' : bifiled_streamplot.streamlines_sliding,
 		    }
 	
 	arrows = {
 				'streamarrows_0.dat' : bifiled_streamplot.streamarrows_0,
-				'streamarrows_1.dat' : bifiled_streamplot.streamarrows_1
+				'streamarrows_1.dat' : bifiled_streamplot.streamarrows_1,
+				'streamarrows_sliding.dat' : bifiled_streamplot.streamarrows_sliding
 			 }
 	
-	streamlines.write_plot_files(directory, lines, arrows)
+	streamlines.write_plot_files(directory, lines, arrows, format, profiler, exist_ok)
 
-def main():
+# Generates and writes the streamplot of generate_streamplot chunk by chunk: the
+# extended streamlines of either field are filtered, given their arrows and
+# appended to the plot files as they are integrated, so that only a chunk of
+# lines is held in memory at any time and the files fill up from the start
+def stream_streamplot(piecewiseBifield, piecewiseBifieldMeshgridGenerator, directory, *argv,
+		format='text', chunk_size=streamlines.DEFAULT_CHUNK_SIZE, **kwargs):
+	(stream_kwargs, arrow_kwargs, manifold_kwargs) = get_keywords(**kwargs)
+	
+	piecewise_bifield_streamplot = PiecewiseBifieldStreamplot(piecewiseBifield, piecewiseBifieldMeshgridGenerator)
+	meshgrid = piecewise_bifield_streamplot.piecewise_bifield_meshgrid
+	manifold = piecewiseBifield.manifold
+	
+	subsystems = [
+		(0, meshgrid.Fx_0, meshgrid.Fy_0, 'streamlines_0.dat', 'streamarrows_0.dat'),
+		(1, meshgrid.Fx_1, meshgrid.Fy_1, 'streamlines_1.dat', 'streamarrows_1.dat'),
+	]
+	
+	def generate_chunks():
+		for u, Fx, Fy, lines_name, arrows_name in subsystems:
+			for extended_stream_lines in streamlines.generate_stream_line_chunks(
+					streamlines.Meshgrid(meshgrid.X, meshgrid.Y, Fx, Fy), *argv,
+					chunk_size=chunk_size, **stream_kwargs):
+				stream_lines = struct.PolylineSet.concatenate([filter_stream_line(line, u, manifold) for line in extended_stream_lines])
+				stream_arrows = streamlines.generate_stream_arrows(stream_lines, **arrow_kwargs)
+				yield ({lines_name : stream_lines}, {arrows_name : stream_arrows})
+		
+		switching_manifold = piecewise_bifield_streamplot.generate_switching_manifold(**manifold_kwargs)
+		stream_lines_sliding = piecewise_bifield_streamplot.generate_sliding_lines(switching_manifold)
+		stream_arrows_sliding = streamlines.generate_stream_arrows(stream_lines_sliding, **arrow_kwargs)
+		yield (
+			{'switching_manifold.dat' : switching_manifold, 'streamlines_sliding.dat' : stream_lines_sliding},
+			{'streamarrows_sliding.dat' : stream_arrows_sliding}
+		)
+	
+	streamlines.write_plot_file_chunks(directory, generate_chunks(), format)
+
+# Streamplot archives
+#
+# A single file holding every set of a BifieldStreamplot as raw little-endian
+# blocks, so that it can be memory mapped: an 8 byte magic string, the length of
+# the JSON header index as a little-endian uint64, the header itself and then the
+# blocks, each aligned to _ARCHIVE_ALIGNMENT bytes. Line sets are stored as a
+# float64 (M, 2) vertex block and an int64 offsets block, arrow sets as a float64
+# (K, 3, 2) block.
+
+_ARCHIVE_MAGIC = b'PWSARCH1'
+_ARCHIVE_ALIGNMENT = 64
+
+class InvalidArchive(Exception):
+	def __init__(self, filename, *args):
+		super().__init__(*args)
+		self.filename = filename
+	
+	def __str__(self):
+		return f"The file {self.filename} is not a streamplot archive"
+
+def _get_archive_sets(bifiled_streamplot):
+	lines = {
+			   'streamlines_0' : bifiled_streamplot.streamlines_0,
+			   'streamlines_1' : bifiled_streamplot.streamlines_1,
+			   'switching_manifold' : bifiled_streamplot.switching_manifold,
+			   'streamlines_sliding' : bifiled_streamplot.streamlines_sliding,
+		    }
+	
+	arrows = {
+				'streamarrows_0' : bifiled_streamplot.streamarrows_0,
+				'streamarrows_1' : bifiled_streamplot.streamarrows_1,
+				'streamarrows_sliding' : bifiled_streamplot.streamarrows_sliding
+			 }
+	
+	return (lines, arrows)
+
+def _align(position):
+	return -(-position // _ARCHIVE_ALIGNMENT) * _ARCHIVE_ALIGNMENT
+
+class StreamplotArchive:
+	def __init__(self, filename):
+		self.filename = filename
+		
+		with open(filename, 'rb') as file:
+			if file.read(len(_ARCHIVE_MAGIC)) != _ARCHIVE_MAGIC:
+				raise InvalidArchive(filename)
+			header_size = int(np.frombuffer(file.read(8), dtype='<u8')[0])
+			header = json.loads(file.read(header_size).decode('utf-8'))
+		
+		self.sets = header['sets']
+		self.__loaded_sets = {}
+	
+	@staticmethod
+	def write(filename, bifiled_streamplot):
+		lines, arrows = _get_archive_sets(bifiled_streamplot)
+		
+		blocks = []
+		sets = {}
+		for name in lines:
+			stream_lines = struct.PolylineSet.from_lines(lines[name])
+			vertices = np.ascontiguousarray(stream_lines.vertices, dtype='<f8')
+			offsets = np.ascontiguousarray(stream_lines.offsets, dtype='<i8')
+			sets[name] = {'kind' : 'lines', 'vertices' : len(blocks), 'offsets' : len(blocks) + 1}
+			blocks.extend([vertices, offsets])
+		
+		for name in arrows:
+			stream_arrows = np.ascontiguousarray(np.reshape(arrows[name], (-1, 3, 2)), dtype='<f8')
+			sets[name] = {'kind' : 'arrows', 'arrows' : len(blocks)}
+			blocks.append(stream_arrows)
+		
+		# Block positions depend on the header size, which depends on the positions
+		header_size = 0
+		while True:
+			position = _align(len(_ARCHIVE_MAGIC) + 8 + header_size)
+			block_index = []
+			for block in blocks:
+				block_index.append({'offset' : position, 'shape' : list(block.shape), 'dtype' : block.dtype.str})
+				position = _align(position + block.nbytes)
+			
+			header_sets = {
+				name : {key : (block_index[value] if key != 'kind' else value) for key, value in entry.items()}
+				for name, entry in sets.items()
+			}
+			header = json.dumps({'version' : 1, 'sets' : header_sets}).encode('utf-8')
+			if len(header) <= header_size:
+				break
+			header_size = _align(len(header))
+		
+		with open(filename, 'wb') as file:
+			file.write(_ARCHIVE_MAGIC)
+			file.write(np.array([header_size], dtype='<u8').tobytes())
+			file.write(header.ljust(header_size))
+			for block, index in zip(blocks, block_index):
+				file.seek(index['offset'])
+				file.write(block.tobytes())
+			file.truncate(_align(file.tell()))
+	
+	def names(self):
+		return list(self.sets)
+	
+	def __map_block(self, block):
+		shape = tuple(block['shape'])
+		if np.prod(shape) == 0:
+			return np.empty(shape, dtype=block['dtype'])
+		
+		return np.memmap(self.filename, dtype=block['dtype'], mode='r', offset=block['offset'], shape=shape)
+	
+	def __getitem__(self, name):
+		if name not in self.__loaded_sets:
+			entry = self.sets[name]
+			if entry['kind'] == 'lines':
+				loaded_set = struct.PolylineSet(self.__map_block(entry['vertices']), self.__map_block(entry['offsets']))
+			else:
+				loaded_set = self.__map_block(entry['arrows'])
+			self.__loaded_sets[name] = loaded_set
+		
+		return self.__loaded_sets[name]
+	
+	def to_bifield_streamplot(self):
+		# Archives written before sliding motion was plotted have no sliding sets
+		def get_optional(name):
+			return self[name] if name in self.sets else None
+		
+		return BifieldStreamplot(
+			self['streamlines_0'], self['streamlines_1'],
+			self['streamarrows_0'], self['streamarrows_1'],
+			self['switching_manifold'],
+			get_optional('streamlines_sliding'), get_optional('streamarrows_sliding')
+		)
+
+def write_streamplot_archive(filename, bifiled_streamplot):
+	StreamplotArchive.write(filename, bifiled_streamplot)
+
+def read_streamplot_archive(filename):
+	return StreamplotArchive(filename).to_bifield_streamplot()
+
+# Streamplot cache
+#
+# Stores computed streamplots as archives in a local directory, keyed by a hash of
+# the sampled fields of the meshgrid and of the plot arguments. The least recently
+# used archives are evicted when the directory grows beyond max_bytes.
+
+_CACHE_VERSION = b'streamplot-cache-2'
+_CACHE_EXTENSION = '.pwsa'
+
+# Values that are hashed by their representation
+_REPR_HASHED_TYPES = (type(None), bool, int, float, complex, str, bytes, np.generic, np.dtype, slice, type(Ellipsis))
+
+# Functions are hashed by their name and the digest of their code, constants,
+# defaults and closure, and not by their identity, so that the same function hashes
+# the same from one run to the next; the globals they read are not hashed. The
+# functions being hashed are passed along, so that recursive closures end.
+def _hash_function(digest, function, hashed_functions):
+	digest.update(f'function{function.__module__}.{function.__qualname__}'.encode('utf-8'))
+	if id(function) in hashed_functions:
+		return
+	hashed_functions = hashed_functions | {id(function)}
+	
+	_hash_value(digest, function.__code__, hashed_functions)
+	_hash_value(digest, function.__defaults__, hashed_functions)
+	_hash_value(digest, function.__kwdefaults__, hashed_functions)
+	# Cells of variables not assigned yet are hashed as empty
+	for cell in function.__closure__ or ():
+		try:
+			contents = cell.cell_contents
+		except ValueError:
+			digest.update('empty'.encode('utf-8'))
+			continue
+		_hash_value(digest, contents, hashed_functions)
+
+def _hash_value(digest, value, hashed_functions=frozenset()):
+	if isinstance(value, np.ndarray) and any(stride == 0 and size > 1 for stride, size in zip(value.strides, value.shape)):
+		# Broadcast arrays are hashed through the values they repeat
+		digest.update(f'broadcast{value.shape}'.encode('utf-8'))
+		_hash_value(digest, value[tuple(slice(None) if stride else slice(0, 1) for stride in value.strides)], hashed_functions)
+	elif isinstance(value, np.ndarray):
+		array = np.ascontiguousarray(value)
+		digest.update(f'ndarray{array.dtype.str}{array.shape}'.encode('utf-8'))
+		digest.update(memoryview(array.reshape(-1).view(np.uint8)))
+	elif isinstance(value, tiles.TiledArray):
+		# Hashed tile by tile, to keep within the memory budget of the tiles
+		digest.update(f'tiled{value.shape}{value.tile_shape}'.encode('utf-8'))
+		for j_0, j_1, i_0, i_1 in tiles.get_tile_bounds(value):
+			_hash_value(digest, value[j_0:j_1,i_0:i_1], hashed_functions)
+	elif isinstance(value, dict):
+		digest.update(f'dict{len(value)}'.encode('utf-8'))
+		for key in sorted(value, key=repr):
+			_hash_value(digest, key, hashed_functions)
+			_hash_value(digest, value[key], hashed_functions)
+	elif isinstance(value, (list, tuple, frozenset)):
+		items = sorted(value, key=repr) if isinstance(value, frozenset) else value
+		digest.update(f'{type(value).__name__}{len(value)}'.encode('utf-8'))
+		for item in items:
+			_hash_value(digest, item, hashed_functions)
+	elif isinstance(value, _REPR_HASHED_TYPES):
+		digest.update(repr(value).encode('utf-8'))
+	elif isinstance(value, types.FunctionType):
+		_hash_function(digest, value, hashed_functions)
+	elif isinstance(value, types.CodeType):
+		digest.update(f'code{value.co_name}'.encode('utf-8'))
+		digest.update(value.co_code)
+		_hash_value(digest, value.co_consts, hashed_functions)
+		_hash_value(digest, value.co_names, hashed_functions)
+		_hash_value(digest, value.co_varnames, hashed_functions)
+	elif isinstance(value, types.MethodType):
+		digest.update('method'.encode('utf-8'))
+		_hash_value(digest, value.__func__, hashed_functions)
+		_hash_value(digest, value.__self__, hashed_functions)
+	elif isinstance(value, functools.partial):
+		digest.update('partial'.encode('utf-8'))
+		_hash_value(digest, (value.func, value.args, value.keywords), hashed_functions)
+	elif isinstance(value, types.ModuleType):
+		digest.update(f'module{value.__name__}'.encode('utf-8'))
+	elif isinstance(value, (types.BuiltinFunctionType, np.ufunc)):
+		# Compiled functions are known by their name, and the methods of objects by
+		# their object too
+		digest.update(f'builtin{value.__module__}.{getattr(value, "__qualname__", value.__name__)}'.encode('utf-8'))
+		owner = getattr(value, '__self__', None)
+		if owner is not None and not isinstance(owner, types.ModuleType):
+			_hash_value(digest, owner, hashed_functions)
+	else:
+		raise TypeError(f"values of type {type(value).__name__} cannot be hashed into a digest")
+
+# Hexadecimal digest of the values, hashed as the fields and arguments of the cache keys
+def get_digest(*values):
+	digest = hashlib.sha256()
+	for value in values:
+		_hash_value(digest, value)
+	
+	return digest.hexdigest()
+
+class StreamplotCache:
+	def __init__(self, directory, max_bytes=1 << 30):
+		self.directory = directory
+		self.max_bytes = max_bytes
+		os.makedirs(directory, exist_ok=True)
+	
+	@staticmethod
+	def get_key(piecewiseBifieldMeshgrid, *argv, **kwargs):
+		digest = hashlib.sha256(_CACHE_VERSION)
+		
+		for field in ['X', 'Y', 'Fx_0', 'Fy_0', 'Fx_1', 'Fy_1', 'S']:
+			value = getattr(piecewiseBifieldMeshgrid, field)
+			_hash_value(digest, value if isinstance(value, tiles.TiledArray) else np.asarray(value))
+		_hash_value(digest, argv)
+		_hash_value(digest, kwargs)
+		
+		return digest.hexdigest()
+	
+	def __get_filename(self, key):
+		return os.path.join(self.directory, key + _CACHE_EXTENSION)
+	
+	def load(self, key):
+		filename = self.__get_filename(key)
+		try:
+			bifield_streamplot = read_streamplot_archive(filename)
+		except (FileNotFoundError, InvalidArchive):
+			return None
+		
+		# Mark as recently used
+		os.utime(filename)
+		
+		return bifield_streamplot
+	
+	def store(self, key, bifiled_streamplot):
+		filename = self.__get_filename(key)
+		temporary_filename = f'{filename}.{os.getpid()}.tmp'
+		
+		write_streamplot_archive(temporary_filename, bifiled_streamplot)
+		os.replace(temporary_filename, filename)
+		
+		self.evict()
+	
+	def __get_entries(self):
+		entries = []
+		for entry in os.scandir(self.directory):
+			if entry.is_file() and entry.name.endswith(_CACHE_EXTENSION):
+				stat = entry.stat()
+				entries.append((stat.st_mtime, stat.st_size, entry.path))
+		
+		return sorted(entries)
+	
+	def __remove_entries_beyond(self, max_bytes):
+		entries = self.__get_entries()
+		total_bytes = sum(size for _, size, _ in entries)
+		for _, size, path in entries:
+			if total_bytes <= max_bytes:
+				break
+			try:
+				os.remove(path)
+			except FileNotFoundError:
+				pass
+			total_bytes = total_bytes - size
+	
+	def evict(self):
+		self.__remove_entries_beyond(self.max_bytes)
+	
+	def clear(self):
+		self.__remove_entries_beyond(0)
+
+# Buck converter with a sliding mode controller, and the box and grid step it is
+# plotted on
+def get_buck_converter_system():
 	C = 0.6e-3
 	L = 1.7e-3
 	R = 8
@@ -307,7 +1102,49 @@ def main():
 	
 	piecewise_bifield = PiecewiseBifield(f_0, f_1, switching_manifold)
 	
-	meshgrid_generator = IsoPiecewiseBifieldMeshgridGenerator(min_value=(0,0), max_value=(10,75), step=(0.02, 0.02))
+	return (piecewise_bifield, (0,0), (10,75), (0.02, 0.02))
+
+def test():
+	piecewise_bifield, min_value, max_value, step = get_buck_converter_system()
+	keywords = {'stream_density' : 0.6, 'stream_broken_streamlines' : True}
+	
+	iso_streamplot = generate_streamplot(piecewise_bifield, IsoPiecewiseBifieldMeshgridGenerator(min_value, max_value, step), **keywords)
+	
+	# The tiled pipeline reads its fields tile by tile and never as a whole
+	def __array__(self, dtype=None, copy=None):
+		raise RuntimeError(f"a tiled array of shape {self.shape} was converted to an array")
+	
+	tiled_generator = TiledPiecewiseBifieldMeshgridGenerator(min_value, max_value, step, tile_shape=(64, 64), max_bytes=1 << 20)
+	full_array = tiles.TiledArray.__array__
+	tiles.TiledArray.__array__ = __array__
+	try:
+		profiler = profiling.StageProfiler()
+		tiled_streamplot = generate_streamplot(piecewise_bifield, tiled_generator, profiler=profiler, **keywords)
+	finally:
+		tiles.TiledArray.__array__ = full_array
+	
+	test_results = []
+	for lines in ['streamlines_0', 'streamlines_1', 'switching_manifold', 'streamlines_sliding']:
+		iso_lines = getattr(iso_streamplot, lines)
+		tiled_lines = getattr(tiled_streamplot, lines)
+		test_results.append(np.array_equal(iso_lines.offsets, tiled_lines.offsets) and np.array_equal(iso_lines.vertices, tiled_lines.vertices))
+	# The store exceeds its budget by the tile it computed last, until it evicts
+	test_results.append(tiled_generator.tile_store.peak_nbytes <= (1 << 20) + 5 * 64 * 64 * 8)
+	
+	# Every crossing solved by the filtering ends a filtered line on the manifold
+	on_manifold = 0
+	for lines in [tiled_streamplot.streamlines_0, tiled_streamplot.streamlines_1]:
+		on_manifold += np.count_nonzero(np.abs(crossings.evaluate_manifold(piecewise_bifield.manifold, lines.vertices[:,0], lines.vertices[:,1])) < 1e-6)
+	crossing_stage = profiler.stages['crossings']
+	test_results.append(crossing_stage['counts']['crossings'] == on_manifold > 0)
+	test_results.append(crossing_stage['seconds'] <= profiler.stages['filtering']['seconds'])
+	
+	return all(test_results)
+
+def main():
+	piecewise_bifield, min_value, max_value, step = get_buck_converter_system()
+	
+	meshgrid_generator = IsoPiecewiseBifieldMeshgridGenerator(min_value=min_value, max_value=max_value, step=step)
 	
 	bifield_streamplot = generate_streamplot( piecewise_bifield, meshgrid_generator, stream_density=1.2, stream_broken_streamlines=True)
 	write_streamplot('streamplot', bifield_streamplot)
@@ -0,0 +1,98 @@
+import time
+import threading
+import sys
+
+# Stage profiling
+#
+# The streamplot generators report every stage they run to a profiler: the stage
+# starts with start_stage(name) and stops with stop_stage(name, **counts), where
+# the counts measure the work of the stage, such as the lines and points it
+# produced, the segments it stitched, the crossings it solved or the bytes it
+# wrote. The default profiler ignores the events. Counts that cost anything to
+# measure are only gathered for profilers that are enabled.
+
+class Profiler:
+	enabled = False
+	
+	def start_stage(self, name):
+		pass
+	
+	def stop_stage(self, name, **counts):
+		pass
+
+NULL_PROFILER = Profiler()
+
+def get_profiler(profiler):
+	return NULL_PROFILER if profiler is None else profiler
+
+# Collects the time, the number of runs and the counts of every stage; stages are
+# reported in the order they first started
+class StageProfiler(Profiler):
+	enabled = True
+	
+	def __init__(self, clock=time.perf_counter):
+		self.clock = clock
+		self.stages = {}
+		self.__starts = {}
+		self.__first_start = None
+		self.__last_stop = None
+		self.__lock = threading.Lock()
+	
+	def start_stage(self, name):
+		start = self.clock()
+		with self.__lock:
+			self.__starts.setdefault(name, []).append(start)
+			self.stages.setdefault(name, {'runs' : 0, 'seconds' : 0.0, 'counts' : {}})
+			if self.__first_start is None:
+				self.__first_start = start
+	
+	def stop_stage(self, name, **counts):
+		stop = self.clock()
+		with self.__lock:
+			start = self.__starts[name].pop()
+			stage = self.stages[name]
+			stage['runs'] += 1
+			stage['seconds'] += stop - start
+			for count, value in counts.items():
+				stage['counts'][count] = stage['counts'].get(count, 0) + value
+			self.__last_stop = stop
+	
+	# Time from the start of the first stage to the end of the last one; stages run
+	# within other stages are counted in both
+	def get_total_seconds(self):
+		if self.__first_start is None or self.__last_stop is None:
+			return 0.0
+		return self.__last_stop - self.__first_start
+	
+	def get_report(self):
+		total_seconds = self.get_total_seconds()
+		
+		return [
+			{
+				'stage' : name,
+				'runs' : stage['runs'],
+				'seconds' : stage['seconds'],
+				'share' : stage['seconds'] / total_seconds if total_seconds > 0 else 0.0,
+				**stage['counts']
+			}
+			for name, stage in self.stages.items()
+		]
+	
+	def format_report(self):
+		lines = [f"{'stage':<14} {'runs':>5} {'seconds':>10} {'share':>7}  counts"]
+		for row in self.get_report():
+			counts = ", ".join(f"{count}={row[count]}" for count in row if count not in ['stage', 'runs', 'seconds', 'share'])
+			lines.append(f"{row['stage']:<14} {row['runs']:>5} {row['seconds']:>10.4f} {row['share']:>7.1%}  {counts}")
+		lines.append(f"{'total':<14} {'':>5} {self.get_total_seconds():>10.4f}")
+		
+		return "\n".join(lines)
+	
+	def print_report(self, file=sys.stdout):
+		print(self.format_report(), file=file)
+	
+	def clear(self):
+		with self.__lock:
+			self.stages = {}
+			self.__starts = {}
+			self.__first_start = None
+			self.__last_stop = None
@@ -0,0 +1,442 @@
+import numpy as np
+import abc
+
+import math
+import os
+
+import streamlines as streamlines
+import datastructures as struct
+import executors as executors
+import crossings as crossings
+import piecewise_smooth_field as pws
+
+# Seed points
+#
+# The streamlines of a streamplot start from seed points. Without seeds, the
+# native engines seed every free cell of the density mask in a spiral, one seed
+# after the other, so the whole plot is a single sequential integration. With the
+# seed generators below the seeds are chosen explicitly instead:
+# - GridSeedGenerator seeds the nodes of the density mask, boundary first,
+# - PoissonDiskSeedGenerator seeds random points no closer to each other than the
+#   spacing of the density mask, reproducibly for a given random seed,
+# - StartPointSeedGenerator seeds given start points.
+# The seeds of either field of a piecewise bifield are restricted to the side of
+# the switching manifold where the field is active.
+#
+# Sharding
+#
+# The box of the streamplot is split into a layout of (columns, rows) tiles, and
+# the seeds in every tile form a shard, which is integrated independently of the
+# others with a density mask of its own. Shards are merged in the order of the
+# tiles: the lines of every shard are cut where they enter a cell of the density
+# mask taken by the lines of an earlier shard, and the pieces shorter than the
+# minimum length are dropped, so that lines found by several shards are kept once.
+# The shards and their merge only depend on the seeds and the layout, not on the
+# executor or its workers.
+#
+# Shards may also be integrated on separate nodes with run_shard, which writes the
+# lines of a shard to a shared directory, and merged by merge_shards once all of
+# them are written.
+
+_SHARD_FILE_FORMAT = 'shard_{:04d}.npz'
+
+def _get_mask_shape(density):
+	mask_nx, mask_ny = (streamlines.MASK_CELLS * np.broadcast_to(density, 2)).astype(int)
+	return (mask_nx, mask_ny)
+
+# Box spanned by the nodes of a meshgrid, where streamlines may start
+def get_meshgrid_bounds(meshgrid):
+	x = np.asarray(meshgrid.X[0,:])
+	y = np.asarray(meshgrid.Y[:,0])
+	
+	return ((x[0], y[0]), (x[-1], y[-1]))
+
+# Region of the side of the manifold where field u is active, field 0 where the
+# manifold is positive
+def get_side_region(manifold, u):
+	alpha = - (2*u - 1)
+	
+	def region(x, y):
+		return alpha * crossings.evaluate_manifold(manifold, x, y) >= 0
+	
+	return region
+
+def _restrict_to_region(seeds, region):
+	if region is None or len(seeds) == 0:
+		return seeds
+	
+	return seeds[region(seeds[:,0], seeds[:,1])]
+
+class SeedGenerator(abc.ABC):
+	# Seeds in the box [min_value, max_value], as an array of shape (n, 2), within
+	# the region when given, a function of the coordinates that is true inside it
+	@abc.abstractmethod
+	def get_seeds(self, min_value, max_value, region=None):
+		pass
+
+class GridSeedGenerator(SeedGenerator):
+	def __init__(self, density=1):
+		self.density = density
+	
+	def get_seeds(self, min_value, max_value, region=None):
+		mask_nx, mask_ny = _get_mask_shape(self.density)
+		i, j = np.meshgrid(np.arange(mask_nx), np.arange(mask_ny))
+		
+		# Seeds on the boundary first give higher quality streamlines
+		ring = np.minimum(np.minimum(i, mask_nx - 1 - i), np.minimum(j, mask_ny - 1 - j))
+		order = np.argsort(ring, axis=None, kind='stable')
+		
+		x = np.linspace(min_value[0], max_value[0], mask_nx)
+		y = np.linspace(min_value[1], max_value[1], mask_ny)
+		seeds = np.stack((x[i.ravel()[order]], y[j.ravel()[order]]), axis=1)
+		
+		return _restrict_to_region(seeds, region)
+
+# Poisson disk sampling of the unit square with Bridson's algorithm; candidates are
+# drawn around a random active point and the first one far enough from every
+# sample is kept, or the point stops being active when none is
+def _sample_poisson_disk(radius, rng, candidates):
+	cell_size = radius / math.sqrt(2)
+	grid_size = math.ceil(1 / cell_size)
+	grid = np.full((grid_size, grid_size), -1, dtype=np.int64)
+	# Samples within radius of a candidate lie within 3 radii of its active point
+	reach = math.ceil(3 * radius / cell_size)
+	
+	def get_cell(point):
+		return tuple(np.minimum((point / cell_size).astype(int), grid_size - 1))
+	
+	# There is at most one sample per cell
+	samples = np.empty((grid_size * grid_size, 2))
+	samples[0] = rng.random(2)
+	sample_count = 1
+	grid[get_cell(samples[0])[::-1]] = 0
+	active = [0]
+	
+	while active:
+		a = rng.integers(len(active))
+		point = samples[active[a]]
+		
+		radii = radius * (1 + rng.random(candidates))
+		angles = 2 * math.pi * rng.random(candidates)
+		candidate_points = point + np.stack((radii * np.cos(angles), radii * np.sin(angles)), axis=1)
+		candidate_points = candidate_points[np.all((candidate_points >= 0) & (candidate_points < 1), axis=1)]
+		
+		ci, cj = get_cell(point)
+		window = grid[max(cj - reach, 0):cj + reach + 1, max(ci - reach, 0):ci + reach + 1]
+		neighbours = samples[window[window >= 0]]
+		distances = np.linalg.norm(candidate_points[:,np.newaxis,:] - neighbours[np.newaxis,:,:], axis=2)
+		accepted = np.flatnonzero(np.all(distances >= radius, axis=1))
+		
+		if len(accepted) == 0:
+			active[a] = active[-1]
+			active.pop()
+			continue
+		
+		samples[sample_count] = candidate_points[accepted[0]]
+		grid[get_cell(samples[sample_count])[::-1]] = sample_count
+		active.append(sample_count)
+		sample_count += 1
+	
+	return samples[:sample_count]
+
+# Seeds no closer than the spacing of the density mask in axes coordinates; the
+# seeds of the whole box are drawn first and then restricted to the region, so
+# that the seeds of complementary regions do not depend on each other
+class PoissonDiskSeedGenerator(SeedGenerator):
+	def __init__(self, density=1, seed=0, candidates=30):
+		self.density = density
+		self.seed = seed
+		self.candidates = candidates
+	
+	def get_seeds(self, min_value, max_value, region=None):
+		radius = 1 / (streamlines.MASK_CELLS * np.max(np.broadcast_to(self.density, 2)))
+		samples = _sample_poisson_disk(radius, np.random.default_rng(self.seed), self.candidates)
+		
+		min_value = np.asarray(min_value, dtype=np.float64)
+		max_value = np.asarray(max_value, dtype=np.float64)
+		seeds = min_value + samples * (max_value - min_value)
+		
+		return _restrict_to_region(seeds, region)
+
+class StartPointSeedGenerator(SeedGenerator):
+	def __init__(self, start_points):
+		self.start_points = np.asarray(start_points, dtype=np.float64).reshape(-1, 2)
+	
+	def get_seeds(self, min_value, max_value, region=None):
+		return _restrict_to_region(self.start_points, region)
+
+# Seeds of the two fields of a piecewise bifield streamplot, each on its own side
+def get_bifield_seeds(seed_generator, piecewiseBifieldStreamplot):
+	min_value, max_value = get_meshgrid_bounds(piecewiseBifieldStreamplot.piecewise_bifield_meshgrid)
+	manifold = piecewiseBifieldStreamplot.piecewise_bifield.manifold
+	
+	return tuple(seed_generator.get_seeds(min_value, max_value, get_side_region(manifold, u)) for u in range(2))
+
+# Layout (columns, rows) of the shard tiles; a number of shards is a row of tiles
+def get_shard_layout(shards):
+	if np.ndim(shards) == 0:
+		return (int(shards), 1)
+	
+	columns, rows = shards
+	return (int(columns), int(rows))
+
+# Seeds of every shard, in the order of the tiles, row by row
+def split_seeds(seeds, min_value, max_value, shards):
+	columns, rows = get_shard_layout(shards)
+	seeds = np.asarray(seeds, dtype=np.float64).reshape(-1, 2)
+	
+	def get_tiles(values, lower, upper, count):
+		extent = upper - lower
+		tiles = np.floor((values - lower) / extent * count) if extent > 0 else np.zeros(len(values))
+		return np.clip(tiles, 0, count - 1).astype(np.int64)
+	
+	shard_ids = get_tiles(seeds[:,1], min_value[1], max_value[1], rows) * columns + get_tiles(seeds[:,0], min_value[0], max_value[0], columns)
+	
+	return [seeds[shard_ids == shard] for shard in range(columns * rows)]
+
+# Merges the stream lines of the shards, in order, cutting the lines of every shard
+# where they enter a cell of the density mask taken by an earlier shard
+def merge_shard_stream_lines(shard_stream_lines, min_value, max_value, density=1, minlength=0.1):
+	mask_nx, mask_ny = _get_mask_shape(density)
+	owners = np.zeros((mask_ny, mask_nx), dtype=np.int64)
+	extent = np.asarray(max_value, dtype=np.float64) - np.asarray(min_value, dtype=np.float64)
+	
+	merged_lines = []
+	for shard, stream_lines in enumerate(shard_stream_lines):
+		stream_lines = struct.PolylineSet.from_lines(stream_lines)
+		vertices = stream_lines.vertices
+		if len(vertices) == 0:
+			continue
+		
+		axes_vertices = (vertices - min_value) / extent
+		xm = np.clip(np.round(axes_vertices[:,0] * (mask_nx - 1)).astype(np.int64), 0, mask_nx - 1)
+		ym = np.clip(np.round(axes_vertices[:,1] * (mask_ny - 1)).astype(np.int64), 0, mask_ny - 1)
+		cell_owners = owners[ym, xm]
+		free = (cell_owners == 0) | (cell_owners == shard + 1)
+		
+		# Runs of free vertices within a line
+		line_starts = np.zeros(len(vertices), dtype=bool)
+		line_starts[stream_lines.offsets[:-1]] = True
+		continues_run = np.zeros(len(vertices), dtype=bool)
+		continues_run[1:] = free[1:] & free[:-1] & ~line_starts[1:]
+		run_starts = free & ~continues_run
+		run_ids = np.cumsum(run_starts) - 1
+		
+		run_count = np.count_nonzero(run_starts)
+		run_sizes = np.bincount(run_ids[free], minlength=run_count)
+		segment_lengths = np.zeros(len(vertices))
+		segment_lengths[1:] = np.linalg.norm(np.diff(axes_vertices, axis=0), axis=1)
+		run_lengths = np.bincount(run_ids[continues_run], weights=segment_lengths[continues_run], minlength=run_count)
+		
+		kept_runs = (run_sizes > 1) & (run_lengths > minlength)
+		kept = free.copy()
+		kept[free] = kept_runs[run_ids[free]]
+		
+		offsets = np.zeros(np.count_nonzero(kept_runs) + 1, dtype=np.int64)
+		np.cumsum(run_sizes[kept_runs], out=offsets[1:])
+		merged_lines.append(struct.PolylineSet(vertices[kept], offsets))
+		
+		taken = kept & (cell_owners == 0)
+		owners[ym[taken], xm[taken]] = shard + 1
+	
+	return struct.PolylineSet.concatenate(merged_lines)
+
+def _get_integration_keywords(stream_kwargs):
+	stream_kwargs = dict(stream_kwargs)
+	compiled = streamlines.is_compiled_engine(stream_kwargs.pop('engine', 'native'))
+	
+	stream_kwargs.setdefault('density', 1)
+	stream_kwargs.setdefault('minlength', 0.1)
+	stream_kwargs['compiled'] = compiled
+	
+	return stream_kwargs
+
+def _get_field_meshgrid(piecewiseBifieldMeshgrid, u):
+	meshgrid = piecewiseBifieldMeshgrid
+	if u == 0:
+		return streamlines.Meshgrid(meshgrid.X, meshgrid.Y, meshgrid.Fx_0, meshgrid.Fy_0)
+	
+	return streamlines.Meshgrid(meshgrid.X, meshgrid.Y, meshgrid.Fx_1, meshgrid.Fy_1)
+
+def _integrate_seeds(piecewiseBifieldStreamplot, u, seeds, integration_kwargs):
+	meshgrid = _get_field_meshgrid(piecewiseBifieldStreamplot.piecewise_bifield_meshgrid, u)
+	
+	return streamlines.integrate_stream_lines(meshgrid, start_points=seeds, **integration_kwargs)
+
+# Extended stream lines of both fields started from the seeds of one shard
+def integrate_shard(piecewiseBifieldStreamplot, seed_generator, shards, index, **stream_kwargs):
+	integration_kwargs = _get_integration_keywords(stream_kwargs)
+	min_value, max_value = get_meshgrid_bounds(piecewiseBifieldStreamplot.piecewise_bifield_meshgrid)
+	
+	return tuple(
+		_integrate_seeds(piecewiseBifieldStreamplot, u, split_seeds(seeds, min_value, max_value, shards)[index], integration_kwargs)
+		for u, seeds in enumerate(get_bifield_seeds(seed_generator, piecewiseBifieldStreamplot))
+	)
+
+def _merge_bifield_shards(piecewiseBifieldStreamplot, shard_stream_lines, stream_kwargs, manifold_kwargs, arrow_kwargs, executor, workers):
+	integration_kwargs = _get_integration_keywords(stream_kwargs)
+	min_value, max_value = get_meshgrid_bounds(piecewiseBifieldStreamplot.piecewise_bifield_meshgrid)
+	
+	extended_stream_lines = [
+		merge_shard_stream_lines(
+			[stream_lines[u] for stream_lines in shard_stream_lines],
+			min_value, max_value,
+			integration_kwargs['density'], integration_kwargs['minlength']
+		)
+		for u in range(2)
+	]
+	
+	(stream_lines_0, stream_lines_1) = pws.filter_stream_lines(
+		*extended_stream_lines,
+		piecewiseBifieldStreamplot.piecewise_bifield.manifold,
+		executor, workers
+	)
+	
+	return pws.assemble_bifield_streamplot(
+		piecewiseBifieldStreamplot.piecewise_bifield,
+		stream_lines_0, stream_lines_1,
+		piecewiseBifieldStreamplot.generate_switching_manifold(**manifold_kwargs),
+		**arrow_kwargs
+	)
+
+# Streamplot of a piecewise bifield with the seeds of seed_generator, integrated
+# in shards on the workers of the executor and merged; the keywords are those of
+# piecewise_smooth_field.generate_streamplot, for the native or numba engines
+def generate_seeded_streamplot(piecewiseBifield, piecewiseBifieldMeshgridGenerator, seed_generator, shards=1,
+		executor='serial', workers=None, **kwargs):
+	(stream_kwargs, arrow_kwargs, manifold_kwargs) = pws.get_keywords(**kwargs)
+	integration_kwargs = _get_integration_keywords(stream_kwargs)
+	
+	piecewise_bifield_streamplot = pws.PiecewiseBifieldStreamplot(piecewiseBifield, piecewiseBifieldMeshgridGenerator)
+	min_value, max_value = get_meshgrid_bounds(piecewise_bifield_streamplot.piecewise_bifield_meshgrid)
+	
+	shard_seeds = [split_seeds(seeds, min_value, max_value, shards) for seeds in get_bifield_seeds(seed_generator, piecewise_bifield_streamplot)]
+	tasks = [(index, u) for index in range(len(shard_seeds[0])) for u in range(2)]
+	
+	# The velocities are converted once, before the workers start, rather than by
+	# every shard
+	meshgrids = [streamlines.PreparedMeshgrid(_get_field_meshgrid(piecewise_bifield_streamplot.piecewise_bifield_meshgrid, u)) for u in range(2)]
+	
+	def integrate(task):
+		index, u = task
+		return streamlines.integrate_stream_lines(meshgrids[u], start_points=shard_seeds[u][index], **integration_kwargs)
+	
+	stream_lines = executors.map_ordered(integrate, tasks, executor, workers, chunk_size=1)
+	shard_stream_lines = [tuple(stream_lines[2*index:2*index + 2]) for index in range(len(shard_seeds[0]))]
+	
+	return _merge_bifield_shards(piecewise_bifield_streamplot, shard_stream_lines, stream_kwargs, manifold_kwargs, arrow_kwargs, executor, workers)
+
+class MissingShards(Exception):
+	def __init__(self, missing_shards, *args):
+		super().__init__(*args)
+		self.missing_shards = missing_shards
+	
+	def __str__(self):
+		return f"The shards {', '.join(str(index) for index in self.missing_shards)} are not written yet"
+
+def _get_shard_filename(directory, index):
+	return os.path.join(directory, _SHARD_FILE_FORMAT.format(index))
+
+# Shard files are written under a temporary name and renamed once complete, so
+# that a merge never reads a partial shard
+def write_shard(directory, index, stream_lines):
+	arrays = {}
+	for u, lines in enumerate(stream_lines):
+		lines = struct.PolylineSet.from_lines(lines)
+		arrays[f'vertices_{u}'] = lines.vertices
+		arrays[f'offsets_{u}'] = lines.offsets
+	
+	filename = _get_shard_filename(directory, index)
+	temporary_filename = f'{filename}.{os.getpid()}.tmp'
+	with open(temporary_filename, 'wb') as file:
+		np.savez(file, **arrays)
+	os.replace(temporary_filename, filename)
+
+def read_shard(directory, index):
+	with np.load(_get_shard_filename(directory, index)) as archive:
+		return tuple(struct.PolylineSet(archive[f'vertices_{u}'], archive[f'offsets_{u}']) for u in range(2))
+
+# Integrates shard index of the layout and writes its lines to the directory, a
+# directory shared by the nodes integrating the other shards
+def run_shard(piecewiseBifield, piecewiseBifieldMeshgridGenerator, seed_generator, shards, index, directory, **kwargs):
+	(stream_kwargs, _, _) = pws.get_keywords(**kwargs)
+	piecewise_bifield_streamplot = pws.PiecewiseBifieldStreamplot(piecewiseBifield, piecewiseBifieldMeshgridGenerator)
+	
+	os.makedirs(directory, exist_ok=True)
+	write_shard(directory, index, integrate_shard(piecewise_bifield_streamplot, seed_generator, shards, index, **stream_kwargs))
+
+# Streamplot merged from the shards written to the directory by run_shard, given
+# the keywords the shards were run with
+def merge_shards(piecewiseBifield, piecewiseBifieldMeshgridGenerator, shards, directory, executor='serial', workers=None, **kwargs):
+	(stream_kwargs, arrow_kwargs, manifold_kwargs) = pws.get_keywords(**kwargs)
+	columns, rows = get_shard_layout(shards)
+	
+	missing_shards = [index for index in range(columns * rows) if not os.path.exists(_get_shard_filename(directory, index))]
+	if missing_shards:
+		raise MissingShards(missing_shards)
+	
+	piecewise_bifield_streamplot = pws.PiecewiseBifieldStreamplot(piecewiseBifield, piecewiseBifieldMeshgridGenerator)
+	shard_stream_lines = [read_shard(directory, index) for index in range(columns * rows)]
+	
+	return _merge_bifield_shards(piecewise_bifield_streamplot, shard_stream_lines, stream_kwargs, manifold_kwargs, arrow_kwargs, executor, workers)
+
+def _is_same_streamplot(streamplot_0, streamplot_1):
+	for lines in ['streamlines_0', 'streamlines_1', 'streamlines_sliding', 'switching_manifold']:
+		lines_0 = getattr(streamplot_0, lines)
+		lines_1 = getattr(streamplot_1, lines)
+		if not (np.array_equal(lines_0.offsets, lines_1.offsets) and np.array_equal(lines_0.vertices, lines_1.vertices)):
+			return False
+	
+	return True
+
+def test():
+	import tempfile
+	
+	test_results = []
+	
+	# Poisson disk samples are no closer than the radius, and cover the square
+	radius = 1 / streamlines.MASK_CELLS
+	samples = _sample_poisson_disk(radius, np.random.default_rng(7), 30)
+	distances = np.linalg.norm(samples[:,np.newaxis,:] - samples[np.newaxis,:,:], axis=2)
+	np.fill_diagonal(distances, np.inf)
+	test_results.append(bool(np.all(distances >= radius)) and len(samples) > 1 / (4 * radius**2))
+	test_results.append(bool(np.all((samples >= 0) & (samples < 1))))
+	test_results.append(np.array_equal(samples, _sample_poisson_disk(radius, np.random.default_rng(7), 30)))
+	
+	# Shards written and merged from a directory give the streamplot integrated in
+	# process, whatever the executor
+	piecewise_bifield, min_value, max_value, step = pws.get_buck_converter_system()
+	meshgrid_generator = pws.IsoPiecewiseBifieldMeshgridGenerator(min_value, max_value, step)
+	seed_generator = PoissonDiskSeedGenerator(density=0.5, seed=3)
+	shards = (2, 2)
+	keywords = {'stream_density' : 0.5}
+	
+	streamplot = generate_seeded_streamplot(piecewise_bifield, meshgrid_generator, seed_generator, shards, **keywords)
+	threads_streamplot = generate_seeded_streamplot(piecewise_bifield, meshgrid_generator, seed_generator, shards, executor='threads', workers=2, **keywords)
+	test_results.append(len(streamplot.streamlines_0) > 0 and len(streamplot.streamlines_1) > 0)
+	test_results.append(_is_same_streamplot(streamplot, threads_streamplot))
+	
+	with tempfile.TemporaryDirectory() as directory:
+		try:
+			merge_shards(piecewise_bifield, meshgrid_generator, shards, directory, **keywords)
+			test_results.append(False)
+		except MissingShards as missing_shards:
+			test_results.append(missing_shards.missing_shards == [0, 1, 2, 3])
+		
+		for index in range(4):
+			run_shard(piecewise_bifield, meshgrid_generator, seed_generator, shards, index, directory, **keywords)
+		merged_streamplot = merge_shards(piecewise_bifield, meshgrid_generator, shards, directory, **keywords)
+	test_results.append(_is_same_streamplot(streamplot, merged_streamplot))
+	
+	# Shards resolve their engine as streamlines does, and cannot run matplotlib
+	test_results.append(_get_integration_keywords({'engine' : 'numba'})['compiled'] and not _get_integration_keywords({})['compiled'])
+	try:
+		_get_integration_keywords({'engine' : 'matplotlib'})
+		test_results.append(False)
+	except streamlines.UnknownEngine:
+		test_results.append(True)
+	
+	return all(test_results)
+
+if __name__ == '__main__':
+	print(test())
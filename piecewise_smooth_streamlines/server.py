@@ -0,0 +1,403 @@
+import numpy as np
+
+import argparse
+import ast
+import concurrent.futures
+import json
+import multiprocessing
+import os
+import socketserver
+import sys
+import threading
+import time
+
+import piecewise_smooth_field as pws
+
+# Batch render server
+#
+# A long lived job runner that generates streamplots of piecewise bifields for a
+# stream of jobs, on a pool of worker processes started once and warmed up with a
+# small streamplot, so that the cost of importing the modules and of setting up
+# the plotting state is paid once per worker rather than once per plot.
+#
+# Jobs are JSON objects, one per line, read from the standard input or from the
+# connections to a Unix socket:
+# {
+#   "id" : "buck-1",
+#   "directory" : "plots/buck-1",
+#   "variables" : ["i_L", "v_C"],
+#   "parameters" : {"L" : 1.7e-3, "C" : 0.6e-3, "R" : 8, "E" : 48},
+#   "fields" : [["-v_C/L", "(i_L - v_C/R)/C"], ["(E - v_C)/L", "(i_L - v_C/R)/C"]],
+#   "manifold" : "(i_L - 4.5) + (v_C - 36)",
+#   "min_value" : [0, 0], "max_value" : [10, 75], "step" : [0.02, 0.02],
+#   "meshgrid" : {"kind" : "iso"},
+#   "format" : "text",
+#   "keywords" : {"stream_density" : 1.2}
+# }
+# The fields and the manifold are arithmetic expressions of the variables, "x" and
+# "y" by default, of the numeric parameters and of the functions in _FUNCTIONS.
+# Only "directory", "fields", "manifold", "min_value", "max_value" and "step" are
+# required. The keywords are those of generate_streamplot, and the streamplot is
+# written with write_streamplot to the directory, which must not exist yet and is
+# claimed by the job before it runs. Every job is answered by a JSON line with its
+# id, its status, "ok" or "error", and either the directory and the seconds taken
+# or the error; answers are sent as the jobs complete, not in the order they came.
+
+_FUNCTIONS = {
+	name : getattr(np, name)
+	for name in [
+		'sin', 'cos', 'tan', 'arcsin', 'arccos', 'arctan', 'arctan2',
+		'sinh', 'cosh', 'tanh', 'exp', 'log', 'log10', 'sqrt', 'abs',
+		'sign', 'minimum', 'maximum', 'where', 'hypot', 'pi', 'e'
+	]
+}
+
+_MESHGRID_GENERATORS = {
+	'iso' : pws.IsoPiecewiseBifieldMeshgridGenerator,
+	'adaptive' : pws.AdaptivePiecewiseBifieldMeshgridGenerator,
+	'tiled' : pws.TiledPiecewiseBifieldMeshgridGenerator
+}
+
+# Fields every job needs besides its directory
+_STREAMPLOT_FIELDS = ['fields', 'manifold', 'min_value', 'max_value', 'step']
+
+# Small job run by every worker when it starts
+_WARM_UP_JOB = {
+	'fields' : [['-y', 'x'], ['-y', 'x - 1']],
+	'manifold' : 'x - y',
+	'min_value' : [-1, -1], 'max_value' : [1, 1], 'step' : [0.1, 0.1],
+	'keywords' : {'stream_density' : 0.3}
+}
+
+class InvalidJob(Exception):
+	def __init__(self, reason, *args):
+		super().__init__(*args)
+		self.reason = reason
+	
+	def __str__(self):
+		return f"Invalid job: {self.reason}"
+
+# Nodes the expressions may hold: numbers and names combined by operators,
+# comparisons and conditionals, and calls of named functions. Attributes,
+# subscripts, lambdas, comprehensions and every other node are rejected, at any
+# depth of the expression.
+_EXPRESSION_NODES = (
+	ast.Expression, ast.Constant, ast.Name, ast.Load, ast.Call,
+	ast.BinOp, ast.UnaryOp, ast.BoolOp, ast.Compare, ast.IfExp,
+	ast.operator, ast.unaryop, ast.boolop, ast.cmpop
+)
+
+# Integer constants are made floats, so that powers of them overflow rather than
+# grow without bound
+class _FloatConstants(ast.NodeTransformer):
+	def visit_Constant(self, node):
+		if isinstance(node.value, int) and not isinstance(node.value, bool):
+			return ast.copy_location(ast.Constant(float(node.value)), node)
+		return node
+
+# Compiled expressions and the names they use, by source, shared by the jobs run
+# by a worker
+_compiled_expressions = {}
+
+def _parse_expression(expression):
+	try:
+		tree = ast.parse(expression, '<job>', 'eval')
+	except SyntaxError as error:
+		raise InvalidJob(f"the expression {expression!r} is not valid: {error.msg}")
+	
+	used_names = set()
+	for node in ast.walk(tree):
+		if not isinstance(node, _EXPRESSION_NODES):
+			raise InvalidJob(f"the expression {expression!r} uses {type(node).__name__}, which is not allowed")
+		if isinstance(node, ast.Constant) and (isinstance(node.value, bool) or not isinstance(node.value, (int, float))):
+			raise InvalidJob(f"the expression {expression!r} uses the constant {node.value!r}, which is not a number")
+		if isinstance(node, ast.Call) and (not isinstance(node.func, ast.Name) or node.keywords):
+			raise InvalidJob(f"the expression {expression!r} calls something other than a function by name")
+		if isinstance(node, ast.Name):
+			used_names.add(node.id)
+	
+	tree = ast.fix_missing_locations(_FloatConstants().visit(tree))
+	return (compile(tree, '<job>', 'eval'), used_names)
+
+def _compile_expression(expression, names):
+	if not isinstance(expression, str):
+		raise InvalidJob(f"the expression {expression!r} is not a string")
+	
+	compiled_expression = _compiled_expressions.get(expression)
+	if compiled_expression is None:
+		compiled_expression = _parse_expression(expression)
+		_compiled_expressions[expression] = compiled_expression
+	
+	code, used_names = compiled_expression
+	unknown_names = sorted(used_names - set(names))
+	if unknown_names:
+		raise InvalidJob(f"the expression {expression!r} uses the unknown names {', '.join(unknown_names)}")
+	
+	return code
+
+# Function of the two variables evaluating the expressions; the values are
+# broadcast to the shape of the variables, so that constant expressions sample
+# like the others
+def _get_expression_function(expressions, variables, parameters):
+	namespace = {'__builtins__' : {}, **_FUNCTIONS, **parameters}
+	names = (set(_FUNCTIONS) | set(parameters) | set(variables)) - {'__builtins__'}
+	codes = [_compile_expression(expression, names) for expression in expressions]
+	
+	def evaluate(x, y):
+		local_namespace = {variables[0] : x, variables[1] : y}
+		values = [np.broadcast_arrays(eval(code, namespace, local_namespace), x)[0] for code in codes]
+		return tuple(values)
+	
+	return evaluate
+
+def _get_pair(job, key):
+	value = job[key]
+	if not isinstance(value, (list, tuple)) or len(value) != 2:
+		raise InvalidJob(f"{key} is not a pair of values")
+	
+	return tuple(value)
+
+def _get_piecewise_bifield(job):
+	variables = job.get('variables', ['x', 'y'])
+	parameters = job.get('parameters', {})
+	if not isinstance(variables, (list, tuple)) or len(variables) != 2:
+		raise InvalidJob("variables is not a pair of names")
+	if not isinstance(parameters, dict):
+		raise InvalidJob("parameters is not an object")
+	if any(isinstance(value, bool) or not isinstance(value, (int, float)) for value in parameters.values()):
+		raise InvalidJob("parameters are not all numbers")
+	parameters = {name : float(value) for name, value in parameters.items()}
+	
+	fields = job['fields']
+	if not isinstance(fields, (list, tuple)) or len(fields) != 2 or any(len(field) != 2 for field in fields):
+		raise InvalidJob("fields is not a pair of vector fields with two components")
+	
+	vector_field_0, vector_field_1 = [_get_expression_function(field, variables, parameters) for field in fields]
+	manifold_function = _get_expression_function([job['manifold']], variables, parameters)
+	manifold = lambda x, y : manifold_function(x, y)[0]
+	
+	return pws.PiecewiseBifield(vector_field_0, vector_field_1, manifold)
+
+def _get_meshgrid_generator(job):
+	meshgrid = dict(job.get('meshgrid', {}))
+	kind = meshgrid.pop('kind', 'iso')
+	if kind not in _MESHGRID_GENERATORS:
+		raise InvalidJob(f"the meshgrid kind {kind!r} is not one of {', '.join(_MESHGRID_GENERATORS)}")
+	
+	return _MESHGRID_GENERATORS[kind](_get_pair(job, 'min_value'), _get_pair(job, 'max_value'), _get_pair(job, 'step'), **meshgrid)
+
+def generate_job_streamplot(job):
+	missing_fields = [key for key in _STREAMPLOT_FIELDS if key not in job]
+	if missing_fields:
+		raise InvalidJob(f"the fields {', '.join(missing_fields)} are missing")
+	
+	return pws.generate_streamplot(_get_piecewise_bifield(job), _get_meshgrid_generator(job), **job.get('keywords', {}))
+
+# Generates and writes the streamplot of a job; returns the answer to the job
+def run_job(job):
+	start = time.perf_counter()
+	try:
+		if not isinstance(job, dict):
+			raise InvalidJob("the job is not an object")
+		if 'directory' not in job:
+			raise InvalidJob("the field directory is missing")
+		
+		directory = job['directory']
+		# The directory is claimed before any work, so that of the jobs writing to
+		# the same directory only the first one runs
+		try:
+			os.makedirs(directory)
+		except FileExistsError:
+			raise InvalidJob(f"the directory {directory} already exists")
+		
+		try:
+			bifield_streamplot = generate_job_streamplot(job)
+			pws.write_streamplot(directory, bifield_streamplot, job.get('format', 'text'), exist_ok=True)
+		except BaseException:
+			# A job that failed leaves no directory behind, unless it wrote to it
+			try:
+				os.rmdir(directory)
+			except OSError:
+				pass
+			raise
+	except Exception as error:
+		return _get_answer(job, 'error', error=str(error))
+	
+	return _get_answer(job, 'ok', directory=directory, seconds=time.perf_counter() - start)
+
+def _get_answer(job, status, **fields):
+	job_id = job.get('id') if isinstance(job, dict) else None
+	return {'id' : job_id, 'status' : status, **fields}
+
+def _warm_up_worker():
+	generate_job_streamplot(_WARM_UP_JOB)
+
+# Pool of warm worker processes running jobs
+class JobServer:
+	def __init__(self, workers=None):
+		self.workers = workers or os.cpu_count() or 1
+		
+		context = None
+		if 'fork' in multiprocessing.get_all_start_methods():
+			context = multiprocessing.get_context('fork')
+		self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers, mp_context=context, initializer=_warm_up_worker)
+		# Forked workers all start with the first job, which is run here so that they
+		# are forked before any serving thread exists and are warm once serving starts
+		self.pool.submit(int).result()
+	
+	# Future of the answer to the job
+	def submit(self, job):
+		return self.pool.submit(run_job, job)
+	
+	# Parses a line holding a job and calls answer with the answer to the job once
+	# it is done, from another thread; returns a future done once it is answered
+	def submit_line(self, line, answer):
+		answered = concurrent.futures.Future()
+		try:
+			job = json.loads(line)
+		except json.JSONDecodeError as error:
+			answer(_get_answer(None, 'error', error=f"Invalid job: {error}"))
+			answered.set_result(None)
+			return answered
+		
+		def answer_job(future):
+			try:
+				answer(_get_future_answer(job, future))
+			finally:
+				answered.set_result(None)
+		
+		self.submit(job).add_done_callback(answer_job)
+		
+		return answered
+	
+	def close(self):
+		self.pool.shutdown()
+	
+	def __enter__(self):
+		return self
+	
+	def __exit__(self, exc_type, exc_value, traceback):
+		self.close()
+
+# Errors that escape run_job, such as a worker that died, still get an answer
+def _get_future_answer(job, future):
+	try:
+		return future.result()
+	except BaseException as error:
+		return _get_answer(job, 'error', error=repr(error))
+
+# Writes answers as JSON lines to a text output, or to a binary one when encoding
+def _get_answer_writer(output, encoding=None):
+	lock = threading.Lock()
+	
+	def answer(response):
+		line = json.dumps(response) + '\n'
+		with lock:
+			output.write(line if encoding is None else line.encode(encoding))
+			output.flush()
+	
+	return answer
+
+# Runs the jobs read line by line from input and writes their answers to output;
+# returns once every job is answered
+def serve_stream(job_server, input=sys.stdin, output=sys.stdout):
+	answer = _get_answer_writer(output)
+	futures = []
+	for line in input:
+		if line.strip():
+			futures.append(job_server.submit_line(line, answer))
+	
+	concurrent.futures.wait(futures)
+
+class _JobRequestHandler(socketserver.StreamRequestHandler):
+	def handle(self):
+		answer = _get_answer_writer(self.wfile, 'utf-8')
+		futures = []
+		for line in self.rfile:
+			if line.strip():
+				futures.append(self.server.job_server.submit_line(line, answer))
+		
+		concurrent.futures.wait(futures)
+
+class _JobSocketServer(socketserver.ThreadingUnixStreamServer):
+	daemon_threads = True
+	
+	def __init__(self, path, job_server):
+		super().__init__(path, _JobRequestHandler)
+		self.job_server = job_server
+
+# Serves the jobs sent to the Unix socket at path until interrupted; every
+# connection sends jobs line by line and receives their answers, and is closed by
+# the server once the client shut down its side and every job is answered
+def serve_socket(job_server, path):
+	with _JobSocketServer(path, job_server) as socket_server:
+		try:
+			socket_server.serve_forever()
+		finally:
+			os.remove(path)
+
+def test():
+	import contextlib
+	import io
+	import tempfile
+	
+	test_results = []
+	
+	# Expressions may not reach objects through anything but the allowed names,
+	# however deep in the expression
+	names = {'x', 'y', *_FUNCTIONS}
+	rejected_expressions = [
+		'(lambda: ().__class__.__base__.__subclasses__())() and x',
+		'x.__class__', 'x[0]', '[x for x in y]', '{x : y}', 'exp(x=y)',
+		'__builtins__', 'open', '"x"', 'x if (lambda: 1) else y'
+	]
+	for expression in rejected_expressions:
+		try:
+			_compile_expression(expression, names)
+			test_results.append(False)
+		except InvalidJob:
+			test_results.append(True)
+	
+	code = _compile_expression('where(x > 0, sqrt(x), -y) + 2**3', names)
+	test_results.append(eval(code, {'__builtins__' : {}, **_FUNCTIONS}, {'x' : 4.0, 'y' : 1.0}) == 10.0)
+	
+	with tempfile.TemporaryDirectory() as directory:
+		job = {**_WARM_UP_JOB, 'id' : 'job', 'directory' : os.path.join(directory, 'plots', 'job')}
+		payload_job = {**job, 'manifold' : rejected_expressions[0]}
+		
+		output = io.StringIO()
+		with contextlib.redirect_stdout(output):
+			payload_answer = run_job(payload_job)
+			# Of the jobs writing to the same directory only the first one runs
+			with concurrent.futures.ThreadPoolExecutor(max_workers=2) as pool:
+				answers = list(pool.map(run_job, [job, job]))
+		
+		test_results.append(payload_answer['status'] == 'error' and payload_answer['id'] == 'job')
+		test_results.append(sorted(answer['status'] for answer in answers) == ['error', 'ok'])
+		test_results.append(sorted(os.listdir(job['directory'])) == sorted([
+			'streamlines_0.dat', 'streamlines_1.dat', 'switching_manifold.dat', 'streamlines_sliding.dat',
+			'streamarrows_0.dat', 'streamarrows_1.dat', 'streamarrows_sliding.dat'
+		]))
+		test_results.append(output.getvalue() == '')
+	
+	return all(test_results)
+
+def main():
+	parser = argparse.ArgumentParser(description='Generate the streamplots of JSON jobs on a pool of warm worker processes')
+	parser.add_argument('--socket', help='serve the jobs sent to this Unix socket instead of the standard input')
+	parser.add_argument('--workers', type=int, help='number of worker processes, one per core by default')
+	arguments = parser.parse_args()
+	
+	with JobServer(arguments.workers) as job_server:
+		if arguments.socket is None:
+			serve_stream(job_server)
+		else:
+			try:
+				serve_socket(job_server, arguments.socket)
+			except KeyboardInterrupt:
+				pass
+	
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
@@ -0,0 +1,157 @@
+import numpy as np
+
+import datastructures as struct
+
+# Sliding motion
+#
+# Field 0 applies where the switching manifold is positive and field 1 where it is
+# negative. Where both fields point into the manifold, trajectories reaching it
+# slide along it with the Filippov sliding vector field, the convex combination
+# f_s = lambda*f_0 + (1 - lambda)*f_1 tangent to the manifold, with
+# lambda = n.f_1 / (n.f_1 - n.f_0) for a normal n pointing to the positive side.
+# In the plane the sliding trajectories run along the manifold curve itself, in
+# the direction of t.f_s for a tangent t, and stop at the tangency points that
+# bound the sliding region and at the pseudo-equilibria where t.f_s vanishes.
+#
+# The manifold polylines of the contours module keep the positive side on their
+# left, so the normal is the tangent turned counterclockwise.
+
+def evaluate_vector_field(vector_field, points):
+	points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+	Fx, Fy = vector_field(points[:,0], points[:,1])
+	
+	return np.stack((np.broadcast_to(Fx, len(points)), np.broadcast_to(Fy, len(points))), axis=1).astype(np.float64)
+
+# Unit tangents of the lines at their vertices, by central differences inside the
+# lines and one sided differences at their ends
+def _get_vertex_tangents(lines):
+	vertices = lines.vertices
+	offsets = lines.offsets
+	
+	starts = offsets[:-1]
+	ends = offsets[1:] - 1
+	non_empty = starts <= ends
+	
+	previous_vertex = np.arange(len(vertices)) - 1
+	next_vertex = np.arange(len(vertices)) + 1
+	previous_vertex[starts[non_empty]] = starts[non_empty]
+	next_vertex[ends[non_empty]] = ends[non_empty]
+	
+	tangents = vertices[next_vertex] - vertices[previous_vertex]
+	norms = np.hypot(tangents[:,0], tangents[:,1])
+	tangents[norms > 0] /= norms[norms > 0,np.newaxis]
+	
+	return tangents
+
+def _get_zero_crossing_parameters(f_0, f_1):
+	return np.clip(f_0 / (f_0 - f_1), 0.0, 1.0)
+
+# Reverses the runs [begin, end) of a sequence whose reverse flag is set
+def _get_run_order(offsets, reverse):
+	run_sizes = np.diff(offsets)
+	run_of_point = np.repeat(np.arange(len(run_sizes)), run_sizes)
+	order = np.arange(offsets[-1])
+	
+	reversed_points = reverse[run_of_point]
+	order[reversed_points] = (offsets[:-1] + offsets[1:] - 1)[run_of_point[reversed_points]] - order[reversed_points]
+	
+	return order
+
+# Sliding trajectories along the switching manifold polylines, oriented along the
+# sliding flow
+def get_sliding_lines(manifold_lines, vector_field_0, vector_field_1):
+	manifold_lines = struct.PolylineSet.from_lines(manifold_lines)
+	vertices = manifold_lines.vertices
+	if len(vertices) == 0:
+		return struct.PolylineSet.empty()
+	
+	tangents = _get_vertex_tangents(manifold_lines)
+	normals = np.stack((-tangents[:,1], tangents[:,0]), axis=1)
+	
+	F_0 = evaluate_vector_field(vector_field_0, vertices)
+	F_1 = evaluate_vector_field(vector_field_1, vertices)
+	normal_0 = np.sum(normals * F_0, axis=1)
+	normal_1 = np.sum(normals * F_1, axis=1)
+	
+	# Positive exactly where both fields point into the manifold
+	attraction = np.minimum(-normal_0, normal_1)
+	sliding = attraction > 0
+	
+	F_s = np.zeros(vertices.shape)
+	weight = normal_1[sliding] / (normal_1[sliding] - normal_0[sliding])
+	F_s[sliding] = weight[:,np.newaxis] * F_0[sliding] + (1 - weight[:,np.newaxis]) * F_1[sliding]
+	tangent_flow = np.sum(tangents * F_s, axis=1)
+	
+	# Vertices are labelled by their direction of sliding, 0 where there is none
+	direction = np.where(sliding, np.where(tangent_flow < 0, -1, 1), 0)
+	line_of_vertex = np.repeat(np.arange(len(manifold_lines)), manifold_lines.line_sizes())
+	
+	# Segments along which the label changes are cut at the tangency point or at
+	# the pseudo-equilibrium, which ends the run before and starts the run after
+	cut = np.flatnonzero((direction[:-1] != direction[1:]) & (line_of_vertex[:-1] == line_of_vertex[1:]))
+	at_equilibrium = (direction[cut] != 0) & (direction[cut+1] != 0)
+	t = np.where(at_equilibrium,
+		_get_zero_crossing_parameters(tangent_flow[cut], tangent_flow[cut+1]),
+		_get_zero_crossing_parameters(attraction[cut], attraction[cut+1]))
+	cut_points = vertices[cut] + t[:,np.newaxis] * (vertices[cut+1] - vertices[cut])
+	
+	points = np.concatenate((vertices, cut_points, cut_points))
+	labels = np.concatenate((direction, direction[cut], direction[cut+1]))
+	lines = np.concatenate((line_of_vertex, line_of_vertex[cut], line_of_vertex[cut]))
+	position = np.concatenate((np.arange(len(vertices)), cut + 0.25, cut + 0.75))
+	
+	order = np.argsort(position, kind='stable')
+	points = points[order]
+	labels = labels[order]
+	lines = lines[order]
+	
+	keep = labels != 0
+	points = points[keep]
+	labels = labels[keep]
+	lines = lines[keep]
+	kept_order = np.flatnonzero(keep)
+	if len(points) == 0:
+		return struct.PolylineSet.empty()
+	
+	run_start = np.ones(len(points), dtype=bool)
+	run_start[1:] = (labels[1:] != labels[:-1]) | (lines[1:] != lines[:-1]) | (kept_order[1:] != kept_order[:-1] + 1)
+	offsets = np.append(np.flatnonzero(run_start), len(points))
+	
+	order = _get_run_order(offsets, labels[offsets[:-1]] < 0)
+	sliding_lines = struct.PolylineSet(points[order], offsets)
+	
+	# Runs reduced to a single point are not lines
+	if np.any(sliding_lines.line_sizes() < 2):
+		sliding_lines = struct.PolylineSet.from_lines([line for line in sliding_lines if len(line) > 1])
+	
+	return sliding_lines
+
+def test():
+	import piecewise_smooth_field as pws
+	import contours as contours
+	import crossings as crossings
+	
+	piecewise_bifield, min_value, max_value, step = pws.get_buck_converter_system()
+	x = np.arange(min_value[0], max_value[0], step[0])
+	y = np.arange(min_value[1], max_value[1], step[1])
+	X, Y = np.meshgrid(x, y)
+	S = crossings.evaluate_manifold(piecewise_bifield.manifold, X, Y)
+	manifold_lines = contours.get_level_contour(X, Y, S, manifold=piecewise_bifield.manifold)
+	sliding_lines = get_sliding_lines(manifold_lines, piecewise_bifield.vector_field_0, piecewise_bifield.vector_field_1)
+	
+	# On the manifold i_L = 40.5 - v_C, the converter slides for v_C below the
+	# tangency point of field 1, towards the pseudo-equilibrium (4.5, 36)
+	L, C, E = (1.7e-3, 0.6e-3, 48)
+	v_C_tangency = (E/L + 40.5/C) / (1/L + 1.125/C)
+	starts = sorted(tuple(line[0]) for line in sliding_lines)
+	
+	test_results = []
+	test_results.append(len(sliding_lines) == 2)
+	test_results.append(all(np.allclose(line[-1], [4.5, 36], atol=1e-9) for line in sliding_lines))
+	test_results.append(np.allclose(starts[0], [40.5 - v_C_tangency, v_C_tangency], atol=1e-9))
+	test_results.append(np.allclose(starts[1], [x[-1], 40.5 - x[-1]], atol=1e-9))
+	
+	return all(test_results)
+
+if __name__ == '__main__':
+	print(test())
@@ -1,79 +1,14 @@
 import numpy as np
-import matplotlib.pyplot as plt
-import bitstring as btstr
 
 import abc
+import types
 
 import sys
 import os
 
 import datastructures as struct
-
-class _LineKeys:
-	def __init__(self):
-		self.__begin = {}
-		self.__end = {}
-	
-	def insert(self, k):
-		k_begin, k_end = k
-		self.__begin[k_begin] = k
-		self.__end[k_end] = k
-	
-	def pop_front(self, k_end):
-		k = self.__begin.pop(k_end)
-		self.__end.pop(k[1])
-		return k
-	
-	def pop_back(self, k_begin):
-		k = self.__end.pop(k_begin)
-		self.__begin.pop(k[0])
-		return k
-	
-	def get_front_keys(self):
-		return self.__begin
-	
-	def get_back_keys(self):
-		return self.__end
-
-class _LineEdgesMap:
-	def __init__(self):
-		self.__line_keys = _LineKeys()
-		self.__begin = {}
-		self.__end = {}
-	
-	def insert(self, k, line):
-		self.__line_keys.insert(k)
-		
-		k_begin, k_end = k
-		
-		self.__begin[k_begin] = line
-		self.__end[k_end] = line
-	
-	def pop_front(self, k_end):
-		k = self.__line_keys.pop_front(k_end)
-		line = self.__begin.pop(k[0])
-		self.__end.pop(k[1])
-		
-		return (k, line)
-	
-	def pop_back(self, k_begin):
-		k = self.__line_keys.pop_back(k_begin)
-		line = self.__end.pop(k[1])
-		self.__begin.pop(k[0])
-		
-		return (k, line)
-	
-	def get_front_list(self):
-		return (self.__line_keys.get_front_keys(), self.__begin)
-	
-	def get_back_list(self):
-		return (self.__line_keys.get_back_keys(), self.__end)
-	
-	def exists_line_begining_with(self, key):
-		return key in self.__line_keys.get_front_keys()
-	
-	def exists_line_ending_with(self, key):
-		return key in self.__line_keys.get_back_keys()
+import tiles as tiles
+import profiling as profiling
 
 class Meshgrid:
 	def __init__(self, X, Y, Fx, Fy):
@@ -109,238 +44,1197 @@ class IsoMeshgridGenerator(MeshgridGenerator):
 		
 		return Meshgrid(X, Y, Fx, Fy)
 
-def __get_key_of_point(point):
-	c0 = btstr.BitArray(float=point[0], length=64).hex
-	c1 = btstr.BitArray(float=point[1], length=64).hex
-	return (c0, c1)
-
-def __get_key_of_segment(segment):
-	k_begin = __get_key_of_point(segment[0,:])
-	k_end = __get_key_of_point(segment[1,:])
-	
-	return (k_begin, k_end)
-
-def __connect_two_lines_with_segment(line_edges_map, connecting_segment_key):
-	connecting_segment_start_key, connecting_segment_end_key = connecting_segment_key
-	back_line_part_key, back_line_part = line_edges_map.pop_front(connecting_segment_end_key)
-	front_line_part_key, front_line_part = line_edges_map.pop_back(connecting_segment_start_key)
-	front_line_part.append_back(back_line_part)
-	front_line_part_start_key, _ = front_line_part_key
-	_, back_line_part_end_key = back_line_part_key
-	line_edges_map.insert((front_line_part_start_key, back_line_part_end_key), front_line_part)
-
-def __extend_line_front_with_segment(line_edges_map, segment, segment_key):
-	segment_start_key, segment_end_key = segment_key
-	line_key, line = line_edges_map.pop_front(segment_end_key)
-	segment_start_point = segment[0,:]
-	line.push_front(segment_start_point)
-	_, line_end_key = line_key
-	line_edges_map.insert((segment_start_key, line_end_key), line)
-
-def __extend_line_back_with_segment(line_edges_map, segment, segment_key):
-	segment_start_key, segment_end_key = segment_key
-	line_key, line = line_edges_map.pop_back(segment_start_key)
-	segment_end_point = segment[1,:]
-	line.push_back(segment_end_point)
-	line_start_key, _ = line_key
-	line_edges_map.insert((line_start_key, segment_end_key), line)
-
-def __create_new_line(line_edges_map, segment, segment_key):
-	line = struct.Dequeue()
-	line.push_front(segment[0,:])
-	line.push_back(segment[1,:])
-	line_edges_map.insert(segment_key, line)
-
-def __insert_segment_in_lines(line_edges_map, segment):
-	segment_key = __get_key_of_segment(segment)
-	segment_start_key, segment_end_key = segment_key
-	
-	if line_edges_map.exists_line_begining_with(segment_end_key):
-		if line_edges_map.exists_line_ending_with(segment_start_key):
-			__connect_two_lines_with_segment(line_edges_map, segment_key)
+def __get_point_ids(segments):
+	# Points are identified by the raw bit patterns of their coordinates
+	keys = np.ascontiguousarray(segments, dtype=np.float64).view(np.uint64).reshape(-1, 2)
+	
+	order = np.lexsort((keys[:,1], keys[:,0]))
+	sorted_keys = keys[order]
+	new_key = np.empty(len(order), dtype=bool)
+	new_key[:1] = True
+	np.any(sorted_keys[1:] != sorted_keys[:-1], axis=1, out=new_key[1:])
+	
+	point_ids = np.empty(len(order), dtype=np.int64)
+	point_ids[order] = np.cumsum(new_key) - 1
+	point_ids = point_ids.reshape(-1, 2)
+	
+	return (point_ids[:,0], point_ids[:,1])
+
+def __get_predecessors(start_ids, end_ids):
+	n_segments = len(start_ids)
+	
+	# A segment succeeds the first segment starting where it ends
+	by_start = np.argsort(start_ids, kind='stable')
+	sorted_start_ids = start_ids[by_start]
+	position = np.minimum(np.searchsorted(sorted_start_ids, end_ids, side='left'), max(n_segments - 1, 0))
+	has_successor = sorted_start_ids[position] == end_ids
+	
+	segment = np.flatnonzero(has_successor)
+	successor = by_start[position[has_successor]]
+	
+	# When several segments end where the same segment starts keep the first
+	successor, first = np.unique(successor, return_index=True)
+	
+	predecessor = np.full(n_segments, -1, dtype=np.int64)
+	predecessor[successor] = segment[first]
+	
+	return predecessor
+
+def __rank_segments(predecessor):
+	n_segments = len(predecessor)
+	index = np.arange(n_segments)
+	
+	# Pointer jumping: head of the chain of each segment and distance to it
+	head = np.where(predecessor >= 0, predecessor, index)
+	rank = (predecessor >= 0).astype(np.int64)
+	for _ in range(int(n_segments).bit_length() + 1):
+		if np.all(head[head] == head):
+			break
+		rank = rank + rank[head]
+		head = head[head]
+	
+	return (head, rank, head[head] == head)
+
+def __break_cycles(predecessor, in_cycle):
+	# Closed chains start at their segment of lowest index
+	visited = ~in_cycle
+	for segment in np.flatnonzero(in_cycle):
+		if visited[segment]:
+			continue
+		cycle = [segment]
+		visited[segment] = True
+		current = predecessor[segment]
+		while current != segment:
+			cycle.append(current)
+			visited[current] = True
+			current = predecessor[current]
+		predecessor[min(cycle)] = -1
+	
+	return predecessor
+
+# Orders segments into chains where each segment ends where the next one starts.
+# Returns the segment indices chain by chain and the offsets of the chains in that
+# order; chains are sorted by the index of their first segment.
+def chain_segments(start_ids, end_ids):
+	start_ids = np.asarray(start_ids, dtype=np.int64)
+	end_ids = np.asarray(end_ids, dtype=np.int64)
+	
+	predecessor = __get_predecessors(start_ids, end_ids)
+	head, rank, acyclic = __rank_segments(predecessor)
+	if not acyclic.all():
+		predecessor = __break_cycles(predecessor, ~acyclic)
+		head, rank, _ = __rank_segments(predecessor)
+	
+	order = np.lexsort((rank, head))
+	chain_start = np.flatnonzero(rank[order] == 0)
+	offsets = np.append(chain_start, len(order))
+	
+	return (order, offsets)
+
+# Joins (N, 2, 2) segments into polylines, given integer identifiers of their
+# start and end points. Returns the vertices and offsets of the polylines.
+def chain_segments_into_polylines(segments, start_ids, end_ids):
+	order, chain_offsets = chain_segments(start_ids, end_ids)
+	n_chains = len(chain_offsets) - 1
+	
+	# Each line holds the start of its first segment and the ends of all its segments
+	chain_index = np.repeat(np.arange(n_chains), np.diff(chain_offsets))
+	vertices = np.empty((len(order) + n_chains, 2))
+	vertices[np.arange(len(order)) + chain_index + 1] = segments[order, 1]
+	offsets = chain_offsets + np.arange(n_chains + 1)
+	vertices[offsets[:-1]] = segments[order[chain_offsets[:-1]], 0]
+	
+	return (vertices, offsets)
+
+def __polylines_to_segments(polylines):
+	if len(polylines) == 0:
+		return np.empty((0, 2, 2))
+	
+	points = np.concatenate([np.asarray(polyline, dtype=np.float64).reshape(-1, 2) for polyline in polylines])
+	lengths = np.array([len(polyline) for polyline in polylines])
+	
+	# Consecutive points of the same polyline form a segment
+	is_last = np.zeros(len(points), dtype=bool)
+	is_last[np.cumsum(lengths)[lengths > 0] - 1] = True
+	begin = np.flatnonzero(~is_last)
+	
+	return np.stack((points[begin], points[begin + 1]), axis=1)
+
+def __segments_to_streamlines(segments):
+	if len(segments) == 0:
+		return (np.empty((0, 2)), np.zeros(1, dtype=np.int64))
+	
+	segments = np.ascontiguousarray(segments, dtype=np.float64)
+	
+	start_ids, end_ids = __get_point_ids(segments)
+	non_singular = start_ids != end_ids
+	segments = segments[non_singular]
+	start_ids = start_ids[non_singular]
+	end_ids = end_ids[non_singular]
+	
+	return chain_segments_into_polylines(segments, start_ids, end_ids)
+
+# Native streamline integration
+#
+# Reimplements the trajectory integration of matplotlib.pyplot.streamplot without
+# any figure state: seeds are placed in a spiral over a density mask, trajectories
+# are integrated with an adaptive RK12 scheme in grid coordinates, and each
+# trajectory is emitted directly as an ordered polyline.
+
+__STEP_OK = 0
+__STEP_OUT_OF_BOUNDS = 1
+__STEP_TERMINATE = 2
+
+# Lines of the chunks in which stream lines are yielded as they are integrated
+DEFAULT_CHUNK_SIZE = 256
+
+# Cells of the density mask per unit of density along each axis
+MASK_CELLS = 30
+
+class UnknownEngine(Exception):
+	def __init__(self, unknown_engine, *args):
+		super().__init__(*args)
+		self.unknown_engine = unknown_engine
+	
+	def __str__(self):
+		return f"The streamline engine {self.unknown_engine} is not known"
+
+class _StreamIntegrationGrid:
+	def __init__(self, meshgrid, density):
+		x = np.asarray(meshgrid.X)[0,:]
+		y = np.asarray(meshgrid.Y)[:,0]
+		
+		self.nx = len(x)
+		self.ny = len(y)
+		self.x_origin = x[0]
+		self.y_origin = y[0]
+		self.width = x[-1] - x[0]
+		self.height = y[-1] - y[0]
+		self.x_data2grid = 1. / (x[1] - x[0])
+		self.y_data2grid = 1. / (y[1] - y[0])
+		
+		# Tiled fields are converted tile by tile as trajectories reach them
+		if isinstance(meshgrid, PreparedMeshgrid):
+			self.u, self.v, self.speed = meshgrid.velocities
+		elif isinstance(meshgrid.Fx, tiles.TiledArray) and isinstance(meshgrid.Fy, tiles.TiledArray):
+			self.u, self.v, self.speed = tiles.map_tiles(self.__get_velocities, meshgrid.Fx, meshgrid.Fy)
 		else:
-			__extend_line_front_with_segment(line_edges_map, segment, segment_key)
-	elif line_edges_map.exists_line_ending_with(segment_start_key):
-		__extend_line_back_with_segment(line_edges_map, segment, segment_key)
+			self.u, self.v, self.speed = self.__get_velocities(np.asarray(meshgrid.Fx), np.asarray(meshgrid.Fy))
+		
+		# Grids without a density only convert the velocities
+		if density is None:
+			return
+		
+		mask_nx, mask_ny = (MASK_CELLS * np.broadcast_to(density, 2)).astype(int)
+		if mask_nx < 0 or mask_ny < 0:
+			raise ValueError("'density' must be positive")
+		self.mask = np.zeros((mask_ny, mask_nx), dtype=np.int8)
+		self.x_grid2mask = (mask_nx - 1) / (self.nx - 1)
+		self.y_grid2mask = (mask_ny - 1) / (self.ny - 1)
+		self.x_mask2grid = 1. / self.x_grid2mask
+		self.y_mask2grid = 1. / self.y_grid2mask
+		
+		# Mask cell last entered and cells entered by the current trajectory
+		self.current_cell = np.full(2, -1, dtype=np.int64)
+		self.trajectory_cells = np.empty((mask_nx * mask_ny, 2), dtype=np.int64)
+		self.trajectory_cell_count = np.zeros(1, dtype=np.int64)
+	
+	# Velocities in grid coordinates, speed in axes coordinates
+	def __get_velocities(self, Fx, Fy):
+		u = np.asarray(Fx, dtype=np.float64) * self.x_data2grid
+		v = np.asarray(Fy, dtype=np.float64) * self.y_data2grid
+		speed = np.sqrt((u / (self.nx - 1))**2 + (v / (self.ny - 1))**2)
+		
+		return (u, v, speed)
+	
+	def grid2data(self, xg, yg):
+		return (xg / self.x_data2grid + self.x_origin, yg / self.y_data2grid + self.y_origin)
+	
+	def data2grid(self, xd, yd):
+		return ((xd - self.x_origin) * self.x_data2grid, (yd - self.y_origin) * self.y_data2grid)
+
+# Meshgrid whose velocities are converted for the integrator once, for meshgrids
+# integrated many times from different start points
+class PreparedMeshgrid(Meshgrid):
+	def __init__(self, meshgrid):
+		super().__init__(meshgrid.X, meshgrid.Y, meshgrid.Fx, meshgrid.Fy)
+		grid = _StreamIntegrationGrid(meshgrid, None)
+		self.velocities = (grid.u, grid.v, grid.speed)
+
+def __within_grid(a, xi, yi):
+	ny, nx = a.shape
+	return 0 <= xi <= nx - 1 and 0 <= yi <= ny - 1
+
+def __interpolate(a, xi, yi):
+	ny, nx = a.shape
+	x = int(xi)
+	y = int(yi)
+	xn = x if x == nx - 1 else x + 1
+	yn = y if y == ny - 1 else y + 1
+	
+	xt = xi - x
+	yt = yi - y
+	a0 = a[y, x] * (1 - xt) + a[y, xn] * xt
+	a1 = a[yn, x] * (1 - xt) + a[yn, xn] * xt
+	
+	return a0 * (1 - yt) + a1 * yt
+
+def __get_step_direction(u, v, speed, xi, yi, time_direction):
+	if not __within_grid(speed, xi, yi):
+		return (__STEP_OUT_OF_BOUNDS, 0.0, 0.0)
+	
+	ds_dt = __interpolate(speed, xi, yi)
+	if np.isnan(ds_dt) or ds_dt == 0:
+		return (__STEP_TERMINATE, 0.0, 0.0)
+	dt_ds = 1. / ds_dt
+	
+	ui = __interpolate(u, xi, yi)
+	vi = __interpolate(v, xi, yi)
+	if np.isnan(ui) or np.isnan(vi):
+		return (__STEP_TERMINATE, 0.0, 0.0)
+	
+	return (__STEP_OK, time_direction * (ui * dt_ds), time_direction * (vi * dt_ds))
+
+def __enter_mask_cell(mask, current_cell, trajectory_cells, trajectory_cell_count, xm, ym, broken_streamlines):
+	if current_cell[0] != xm or current_cell[1] != ym:
+		if mask[ym, xm] == 0:
+			n = trajectory_cell_count[0]
+			trajectory_cells[n, 0] = ym
+			trajectory_cells[n, 1] = xm
+			trajectory_cell_count[0] = n + 1
+			mask[ym, xm] = 1
+			current_cell[0] = xm
+			current_cell[1] = ym
+		elif broken_streamlines:
+			return False
+	
+	return True
+
+def __euler_step_to_boundary(u, v, speed, xs, ys, time_direction):
+	ny, nx = speed.shape
+	xi = xs[-1]
+	yi = ys[-1]
+	status, cx, cy = __get_step_direction(u, v, speed, xi, yi, time_direction)
+	if status != __STEP_OK:
+		return 0.0
+	
+	if cx == 0:
+		dsx = np.inf
+	elif cx < 0:
+		dsx = xi / -cx
 	else:
-		__create_new_line(line_edges_map, segment, segment_key)
+		dsx = (nx - 1 - xi) / cx
+	if cy == 0:
+		dsy = np.inf
+	elif cy < 0:
+		dsy = yi / -cy
+	else:
+		dsy = (ny - 1 - yi) / cy
+	ds = min(dsx, dsy)
+	
+	xs.append(xi + cx * ds)
+	ys.append(yi + cy * ds)
+	
+	return ds
 
-def __convert_LineEdgesMap_to_List(line_segments):
-	keys, lines = line_segments.get_front_list()
+def __integrate_rk12(u, v, speed, mask, current_cell, trajectory_cells, trajectory_cell_count,
+		x_grid2mask, y_grid2mask, x0, y0, time_direction, maxlength, broken_streamlines,
+		max_step_scale, max_error_scale):
+	ny, nx = speed.shape
+	mask_ny, mask_nx = mask.shape
+	
+	# Maximum error in axes coordinates, tuned for visual quality
+	maxerror = 0.003 * max_error_scale
+	# Small enough steps so that no mask cell is skipped
+	maxds = min(1. / mask_nx, 1. / mask_ny, 0.1) * max_step_scale
 	
-	stream_lines = []
-	for line_key in keys:
-		stream_line = []
-		line = lines[line_key]
-		while not line.empty():
-			point = line.front()
-			stream_line.append(point)
-			line.pop_front()
-		stream_lines.append(stream_line)
+	ds = maxds
+	stotal = 0.0
+	xi = x0
+	yi = y0
+	xs = []
+	ys = []
 	
-	return stream_lines
+	while True:
+		if not __within_grid(speed, xi, yi):
+			if xs:
+				stotal = stotal + __euler_step_to_boundary(u, v, speed, xs, ys, time_direction)
+			break
+		xs.append(xi)
+		ys.append(yi)
+		
+		status, k1x, k1y = __get_step_direction(u, v, speed, xi, yi, time_direction)
+		if status == __STEP_OK:
+			status, k2x, k2y = __get_step_direction(u, v, speed, xi + ds * k1x, yi + ds * k1y, time_direction)
+		if status == __STEP_OUT_OF_BOUNDS:
+			stotal = stotal + __euler_step_to_boundary(u, v, speed, xs, ys, time_direction)
+			break
+		elif status == __STEP_TERMINATE:
+			break
+		
+		dx1 = ds * k1x
+		dy1 = ds * k1y
+		dx2 = ds * 0.5 * (k1x + k2x)
+		dy2 = ds * 0.5 * (k1y + k2y)
+		
+		error = np.hypot((dx2 - dx1) / (nx - 1), (dy2 - dy1) / (ny - 1))
+		
+		if error < maxerror:
+			xi += dx2
+			yi += dy2
+			if not __within_grid(speed, xi, yi):
+				break
+			xm = round(xi * x_grid2mask)
+			ym = round(yi * y_grid2mask)
+			if not __enter_mask_cell(mask, current_cell, trajectory_cells, trajectory_cell_count, xm, ym, broken_streamlines):
+				break
+			if stotal + ds > maxlength:
+				break
+			stotal += ds
+		
+		if error == 0:
+			ds = maxds
+		else:
+			ds = min(maxds, 0.85 * ds * np.sqrt(maxerror / error))
+	
+	return (stotal, xs, ys)
 
-def __is_singular(segment):
-	k_begin, k_end = __get_key_of_segment(segment)
-	return k_begin == k_end
+# Compiled kernels
+#
+# When Numba is installed, the kernels of the integration steps above, from the
+# interpolation to the density mask bookkeeping, can be compiled to machine code.
+# The compiled kernels are copies of the same functions calling one another, built
+# on first use, so that both kernels trace exactly the same trajectories. Without
+# Numba the kernels are left to the interpreter.
 
-def __segments_to_streamlines(segments):
-	non_singular_segments = filter(lambda segment : not(__is_singular(segment)), segments)
+__COMPILED_KERNELS = [
+	'__within_grid',
+	'__interpolate',
+	'__get_step_direction',
+	'__enter_mask_cell',
+	'__euler_step_to_boundary',
+	'__integrate_rk12'
+]
+__compiled_kernels = {}
+
+def __compile_kernels():
+	try:
+		import numba
+	except ImportError:
+		return None
+	
+	namespace = dict(globals())
+	for name in __COMPILED_KERNELS:
+		kernel = globals()[name]
+		namespace[name] = numba.njit(types.FunctionType(kernel.__code__, namespace, name, kernel.__defaults__))
+	
+	return namespace['__integrate_rk12']
+
+def is_compiled_engine_available():
+	if 'integrate_rk12' not in __compiled_kernels:
+		__compiled_kernels['integrate_rk12'] = __compile_kernels()
+	return __compiled_kernels['integrate_rk12'] is not None
+
+# Compiled kernels only read plain arrays; tiled fields stay with the interpreter
+def __get_integrate_rk12(grid, compiled):
+	if compiled and is_compiled_engine_available() and all(isinstance(a, np.ndarray) for a in [grid.u, grid.v, grid.speed]):
+		return __compiled_kernels['integrate_rk12']
+	return __integrate_rk12
+
+def __integrate_trajectory(grid, integrate_rk12, x0, y0, minlength, maxlength, integration_direction,
+		broken_streamlines, max_step_scale, max_error_scale):
+	mask = grid.mask
+	
+	grid.trajectory_cell_count[0] = 0
+	xm = round(x0 * grid.x_grid2mask)
+	ym = round(y0 * grid.y_grid2mask)
+	if not __enter_mask_cell(mask, grid.current_cell, grid.trajectory_cells, grid.trajectory_cell_count, xm, ym, broken_streamlines):
+		return None
 	
-	lines = _LineEdgesMap()
-	for segment in non_singular_segments:
-		__insert_segment_in_lines(lines, segment)
+	def integrate(time_direction):
+		return integrate_rk12(grid.u, grid.v, grid.speed,
+			mask, grid.current_cell, grid.trajectory_cells, grid.trajectory_cell_count,
+			grid.x_grid2mask, grid.y_grid2mask,
+			x0, y0, time_direction, maxlength, broken_streamlines,
+			max_step_scale, max_error_scale)
 	
-	stream_lines = __convert_LineEdgesMap_to_List(lines)
+	stotal = 0.0
+	xs = []
+	ys = []
+	if integration_direction in ['both', 'backward']:
+		s, xs_backward, ys_backward = integrate(-1.0)
+		stotal += s
+		xs = xs_backward[::-1]
+		ys = ys_backward[::-1]
 	
-	return stream_lines
+	if integration_direction in ['both', 'forward']:
+		grid.current_cell[0] = xm
+		grid.current_cell[1] = ym
+		s, xs_forward, ys_forward = integrate(1.0)
+		stotal += s
+		xs = xs + xs_forward[1:]
+		ys = ys + ys_forward[1:]
+	
+	if stotal > minlength:
+		return grid.grid2data(np.array(xs), np.array(ys))
+	
+	# Reject short trajectories
+	cells = grid.trajectory_cells[:grid.trajectory_cell_count[0]]
+	mask[cells[:,0], cells[:,1]] = 0
+	return None
+
+def __spiral_seeds(mask_shape):
+	# Seeds on the boundary first give higher quality streamlines
+	ny, nx = mask_shape
+	xfirst = 0
+	yfirst = 1
+	xlast = nx - 1
+	ylast = ny - 1
+	x, y = 0, 0
+	direction = 'right'
+	for _ in range(nx * ny):
+		yield x, y
+		
+		if direction == 'right':
+			x += 1
+			if x >= xlast:
+				xlast -= 1
+				direction = 'up'
+		elif direction == 'up':
+			y += 1
+			if y >= ylast:
+				ylast -= 1
+				direction = 'left'
+		elif direction == 'left':
+			x -= 1
+			if x <= xfirst:
+				xfirst += 1
+				direction = 'down'
+		elif direction == 'down':
+			y -= 1
+			if y <= yfirst:
+				yfirst += 1
+				direction = 'right'
+
+def __get_grid_start_points(grid, start_points):
+	start_points = np.asarray(start_points, dtype=np.float64).reshape(-1, 2)
+	
+	for xs, ys in start_points:
+		if not (grid.x_origin <= xs <= grid.x_origin + grid.width and grid.y_origin <= ys <= grid.y_origin + grid.height):
+			raise ValueError(f"Starting point ({xs}, {ys}) outside of data boundaries")
+	
+	xg, yg = grid.data2grid(start_points[:,0], start_points[:,1])
+	xg = np.clip(xg, 0, grid.nx - 1)
+	yg = np.clip(yg, 0, grid.ny - 1)
+	
+	return zip(xg.tolist(), yg.tolist())
+
+def __trajectories_to_polylines(trajectories):
+	if not trajectories:
+		return struct.PolylineSet.empty()
+	
+	tx = np.concatenate([tx for tx, _ in trajectories])
+	ty = np.concatenate([ty for _, ty in trajectories])
+	trajectory_offsets = np.cumsum([0] + [len(tx) for tx, _ in trajectories])
+	
+	# Drop repeated points, which form singular segments
+	keep = np.ones(len(tx), dtype=bool)
+	keep[1:] = (tx[1:] != tx[:-1]) | (ty[1:] != ty[:-1])
+	keep[trajectory_offsets[:-1]] = True
+	
+	offsets = np.cumsum(np.concatenate(([0], keep)))[trajectory_offsets]
+	polylines = struct.PolylineSet(np.stack((tx[keep], ty[keep]), axis=1), offsets)
+	
+	# Trajectories reduced to a single point are not lines
+	if np.any(polylines.line_sizes() < 2):
+		polylines = struct.PolylineSet.from_lines([line for line in polylines if len(line) > 1])
+	
+	return polylines
+
+def __iterate_trajectories(grid, start_points, integrate):
+	if start_points is None:
+		for xm, ym in __spiral_seeds(grid.mask.shape):
+			if grid.mask[ym, xm] == 0:
+				trajectory = integrate(xm * grid.x_mask2grid, ym * grid.y_mask2grid)
+				if trajectory is not None:
+					yield trajectory
+	else:
+		for xg, yg in __get_grid_start_points(grid, start_points):
+			trajectory = integrate(xg, yg)
+			if trajectory is not None:
+				yield trajectory
 
-def generate_stream_lines(meshgrid, *argv, **kwargs):
+# Integrates the stream lines like integrate_stream_lines, but yields them as they
+# are integrated, in chunks of up to chunk_size lines; there is always at least one
+# chunk, possibly empty
+def iterate_stream_lines(meshgrid, density=1, minlength=0.1, start_points=None, maxlength=4.0,
+		integration_direction='both', broken_streamlines=True,
+		integration_max_step_scale=1.0, integration_max_error_scale=1.0, compiled=False,
+		chunk_size=DEFAULT_CHUNK_SIZE):
+	if integration_direction not in ['both', 'forward', 'backward']:
+		raise ValueError(f"'{integration_direction}' is not a valid integration direction")
+	if integration_direction == 'both':
+		maxlength /= 2.
+	
+	grid = _StreamIntegrationGrid(meshgrid, density)
+	integrate_rk12 = __get_integrate_rk12(grid, compiled)
+	
+	def integrate(xg, yg):
+		return __integrate_trajectory(grid, integrate_rk12, xg, yg, minlength, maxlength, integration_direction,
+			broken_streamlines, integration_max_step_scale, integration_max_error_scale)
+	
+	trajectories = []
+	chunk_count = 0
+	for trajectory in __iterate_trajectories(grid, start_points, integrate):
+		trajectories.append(trajectory)
+		if len(trajectories) == chunk_size:
+			yield __trajectories_to_polylines(trajectories)
+			trajectories = []
+			chunk_count += 1
+	
+	if trajectories or chunk_count == 0:
+		yield __trajectories_to_polylines(trajectories)
+
+def integrate_stream_lines(meshgrid, *argv, **kwargs):
+	return struct.PolylineSet.concatenate(list(iterate_stream_lines(meshgrid, *argv, **kwargs)))
+
+# Matplotlib is only imported by the matplotlib engine, on first use. The plots
+# are never shown, so pyplot runs on the non-interactive Agg backend, unless it was
+# already imported with a backend of its own.
+def __import_pyplot():
+	if 'matplotlib.pyplot' not in sys.modules:
+		import matplotlib
+		matplotlib.use('Agg')
+	
+	import matplotlib.pyplot as plt
+	return plt
+
+def __generate_matplotlib_stream_lines(meshgrid, *argv, profiler=profiling.NULL_PROFILER, **kwargs):
+	plt = __import_pyplot()
 	X, Y = (meshgrid.X, meshgrid.Y)
 	Fx, Fy = (meshgrid.Fx, meshgrid.Fy)
 	
 	# Depict illustration
 	streamlines = plt.streamplot(X, Y, Fx, Fy, *argv, **kwargs)
-	line_segments = streamlines.lines.get_segments()
 	
-	stream_lines = __segments_to_streamlines(line_segments)
+	profiler.start_stage('stitching')
+	line_segments = __polylines_to_segments(streamlines.lines.get_segments())
+	
+	vertices, offsets = __segments_to_streamlines(line_segments)
+	profiler.stop_stage('stitching', segments=len(line_segments))
+	
+	return struct.PolylineSet(vertices, offsets)
 
-	return stream_lines
+# Whether the native integration of engine runs compiled; only the native and
+# numba engines are integrated natively
+def is_compiled_engine(engine):
+	if engine == 'native':
+		return False
+	elif engine == 'numba':
+		return True
+	else:
+		raise UnknownEngine(engine)
 
-def __get_cumulative_distances_along_line_points(line):
-	cumulative_length = 0.0
-	length_up_to_point = []
-	previous_point = None
+def generate_stream_lines(meshgrid, *argv, engine='native', profiler=None, **kwargs):
+	if engine == 'matplotlib':
+		return __generate_matplotlib_stream_lines(meshgrid, *argv, profiler=profiling.get_profiler(profiler), **kwargs)
 	
-	for point in line:
-		if previous_point is None:
-			distance = 0.0
-		else:
-			distance = np.linalg.norm(point - previous_point)
+	return integrate_stream_lines(meshgrid, *argv, compiled=is_compiled_engine(engine), **kwargs)
+
+# Stream lines in chunks of up to chunk_size lines, yielded as they are integrated
+# by the native engines; the matplotlib engine yields all its lines at once
+def generate_stream_line_chunks(meshgrid, *argv, engine='native', chunk_size=DEFAULT_CHUNK_SIZE, **kwargs):
+	if engine == 'matplotlib':
+		return iter([__generate_matplotlib_stream_lines(meshgrid, *argv, **kwargs)])
+	
+	return iterate_stream_lines(meshgrid, *argv, compiled=is_compiled_engine(engine), chunk_size=chunk_size, **kwargs)
+
+# Batch integration
+#
+# Trajectories from many start points advance together, as rows of a single state
+# array. Every step is an adaptive Heun-Euler step along the arc length measured in
+# axes coordinates, taken by all the trajectories still running; they end one by
+# one when they leave the domain, reach their maximum length or stagnate.
+#
+# The trajectories of a batch are numbered direction by direction: with 'both'
+# directions, trajectory n integrates start point n backward and trajectory
+# n + N integrates it forward.
+
+def get_batch_layout(n_start_points, integration_direction):
+	if integration_direction not in ['both', 'forward', 'backward']:
+		raise ValueError(f"'{integration_direction}' is not a valid integration direction")
+	
+	time_directions = {'both' : [-1.0, 1.0], 'forward' : [1.0], 'backward' : [-1.0]}[integration_direction]
+	start_point_of_trajectory = np.tile(np.arange(n_start_points), len(time_directions))
+	time_direction = np.repeat(time_directions, n_start_points)
+	
+	return (start_point_of_trajectory, time_direction)
+
+def __get_batch_directions(get_velocities, points, trajectories, time_direction, axes_scale, min_speed):
+	F = np.asarray(get_velocities(points, trajectories), dtype=np.float64).reshape(-1, 2)
+	speed = np.hypot(F[:,0] / axes_scale[0], F[:,1] / axes_scale[1])
+	valid = (speed > min_speed) & np.isfinite(speed)
+	
+	directions = np.zeros(points.shape)
+	directions[valid] = time_direction[valid,np.newaxis] * F[valid] / speed[valid,np.newaxis]
+	
+	return (directions, valid)
+
+# Fraction of the steps from x_0 to x_1 that lies within the box
+def __get_fraction_within_bounds(x_0, x_1, min_value, max_value):
+	dx = x_1 - x_0
+	with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+		to_min = np.where(dx < 0, (min_value - x_0) / dx, np.inf)
+		to_max = np.where(dx > 0, (max_value - x_0) / dx, np.inf)
+	
+	return np.clip(np.min(np.minimum(to_min, to_max), axis=1), 0.0, 1.0)
+
+# Joins the backward and forward trajectories of every start point into a line.
+# When labels are given, every vertex of the lines carries the label of the
+# segment starting at it, and the last vertex of every line -1.
+def __assemble_batch_lines(n_start_points, start_points, steps, points, labels):
+	order = np.lexsort((steps, start_points))
+	start_points = start_points[order]
+	steps = steps[order]
+	points = points[order]
+	
+	offsets = np.zeros(n_start_points + 1, dtype=np.int64)
+	np.cumsum(np.bincount(start_points, minlength=n_start_points), out=offsets[1:])
+	lines = struct.PolylineSet(points, offsets)
+	
+	segment_labels = None
+	if labels is not None:
+		labels = labels[order]
+		# Backward points, before the start point, are reached from the next point
+		# of the line, and the others from the previous point
+		segment_labels = np.full(len(points), -1, dtype=labels.dtype)
+		backward = steps < 0
+		segment_labels[backward] = labels[backward]
+		following = np.flatnonzero(~backward[:-1] & (start_points[1:] == start_points[:-1]))
+		segment_labels[following] = labels[following + 1]
+	
+	# Start points that did not move are not lines
+	single_points = lines.line_sizes() < 2
+	if np.any(single_points):
+		if segment_labels is not None:
+			segment_labels = segment_labels[np.repeat(~single_points, lines.line_sizes())]
+		lines = struct.PolylineSet.from_lines([line for line in lines if len(line) > 1])
+	
+	return (lines, segment_labels)
+
+# Integrates the trajectories through the start points within the box [min_value,
+# max_value], with get_velocities(points, trajectories) returning the velocities of
+# the given trajectories of the batch at the given points. Lengths and steps are
+# measured in axes coordinates, and trajectories stagnate where their speed in
+# axes coordinates is at most min_speed.
+#
+# Accepted steps from x_0 to x_1 are passed to end_steps(trajectories, x_0, x_1)
+# when given, which returns the fraction of every step to take and whether the
+# trajectory ends there. The vertices reached by a step are labelled with
+# get_labels(trajectories) when given, evaluated before the step ends.
+#
+# Returns the lines, and when get_labels is given the labels of their segments.
+def integrate_trajectory_batch(get_velocities, start_points, min_value, max_value,
+		integration_direction='both', max_length=4.0, max_step=0.01, max_error=0.003,
+		max_steps=10000, min_speed=0.0, end_steps=None, get_labels=None):
+	start_points = np.asarray(start_points, dtype=np.float64).reshape(-1, 2)
+	min_value = np.asarray(min_value, dtype=np.float64)
+	max_value = np.asarray(max_value, dtype=np.float64)
+	axes_scale = max_value - min_value
+	
+	if np.any(~np.all((start_points >= min_value) & (start_points <= max_value), axis=1)):
+		raise ValueError("Starting points outside of data boundaries")
+	
+	n_start_points = len(start_points)
+	start_point_of_trajectory, time_direction = get_batch_layout(n_start_points, integration_direction)
+	if integration_direction == 'both':
+		max_length /= 2.
+	
+	x = start_points[start_point_of_trajectory]
+	ds = np.full(len(x), max_step)
+	length = np.zeros(len(x))
+	step = np.zeros(len(x), dtype=np.int64)
+	running = np.ones(len(x), dtype=bool)
+	
+	# Points reached by the trajectories, with their start point and signed step
+	reached_start_points = [np.arange(n_start_points)]
+	reached_steps = [np.zeros(n_start_points, dtype=np.int64)]
+	reached_points = [start_points]
+	reached_labels = [np.full(n_start_points, -1, dtype=np.int64)] if get_labels is not None else None
+	
+	for _ in range(max_steps):
+		idx = np.flatnonzero(running)
+		if len(idx) == 0:
+			break
+		
+		x_0 = x[idx]
+		ds_i = ds[idx]
+		k_1, valid_1 = __get_batch_directions(get_velocities, x_0, idx, time_direction[idx], axes_scale, min_speed)
+		k_2, valid_2 = __get_batch_directions(get_velocities, x_0 + ds_i[:,np.newaxis] * k_1, idx, time_direction[idx], axes_scale, min_speed)
+		
+		valid = valid_1 & valid_2
+		running[idx[~valid]] = False
+		
+		dx_1 = ds_i[:,np.newaxis] * k_1
+		dx_2 = ds_i[:,np.newaxis] * 0.5 * (k_1 + k_2)
+		error = np.hypot((dx_2[:,0] - dx_1[:,0]) / axes_scale[0], (dx_2[:,1] - dx_1[:,1]) / axes_scale[1])
+		
+		accepted = valid & (error < max_error)
+		with np.errstate(divide='ignore'):
+			ds[idx[valid]] = np.where(error[valid] == 0, max_step,
+				np.minimum(max_step, 0.85 * ds_i[valid] * np.sqrt(max_error / error[valid])))
+		
+		# Steps beyond the maximum length end the trajectory before they are taken
+		too_long = accepted & (length[idx] + ds_i > max_length)
+		running[idx[too_long]] = False
+		accepted &= ~too_long
+		
+		a = idx[accepted]
+		if len(a) == 0:
+			continue
+		x_0 = x_0[accepted]
+		x_1 = x_0 + dx_2[accepted]
+		
+		if get_labels is not None:
+			reached_labels.append(np.asarray(get_labels(a), dtype=np.int64))
 		
-		cumulative_length = cumulative_length + distance
-		length_up_to_point.append(cumulative_length)
-		previous_point = point
+		t = __get_fraction_within_bounds(x_0, x_1, min_value, max_value)
+		ends = t < 1
+		if end_steps is not None:
+			t_event, ends_at_event = end_steps(a, x_0, x_1)
+			at_event = np.asarray(t_event) <= t
+			t = np.where(at_event, t_event, t)
+			ends = np.where(at_event, ends_at_event, ends)
+		
+		x[a] = x_0 + t[:,np.newaxis] * (x_1 - x_0)
+		length[a] += t * ds_i[accepted]
+		step[a] += 1
+		running[a[ends]] = False
+		
+		reached_start_points.append(start_point_of_trajectory[a])
+		reached_steps.append(time_direction[a].astype(np.int64) * step[a])
+		reached_points.append(x[a])
+	
+	return __assemble_batch_lines(
+		n_start_points,
+		np.concatenate(reached_start_points),
+		np.concatenate(reached_steps),
+		np.concatenate(reached_points),
+		np.concatenate(reached_labels) if get_labels is not None else None
+	)
 
-	return length_up_to_point
+# Trajectories of vector_field(X, Y) through the start points, integrated as a batch
+def integrate_trajectories(vector_field, start_points, min_value, max_value, **kwargs):
+	def get_velocities(points, trajectories):
+		Fx, Fy = vector_field(points[:,0], points[:,1])
+		return np.stack((np.broadcast_to(Fx, len(points)), np.broadcast_to(Fy, len(points))), axis=1)
+	
+	lines, _ = integrate_trajectory_batch(get_velocities, start_points, min_value, max_value, **kwargs)
+	
+	return lines
+
+# Length along its line up to every point. The sum restarts at the start of every
+# line, so the lengths of a line do not depend on the lines before it; lines are
+# summed in groups of sizes up to the same power of 2, padded to that size.
+def __get_cumulative_distances_along_lines(stream_lines):
+	vertices = stream_lines.vertices
+	line_starts = stream_lines.offsets[:-1]
+	line_sizes = stream_lines.line_sizes()
+	
+	# Padding points read a zero length from the end of the segment lengths, and
+	# write to a point past the end of the lengths
+	segment_vectors = vertices[1:] - vertices[:-1]
+	segment_lengths = np.append(np.sqrt(np.sum(segment_vectors * segment_vectors, axis=1)), 0.0)
+	length_up_to_point = np.zeros(len(vertices) + 1)
+	
+	size_groups = np.ceil(np.log2(np.maximum(line_sizes, 1))).astype(np.int64)
+	for size_group in np.unique(size_groups):
+		lines = np.flatnonzero(size_groups == size_group)
+		positions = np.arange(1, 2**size_group)[:,np.newaxis]
+		points = np.where(positions < line_sizes[lines], line_starts[lines] + positions, len(vertices))
+		length_up_to_point[points] = np.cumsum(segment_lengths[points - 1], axis=0)
+	
+	return length_up_to_point[:-1]
+
+# Start n of the segment of every arrow along its line, where
+# length_up_to_point[n] < arrow_length <= length_up_to_point[n+1], bisecting the
+# points from first to last of the lines of all the arrows at once
+def __find_arrow_segments(length_up_to_point, first, last, arrow_length):
+	low = first.copy()
+	high = last.copy()
+	
+	bisected = high - low > 1
+	while np.any(bisected):
+		middle = (low + high) // 2
+		below = length_up_to_point[middle] < arrow_length
+		low = np.where(bisected & below, middle, low)
+		high = np.where(bisected & ~below, middle, high)
+		bisected = high - low > 1
+	
+	return low
+
+def __get_arrow_counts(line_lengths, per_line, spacing):
+	if spacing is None:
+		return np.full(len(line_lengths), per_line, dtype=np.int64)
+	
+	return np.maximum(1, np.floor(line_lengths / spacing)).astype(np.int64)
 
 def __expand_arrow_up_to_the_closest_segment_edge(position_factor_along_segment, min_arrow_extension_factor):
-	arrow_extension_factor = min( position_factor_along_segment, 1 - position_factor_along_segment )
-	arrow_extension_factor = max( min_arrow_extension_factor, arrow_extension_factor )
+	arrow_extension_factor = np.minimum( position_factor_along_segment, 1 - position_factor_along_segment )
+	arrow_extension_factor = np.maximum( min_arrow_extension_factor, arrow_extension_factor )
 	
 	return arrow_extension_factor
 
 def __get_arrow_segment(start, segment_vector, midpoint_position_factor, arrow_extension_factor):
-	mid_point = start + midpoint_position_factor * segment_vector
+	mid_point = start + midpoint_position_factor[:,np.newaxis] * segment_vector
 	
-	start_point = mid_point - arrow_extension_factor * segment_vector
-	end_point = mid_point + arrow_extension_factor * segment_vector
+	start_point = mid_point - arrow_extension_factor[:,np.newaxis] * segment_vector
+	end_point = mid_point + arrow_extension_factor[:,np.newaxis] * segment_vector
 	
-	return (start_point, mid_point, end_point)
+	return np.stack((start_point, mid_point, end_point), axis=1)
 
-def __get_line_midpoint_arrow(line, min_arrow_extension_factor = 0.01):
-	if len(line) < 2:
-		return None
+# Arrows are placed at evenly spaced arc lengths along each line: per_line arrows
+# on every line, or when spacing is given, one arrow for every spacing of line
+# length. With a single arrow it sits at the line midpoint.
+def generate_stream_arrows(stream_lines, min_arrow_extension_factor = 0.01, per_line = 1, spacing = None):
+	stream_lines = struct.PolylineSet.from_lines(stream_lines)
+	vertices = stream_lines.vertices
+	
+	length_up_to_point = __get_cumulative_distances_along_lines(stream_lines)
+	line_starts = stream_lines.offsets[:-1]
+	line_ends = np.maximum(stream_lines.offsets[1:] - 1, line_starts)
+	line_lengths = length_up_to_point[line_ends] if len(vertices) > 0 else np.zeros(len(stream_lines))
 	
-	length_up_to_point = __get_cumulative_distances_along_line_points(line)
+	# Lines of fewer than 2 points or of no length carry no arrows
+	arrow_counts = __get_arrow_counts(line_lengths, per_line, spacing)
+	arrow_counts[(stream_lines.line_sizes() < 2) | ~(line_lengths > 0)] = 0
 	
-	total_length = length_up_to_point[-1]
-	half_length = 0.5 * total_length
+	line_of_arrow = np.repeat(np.arange(len(stream_lines)), arrow_counts)
+	arrow_index_in_line = np.arange(len(line_of_arrow)) - np.repeat(np.cumsum(arrow_counts) - arrow_counts, arrow_counts)
+	arrow_position_factor = (arrow_index_in_line + 0.5) / arrow_counts[line_of_arrow]
+	arrow_length = arrow_position_factor * line_lengths[line_of_arrow]
 	
-	def get_index_of_last_point_before_line_half_length():
-		n = np.searchsorted(length_up_to_point, half_length, side = 'left')
-		# length_up_to_point[n-1] < half_length <= length_up_to_point[n]
-		n = n - 1
-		# length_up_to_point[n] < half_length <= length_up_to_point[n+1]
-		return n
+	# length_up_to_point[n] < arrow_length <= length_up_to_point[n+1]
+	n = __find_arrow_segments(length_up_to_point, line_starts[line_of_arrow], line_ends[line_of_arrow], arrow_length)
 	
-	n = get_index_of_last_point_before_line_half_length()
+	position_factor_along_segment = (arrow_length - length_up_to_point[n]) / (length_up_to_point[n+1] - length_up_to_point[n])
+	arrow_extension_factor = __expand_arrow_up_to_the_closest_segment_edge(position_factor_along_segment, min_arrow_extension_factor)
 	
-	midpoint_position_factor_along_the_segmen_at_the_line_half_length = (half_length - length_up_to_point[n]) / (length_up_to_point[n+1] - length_up_to_point[n])
-	arrow_extension_factor = __expand_arrow_up_to_the_closest_segment_edge(midpoint_position_factor_along_the_segmen_at_the_line_half_length, min_arrow_extension_factor)
-			
-	return __get_arrow_segment(line[n],
-		line[n+1] - line[n],
-		midpoint_position_factor_along_the_segmen_at_the_line_half_length,
+	return __get_arrow_segment(vertices[n],
+		vertices[n+1] - vertices[n],
+		position_factor_along_segment,
 		arrow_extension_factor)
 
-def generate_stream_arrows(stream_lines):
-	return list(filter(lambda x : x != None, map(__get_line_midpoint_arrow, stream_lines)))
+# Plot file writers
+#
+# Text files hold one point per row with the coordinates separated by '; ', and a
+# blank line between consecutive lines; arrows hold one arrow per row. Binary files
+# hold raw float64 records for gnuplot, with a row of NaN between consecutive lines.
+
+__TEXT_WRITE_CHUNK_SIZE = 4096
+
+class UnknownFormat(Exception):
+	def __init__(self, unknown_format, *args):
+		super().__init__(*args)
+		self.unknown_format = unknown_format
+	
+	def __str__(self):
+		return f"The plot file format {self.unknown_format} is not known"
+
+def __as_arrow_array(arrows):
+	return np.asarray(arrows, dtype=np.float64).reshape(-1, 3, 2)
+
+def __format_text_lines(stream_lines):
+	vertices = stream_lines.vertices
+	offsets = stream_lines.offsets.tolist()
+	
+	for begin, end in zip(offsets[:-1], offsets[1:]):
+		yield ('%.16f; %.16f\n' * (end - begin)) % tuple(vertices[begin:end].ravel().tolist())
+
+# Lines and arrows are appended to files that may already hold some
+def __append_text_lines(file, stream_lines):
+	stream_lines = struct.PolylineSet.from_lines(stream_lines)
+	separate_next_line = file.tell() > 0
+	formatted_lines = __format_text_lines(stream_lines)
+	while True:
+		chunk = [line for _, line in zip(range(__TEXT_WRITE_CHUNK_SIZE), formatted_lines)]
+		if not chunk:
+			break
+		if separate_next_line:
+			file.write('\n')
+		file.write('\n'.join(chunk))
+		separate_next_line = True
+
+def __append_text_arrows(file, arrows):
+	arrows = __as_arrow_array(arrows).reshape(-1, 6)
+	separate_next_arrow = file.tell() > 0
+	for begin in range(0, len(arrows), __TEXT_WRITE_CHUNK_SIZE):
+		chunk = arrows[begin:begin + __TEXT_WRITE_CHUNK_SIZE]
+		if separate_next_arrow:
+			file.write('\n')
+		file.write('\n'.join(['%.16f; %.16f; %.16f; %.16f; %.16f; %.16f'] * len(chunk)) % tuple(chunk.ravel().tolist()))
+		separate_next_arrow = True
 
 def __write_lines(filename, stream_lines):
 	with open(filename, 'w') as file:
-		separate_next_line = False
-		for line in stream_lines:
-			if not separate_next_line:
-				separate_next_line = True
-			else:
-				file.write('\n')
-			for point in line:
-				file.write(f'{point[0]:.16f}')
-				file.write('; ')
-				file.write(f'{point[1]:.16f}')
-				file.write('\n')
+		__append_text_lines(file, stream_lines)
 
 def __write_arrows(filename, arrows):
 	with open(filename, 'w') as file:
-		separate_next_line = False
-		for arrow in arrows:
-			if not separate_next_line:
-				separate_next_line = True
-			else:
-				file.write('\n')
-			
-			p0, p1, p2 = arrow
-			file.write(f'{p0[0]:.16f}')
-			file.write('; ')
-			file.write(f'{p0[1]:.16f}')
-			file.write('; ')
-			file.write(f'{p1[0]:.16f}')
-			file.write('; ')
-			file.write(f'{p1[1]:.16f}')
-			file.write('; ')
-			file.write(f'{p2[0]:.16f}')
-			file.write('; ')
-			file.write(f'{p2[1]:.16f}')
+		__append_text_arrows(file, arrows)
+
+def __write_text_plot_files(directory, lines, arrows):
+	for name in lines:
+		lines_file = os.path.join(directory, name)
+		__write_lines(str(lines_file), lines[name])
+	
+	for name in arrows:
+		arrows_file = os.path.join(directory, name)
+		__write_arrows(str(arrows_file), arrows[name])
+
+def __append_binary_lines(file, stream_lines):
+	stream_lines = struct.PolylineSet.from_lines(stream_lines)
+	n_lines = len(stream_lines)
+	if n_lines == 0:
+		return
+	
+	# Each line is preceded by a NaN row, which gnuplot treats as a line break,
+	# except for the first line of the file
+	records = np.full((stream_lines.vertex_count() + n_lines, 2), np.nan)
+	line_index = np.repeat(np.arange(n_lines), stream_lines.line_sizes())
+	records[np.arange(stream_lines.vertex_count()) + line_index + 1] = stream_lines.vertices
+	
+	if file.tell() == 0:
+		records = records[1:]
+	records.tofile(file)
+
+def __append_binary_arrows(file, arrows):
+	__as_arrow_array(arrows).tofile(file)
+
+def __write_binary_lines(filename, stream_lines):
+	with open(filename, 'wb') as file:
+		__append_binary_lines(file, stream_lines)
+
+def __get_gnuplot_binary_script(directory, lines, arrows):
+	plot_commands = []
+	for name in lines:
+		lines_file = os.path.join(directory, name)
+		plot_commands.append(f"'{lines_file}' binary format='%2float64' using 1:2 with line linestyle 1 notitle")
+	for name in arrows:
+		arrows_file = os.path.join(directory, name)
+		plot_commands.append(f"'{arrows_file}' binary format='%6float64' using 1:2:($5-$1):($6-$2) with vectors arrowstyle 1 notitle")
+	
+	script = [
+		"set terminal svg",
+		f"set output '{os.path.join(directory, 'plot.svg')}'",
+		"",
+		"set style arrow 1 head size 0.15,15 fixed filled linestyle 1",
+		"",
+		"plot " + ", \\\n\t".join(plot_commands) if plot_commands else "",
+		""
+	]
+	
+	return "\n".join(script)
+
+def __write_binary_plot_files(directory, lines, arrows):
+	for name in lines:
+		lines_file = os.path.join(directory, name)
+		__write_binary_lines(str(lines_file), lines[name])
+	
+	for name in arrows:
+		arrows_file = os.path.join(directory, name)
+		__as_arrow_array(arrows[name]).tofile(str(arrows_file))
+	
+	__write_gnuplot_binary_script(directory, lines, arrows)
+
+def __write_gnuplot_binary_script(directory, lines, arrows):
+	with open(os.path.join(directory, 'plot.plt'), 'w') as file:
+		file.write(__get_gnuplot_binary_script(directory, lines, arrows))
+
+def __write_npz_plot_files(directory, lines, arrows):
+	arrays = {}
+	for name in lines:
+		stream_lines = struct.PolylineSet.from_lines(lines[name])
+		key = os.path.splitext(name)[0]
+		arrays[f'{key}_vertices'] = stream_lines.vertices
+		arrays[f'{key}_offsets'] = stream_lines.offsets
+	
+	for name in arrows:
+		key = os.path.splitext(name)[0]
+		arrays[key] = __as_arrow_array(arrows[name])
+	
+	np.savez(os.path.join(directory, 'streamplot.npz'), **arrays)
+
+__plot_file_writers = {
+	'text' : __write_text_plot_files,
+	'binary' : __write_binary_plot_files,
+	'npz' : __write_npz_plot_files,
+}
+
+# Formats whose files are written chunk by chunk: the mode of the files, the
+# functions appending lines and arrows to them, and the function completing the
+# plot files once every chunk is written
+__plot_file_appenders = {
+	'text' : ('w', __append_text_lines, __append_text_arrows, None),
+	'binary' : ('wb', __append_binary_lines, __append_binary_arrows, __write_gnuplot_binary_script),
+}
 
 class Streamplot:
 	def __init__(self, streamlines, streamarrows):
 		self.streamlines = streamlines
 		self.streamarrows = streamarrows
 
-def generate_streamplot(vector_field, meshgrid_generator, *argv, **kwargs):
+# Stages are reported to the profiler, when given; see profiling
+def generate_streamplot(vector_field, meshgrid_generator, *argv, profiler=None, **kwargs):
+	profiler = profiling.get_profiler(profiler)
+	
+	profiler.start_stage('meshgrid')
 	meshgrid = meshgrid_generator.get_meshgrid(vector_field)
-	stream_lines = generate_stream_lines(meshgrid, *argv, **kwargs)
+	profiler.stop_stage('meshgrid', points=np.size(meshgrid.X))
+	
+	profiler.start_stage('integration')
+	stream_lines = generate_stream_lines(meshgrid, *argv, profiler=profiler, **kwargs)
+	profiler.stop_stage('integration', lines=len(stream_lines), points=stream_lines.vertex_count())
+	
+	profiler.start_stage('arrows')
 	stream_arrows = generate_stream_arrows(stream_lines)
+	profiler.stop_stage('arrows', arrows=len(stream_arrows))
+	
 	return Streamplot(stream_lines, stream_arrows)
 
-def write_plot_files(directory, lines, arrows):
+def __get_plot_file_writer(format):
+	if callable(format):
+		return format
+	elif format in __plot_file_writers:
+		return __plot_file_writers[format]
+	else:
+		raise UnknownFormat(format)
+
+class PlotDirectoryExists(Exception):
+	def __init__(self, directory, *args):
+		super().__init__(*args)
+		self.directory = directory
+	
+	def __str__(self):
+		return f"The directory {self.directory} already exists"
+
+class MissingParentDirectory(Exception):
+	def __init__(self, directory, *args):
+		super().__init__(*args)
+		self.directory = directory
+	
+	def __str__(self):
+		return f"The parent directory of {self.directory} does not exist"
+
+# Plot files are only written to a new directory, or to an existing one when
+# exist_ok is set, such as a directory claimed beforehand by the caller
+def __make_plot_directory(directory, exist_ok=False):
 	try:
 		os.mkdir(directory)
 	except FileExistsError:
-		print('The directory provided already exists.')
-		sys.exit('Program terminating.')
+		if not (exist_ok and os.path.isdir(directory)):
+			raise PlotDirectoryExists(directory)
 	except FileNotFoundError:
-		print('Parent directory does not exist.')
-		sys.exit('Program terminating.')
+		raise MissingParentDirectory(directory)
+
+# The format is one of 'text', 'binary' or 'npz', or a callable taking the
+# directory and the dictionaries of lines and arrows
+def write_plot_files(directory, lines, arrows, format='text', profiler=None, exist_ok=False):
+	profiler = profiling.get_profiler(profiler)
+	write_files = __get_plot_file_writer(format)
+	__make_plot_directory(directory, exist_ok)
 	
-	for name in lines:
-		lines_file = os.path.join(directory, name)
-		__write_lines(str(lines_file), lines[name])
+	profiler.start_stage('writing')
+	write_files(directory, lines, arrows)
+	profiler.stop_stage('writing', **__get_written_counts(directory, profiler))
+
+# Files and bytes written to a plot directory, measured for enabled profilers only
+def __get_written_counts(directory, profiler):
+	if not profiler.enabled:
+		return {}
 	
-	for name in arrows:
-		arrows_file = os.path.join(directory, name)
-		__write_arrows(str(arrows_file), arrows[name])
+	sizes = [entry.stat().st_size for entry in os.scandir(directory) if entry.is_file()]
+	return {'files' : len(sizes), 'bytes' : sum(sizes)}
+
+def __write_plot_file_chunks_at_once(directory, chunks, write_files):
+	line_chunks = {}
+	arrow_chunks = {}
+	for lines, arrows in chunks:
+		for name in lines:
+			line_chunks.setdefault(name, []).append(struct.PolylineSet.from_lines(lines[name]))
+		for name in arrows:
+			arrow_chunks.setdefault(name, []).append(__as_arrow_array(arrows[name]))
+	
+	write_files(
+		directory,
+		{name : struct.PolylineSet.concatenate(line_chunks[name]) for name in line_chunks},
+		{name : np.concatenate(arrow_chunks[name]) for name in arrow_chunks}
+	)
+
+# Writes the plot files from an iterable of pairs (lines, arrows) of dictionaries
+# of chunks, keyed by file name like the dictionaries of write_plot_files. Every
+# chunk is appended to its file as soon as it is produced with the 'text' and
+# 'binary' formats; the other formats gather the chunks and write them at the end.
+def write_plot_file_chunks(directory, chunks, format='text'):
+	if callable(format) or format not in __plot_file_appenders:
+		write_files = __get_plot_file_writer(format)
+		__make_plot_directory(directory)
+		__write_plot_file_chunks_at_once(directory, chunks, write_files)
+		return
+	
+	mode, append_lines, append_arrows, complete_files = __plot_file_appenders[format]
+	__make_plot_directory(directory)
+	
+	files = {}
+	line_names = []
+	arrow_names = []
+	
+	def append(names, name, chunk, append_chunk):
+		if name not in files:
+			files[name] = open(os.path.join(directory, name), mode)
+			names.append(name)
+		append_chunk(files[name], chunk)
+		files[name].flush()
+	
+	try:
+		for lines, arrows in chunks:
+			for name in lines:
+				append(line_names, name, lines[name], append_lines)
+			for name in arrows:
+				append(arrow_names, name, arrows[name], append_arrows)
+	finally:
+		for file in files.values():
+			file.close()
+	
+	if complete_files is not None:
+		complete_files(directory, line_names, arrow_names)
 
-def write_streamplot(directory, streamplot):
+def write_streamplot(directory, streamplot, format='text', profiler=None, exist_ok=False):
 	lines = {'streamlines.dat' : streamplot.streamlines}
 	arrows = {'streamarrows.dat' : streamplot.streamarrows}
 	
-	write_plot_files(directory, lines, arrows)
+	write_plot_files(directory, lines, arrows, format, profiler, exist_ok)
 
-def main():
+# Generates and writes the streamplot chunk by chunk, so that only a chunk of its
+# lines is held in memory at any time
+def stream_streamplot(vector_field, meshgrid_generator, directory, *argv, format='text', chunk_size=DEFAULT_CHUNK_SIZE, **kwargs):
+	meshgrid = meshgrid_generator.get_meshgrid(vector_field)
+	
+	def generate_chunks():
+		for stream_lines in generate_stream_line_chunks(meshgrid, *argv, chunk_size=chunk_size, **kwargs):
+			yield ({'streamlines.dat' : stream_lines}, {'streamarrows.dat' : generate_stream_arrows(stream_lines)})
+	
+	write_plot_file_chunks(directory, generate_chunks(), format)
+
+# Field of a dipole and the box and grid step it is plotted on
+def get_dipole_system():
 	f = lambda X, Y : ((X + 1)/((X+1)**2 + Y**2) - (X - 1)/((X-1)**2 + Y**2), Y/((X+1)**2 + Y**2) - Y/((X-1)**2 + Y**2))
-	meshgrid_generator = IsoMeshgridGenerator(min_value=(-5,-5), max_value=(5,5), step=(0.1, 0.1))
+	
+	return (f, (-5,-5), (5,5), (0.1, 0.1))
+
+def main():
+	f, min_value, max_value, step = get_dipole_system()
+	meshgrid_generator = IsoMeshgridGenerator(min_value=min_value, max_value=max_value, step=step)
 	streamplot = generate_streamplot( f, meshgrid_generator, density=1.4)
 	write_streamplot('streamplot', streamplot)
 
@@ -353,7 +1247,43 @@ def test():
 		np.array([[1.0, 1.0], [2.0, 1.0]]),
 		np.array([[2.0, 1.0], [3.0, 1.0]])
 	]
-	stream_lines = __segments_to_streamlines(streamline_segments)
+	vertices, offsets = __segments_to_streamlines(np.array(streamline_segments))
+	
+	test_results = []
+	test_results.append(np.array_equal(offsets, [0, 4, 8]))
+	test_results.append(np.array_equal(vertices[offsets[0]:offsets[1], 0], [0.0, 1.0, 2.0, 3.0]))
+	test_results.append(np.array_equal(vertices[offsets[1]:offsets[2], 0], [0.0, 1.0, 2.0, 3.0]))
+	
+	# At a fork a line continues with the first segment, like the original stitching
+	out_fork_segments = [
+		np.array([[0.0, 0.0], [1.0, 0.0]]),
+		np.array([[1.0, 0.0], [2.0, 0.0]]),
+		np.array([[1.0, 0.0], [3.0, 0.0]])
+	]
+	vertices, offsets = __segments_to_streamlines(np.array(out_fork_segments))
+	test_results.append(np.array_equal(offsets, [0, 3, 5]))
+	test_results.append(np.array_equal(vertices[:,0], [0.0, 1.0, 2.0, 1.0, 3.0]))
+	
+	in_fork_segments = [
+		np.array([[2.0, 0.0], [3.0, 0.0]]),
+		np.array([[0.0, 0.0], [2.0, 0.0]]),
+		np.array([[1.0, 0.0], [2.0, 0.0]])
+	]
+	vertices, offsets = __segments_to_streamlines(np.array(in_fork_segments))
+	test_results.append(np.array_equal(offsets, [0, 3, 5]))
+	test_results.append(np.array_equal(vertices[:,0], [0.0, 2.0, 3.0, 1.0, 2.0]))
+	
+	# The arrows of a line only depend on the line, not on the lines before it
+	rng = np.random.default_rng(0)
+	line_sizes = [2, 7, 1, 40, 3, 129, 16]
+	lines = struct.PolylineSet.from_lines([np.cumsum(rng.random((size, 2)), axis=0) + 1e3*line for line, size in enumerate(line_sizes)])
+	arrows = generate_stream_arrows(lines, per_line=3)
+	chunk_arrows = [generate_stream_arrows(lines[begin:begin + 2], per_line=3) for begin in range(0, len(lines), 2)]
+	test_results.append(np.array_equal(arrows, np.concatenate(chunk_arrows)))
+	test_results.append(np.array_equal(generate_stream_arrows(lines[::-1], per_line=3), np.concatenate([generate_stream_arrows(line[np.newaxis], per_line=3) for line in lines][::-1])))
+	test_results.append(len(arrows) == 3 * (len(line_sizes) - 1))
+	
+	return all(test_results)
 
 if __name__ == '__main__':
 	main()
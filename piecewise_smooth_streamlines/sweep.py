@@ -0,0 +1,277 @@
+import numpy as np
+
+import inspect
+import itertools
+import json
+import os
+
+import streamlines as streamlines
+import executors as executors
+import crossings as crossings
+import piecewise_smooth_field as pws
+
+# Parameter sweeps
+#
+# A sweep generates the streamplot of a piecewise bifield for every point of a grid
+# of parameters. The fields are built by field_factory and the switching manifold
+# by manifold_factory, each called with the parameters of the point it declares as
+# arguments, or with all of them when it takes **kwargs. Points that only differ
+# in the parameters of one factory share the results of the other:
+# - the coordinate grid is built once for the whole sweep,
+# - the fields are sampled once per set of field parameters and the manifold once
+#   per set of manifold parameters,
+# - the extended streamlines of a field are integrated once per distinct sampled
+#   field, so a subsystem whose field does not change is never integrated again,
+# - the switching manifold is contoured once per set of manifold parameters.
+#
+# The integrations and contours run first, on the workers of the executor, then
+# the points are completed, filtered and written to disk by the workers as soon as
+# they are done; every written point is recorded in the sweep manifest.
+
+_SWEEP_MANIFEST = 'sweep.jsonl'
+
+# Points of a parameter grid, either a dictionary of the values of every parameter,
+# whose points are all their combinations, or a list of points
+def get_sweep_points(param_grid):
+	if isinstance(param_grid, dict):
+		names = list(param_grid)
+		return [dict(zip(names, values)) for values in itertools.product(*[param_grid[name] for name in names])]
+	
+	return [dict(point) for point in param_grid]
+
+def _get_factory_parameters(factory, names):
+	try:
+		parameters = inspect.signature(factory).parameters.values()
+	except (TypeError, ValueError):
+		return list(names)
+	
+	if any(parameter.kind == parameter.VAR_KEYWORD for parameter in parameters):
+		return list(names)
+	
+	accepted = {parameter.name for parameter in parameters if parameter.kind in [parameter.POSITIONAL_OR_KEYWORD, parameter.KEYWORD_ONLY]}
+	return [name for name in names if name in accepted]
+
+class _FactoryCalls:
+	def __init__(self, factory, points):
+		names = sorted({name for point in points for name in point})
+		self.factory = factory
+		self.parameters = _get_factory_parameters(factory, names)
+		self.__results = {}
+	
+	def get_arguments(self, point):
+		return {name : point[name] for name in self.parameters if name in point}
+	
+	def get_key(self, point):
+		return pws.get_digest(self.get_arguments(point))
+	
+	def __call__(self, point):
+		key = self.get_key(point)
+		if key not in self.__results:
+			self.__results[key] = self.factory(**self.get_arguments(point))
+		
+		return self.__results[key]
+
+def _sample_vector_field(vector_field, X, Y):
+	return tuple(np.array(np.broadcast_to(F, X.shape), dtype=np.float64) for F in vector_field(X, Y))
+
+def _get_point_directory(directory, index):
+	return os.path.join(directory, f'point_{index:04d}')
+
+# Directories of the points recorded in the manifest of the directory by an earlier
+# run of the sweep, for the points with the same parameters whose directory still
+# exists, and None for the other points
+def _get_written_point_directories(directory, points):
+	point_directories = [None] * len(points)
+	filename = os.path.join(directory, _SWEEP_MANIFEST)
+	if not os.path.exists(filename):
+		return point_directories
+	
+	with open(filename) as manifest:
+		for line in manifest:
+			try:
+				record = json.loads(line)
+			except json.JSONDecodeError:
+				# The last record of an interrupted run may be cut short
+				continue
+			
+			index = record.get('index')
+			if not isinstance(index, int) or not 0 <= index < len(points):
+				continue
+			if record.get('parameters') == json.loads(json.dumps(points[index], default=repr)) and os.path.isdir(record['directory']):
+				point_directories[index] = record['directory']
+	
+	return point_directories
+
+# Generates and writes the streamplots of the points of param_grid on the grid of
+# the box [min_value, max_value] with the given step. The streamplot of the n-th
+# point is written to <directory>/point_<n> with write_streamplot, and a line with
+# its index, parameters and directory is appended to <directory>/sweep.jsonl once
+# it is written. The keywords are those of generate_streamplot. Returns the pairs
+# (parameters, directory) of the points in their order in the grid.
+#
+# A sweep run again in the same directory, after it was interrupted or with more
+# points, skips the points its manifest records; the directory of a point that is
+# not recorded must not exist, or streamlines.PlotDirectoryExists is raised before
+# anything is computed.
+def sweep_streamplots(field_factory, manifold_factory, param_grid, min_value, max_value, step, directory,
+		*argv, executor='serial', workers=None, format='text', **kwargs):
+	(stream_kwargs, arrow_kwargs, manifold_kwargs) = pws.get_keywords(**kwargs)
+	refine = manifold_kwargs.pop('refine', False)
+	
+	points = get_sweep_points(param_grid)
+	fields = _FactoryCalls(field_factory, points)
+	manifolds = _FactoryCalls(manifold_factory, points)
+	
+	os.makedirs(directory, exist_ok=True)
+	point_directories = _get_written_point_directories(directory, points)
+	pending = [index for index in range(len(points)) if point_directories[index] is None]
+	for index in pending:
+		if os.path.exists(_get_point_directory(directory, index)):
+			raise streamlines.PlotDirectoryExists(_get_point_directory(directory, index))
+	
+	x = np.arange(min_value[0], max_value[0], step[0])
+	y = np.arange(min_value[1], max_value[1], step[1])
+	X, Y = np.meshgrid(x, y)
+	
+	# Subsystems are identified by their sampled field, whatever the field
+	# parameters, and integrated from the fields sampled here; the arguments of the
+	# integration are the same for every subsystem
+	sampled_fields = {}
+	field_subsystem_keys = {}
+	for index in pending:
+		field_key = fields.get_key(points[index])
+		if field_key in field_subsystem_keys:
+			continue
+		
+		keys = []
+		for vector_field in fields(points[index]):
+			Fx, Fy = _sample_vector_field(vector_field, X, Y)
+			key = pws.get_digest(Fx, Fy)
+			sampled_fields.setdefault(key, (Fx, Fy))
+			keys.append(key)
+		field_subsystem_keys[field_key] = keys
+	
+	manifold_keys = {index : manifolds.get_key(points[index]) for index in pending}
+	unique_manifolds = {manifold_keys[index] : manifolds(points[index]) for index in pending}
+	
+	def integrate(task):
+		kind, key = task
+		if kind == 'subsystem':
+			Fx, Fy = sampled_fields[key]
+			return streamlines.generate_stream_lines(streamlines.Meshgrid(X, Y, Fx, Fy), *argv, **stream_kwargs)
+		
+		manifold = unique_manifolds[key]
+		S = crossings.evaluate_manifold(manifold, X, Y)
+		contour_kwargs = {**manifold_kwargs, 'manifold' : manifold} if refine else manifold_kwargs
+		return pws.PiecewiseBifieldStreamplot.generate_contour_plot(X, Y, S, 0.0, **contour_kwargs)
+	
+	tasks = [('subsystem', key) for key in sampled_fields] + [('manifold', key) for key in unique_manifolds]
+	results = dict(zip(tasks, executors.map_ordered(integrate, tasks, executor, workers, chunk_size=1)))
+	
+	def complete(index):
+		vector_field_0, vector_field_1 = fields(points[index])
+		manifold = unique_manifolds[manifold_keys[index]]
+		key_0, key_1 = field_subsystem_keys[fields.get_key(points[index])]
+		
+		(stream_lines_0, stream_lines_1) = pws.filter_stream_lines(
+			results[('subsystem', key_0)], results[('subsystem', key_1)],
+			manifold
+		)
+		
+		bifield_streamplot = pws.assemble_bifield_streamplot(
+			pws.PiecewiseBifield(vector_field_0, vector_field_1, manifold),
+			stream_lines_0, stream_lines_1,
+			results[('manifold', manifold_keys[index])],
+			**arrow_kwargs
+		)
+		
+		point_directory = _get_point_directory(directory, index)
+		pws.write_streamplot(point_directory, bifield_streamplot, format)
+		
+		return point_directory
+	
+	with open(os.path.join(directory, _SWEEP_MANIFEST), 'a') as manifest:
+		for position, point_directory in executors.map_as_completed(complete, pending, executor, workers):
+			index = pending[position]
+			point_directories[index] = point_directory
+			record = {'index' : index, 'parameters' : points[index], 'directory' : point_directory}
+			manifest.write(json.dumps(record, default=repr) + '\n')
+			manifest.flush()
+	
+	return list(zip(points, point_directories))
+
+def test():
+	import math
+	import tempfile
+	
+	C, L, R, i_L_s, v_C_s = (0.6e-3, 1.7e-3, 8, 4.5, 36)
+	min_value, max_value, step = ((0, 0), (10, 75), (0.08, 0.08))
+	keywords = {'stream_density' : 0.6, 'manifold_refine' : True}
+	
+	# Buck converters whose first field does not depend on the source voltage
+	def field_factory(E):
+		return (
+			lambda i_L, v_C : ((1/L)*(-v_C), (1/C)*(i_L - v_C/R)),
+			lambda i_L, v_C : ((1/L)*(-v_C + E), (1/C)*(i_L - v_C/R))
+		)
+	
+	def manifold_factory(phi):
+		return lambda i_L, v_C : math.cos(phi)*(i_L - i_L_s) + math.sin(phi)*(v_C - v_C_s)
+	
+	integrations = []
+	generate_stream_lines = streamlines.generate_stream_lines
+	def count_integration(*argv, **kwargs):
+		integrations.append(1)
+		return generate_stream_lines(*argv, **kwargs)
+	
+	def sweep(param_grid, directory):
+		integrations.clear()
+		return sweep_streamplots(field_factory, manifold_factory, param_grid, min_value, max_value, step, directory, format='npz', **keywords)
+	
+	def read_manifest(directory):
+		with open(os.path.join(directory, _SWEEP_MANIFEST)) as manifest:
+			return [json.loads(line)['index'] for line in manifest]
+	
+	test_results = []
+	streamlines.generate_stream_lines = count_integration
+	try:
+		with tempfile.TemporaryDirectory() as directory:
+			# Two voltages share the subsystem of the first field
+			sweep_directory = os.path.join(directory, 'sweep')
+			written = sweep({'E' : [48, 60], 'phi' : [math.pi/4]}, sweep_directory)
+			test_results.append(len(integrations) == 3)
+			
+			for parameters, point_directory in written:
+				vector_field_0, vector_field_1 = field_factory(parameters['E'])
+				piecewise_bifield = pws.PiecewiseBifield(vector_field_0, vector_field_1, manifold_factory(parameters['phi']))
+				bifield_streamplot = pws.generate_streamplot(piecewise_bifield, pws.IsoPiecewiseBifieldMeshgridGenerator(min_value, max_value, step), **keywords)
+				
+				reference_directory = os.path.join(directory, f"reference_{parameters['E']}")
+				pws.write_streamplot(reference_directory, bifield_streamplot, 'npz')
+				with np.load(os.path.join(point_directory, 'streamplot.npz')) as swept, np.load(os.path.join(reference_directory, 'streamplot.npz')) as reference:
+					test_results.append(set(swept.files) == set(reference.files) and all(np.array_equal(swept[name], reference[name]) for name in reference.files))
+			
+			# A rerun finds every point recorded
+			test_results.append(sweep({'E' : [48, 60], 'phi' : [math.pi/4]}, sweep_directory) == written)
+			test_results.append(len(integrations) == 0 and read_manifest(sweep_directory) == [0, 1])
+			
+			# An extended grid only computes and writes its new points
+			extended = sweep({'E' : [48, 60, 72], 'phi' : [math.pi/4]}, sweep_directory)
+			test_results.append(extended[:2] == written and read_manifest(sweep_directory) == [0, 1, 2])
+			test_results.append(len(integrations) == 2)
+			
+			# The directory of a point the manifest does not record is never overwritten
+			claimed_directory = os.path.join(directory, 'claimed')
+			os.makedirs(_get_point_directory(claimed_directory, 0))
+			try:
+				sweep({'E' : [48], 'phi' : [math.pi/4]}, claimed_directory)
+				test_results.append(False)
+			except streamlines.PlotDirectoryExists:
+				test_results.append(len(integrations) == 0)
+	finally:
+		streamlines.generate_stream_lines = generate_stream_lines
+	
+	return all(test_results)
+
+if __name__ == '__main__':
+	print(test())
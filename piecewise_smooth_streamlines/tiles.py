@@ -0,0 +1,250 @@
+import numpy as np
+
+import collections
+import itertools
+import threading
+
+# Tiled arrays
+#
+# A tiled array is a 2-D array whose values are computed on demand, one rectangular
+# tile at a time. Computed tiles are kept in a store shared by many arrays, which
+# drops the least recently used tiles once they take more than max_bytes, so the
+# memory in use is bounded by the budget instead of by the size of the arrays.
+
+DEFAULT_TILE_SHAPE = (256, 256)
+DEFAULT_MAX_BYTES = 256 << 20
+
+class TileStore:
+	def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+		self.max_bytes = max_bytes
+		self.nbytes = 0
+		self.peak_nbytes = 0
+		self.computed_tiles = 0
+		self.__tiles = collections.OrderedDict()
+		self.__lock = threading.Lock()
+	
+	def get(self, key, compute):
+		with self.__lock:
+			tile = self.__tiles.get(key)
+			if tile is not None:
+				self.__tiles.move_to_end(key)
+				return tile
+		
+		tile = compute()
+		
+		with self.__lock:
+			if key not in self.__tiles:
+				self.__tiles[key] = tile
+				self.nbytes += sum(array.nbytes for array in tile)
+				self.computed_tiles += 1
+				self.peak_nbytes = max(self.peak_nbytes, self.nbytes)
+				# The tile just computed is kept even when it alone exceeds the budget
+				while self.nbytes > self.max_bytes and len(self.__tiles) > 1:
+					_, evicted = self.__tiles.popitem(last=False)
+					self.nbytes -= sum(array.nbytes for array in evicted)
+			return self.__tiles[key]
+	
+	def clear(self):
+		with self.__lock:
+			self.__tiles.clear()
+			self.nbytes = 0
+
+# Identifiers of the tile sources within the stores
+_source_ids = itertools.count()
+
+class _TileSource:
+	def __init__(self, store, shape, tile_shape, compute_tile):
+		self.source_id = next(_source_ids)
+		self.store = store
+		self.shape = shape
+		self.tile_shape = tile_shape
+		self.compute_tile = compute_tile
+	
+	def get_tile_bounds(self, tile_j, tile_i):
+		ny, nx = self.shape
+		th, tw = self.tile_shape
+		
+		return (tile_j * th, min((tile_j + 1) * th, ny), tile_i * tw, min((tile_i + 1) * tw, nx))
+	
+	def get_tile(self, tile_j, tile_i):
+		def compute():
+			return tuple(self.compute_tile(*self.get_tile_bounds(tile_j, tile_i)))
+		
+		return self.store.get((self.source_id, tile_j, tile_i), compute)
+
+def _normalize_index(index, n):
+	if isinstance(index, slice):
+		return (index.indices(n), False)
+	
+	index = int(index)
+	if index < 0:
+		index += n
+	if not 0 <= index < n:
+		raise IndexError(f"index {index} is out of bounds for axis with size {n}")
+	
+	return ((index, index + 1, 1), True)
+
+class TiledArray:
+	def __init__(self, source, component):
+		self.source = source
+		self.component = component
+		self.shape = source.shape
+		self.tile_shape = source.tile_shape
+		self.ndim = 2
+		self.size = source.shape[0] * source.shape[1]
+		self.dtype = np.dtype(np.float64)
+		# Tile of the last element read and its position, kept to spare a store
+		# lookup per element; both are replaced at once for concurrent readers
+		self.__last_tile = (None, None)
+	
+	def __len__(self):
+		return self.shape[0]
+	
+	def get_tile(self, tile_j, tile_i):
+		return self.source.get_tile(tile_j, tile_i)[self.component]
+	
+	def get_tile_grid_shape(self):
+		(ny, nx), (th, tw) = (self.shape, self.tile_shape)
+		return (-(-ny // th), -(-nx // tw))
+	
+	def __get_element(self, j, i):
+		th, tw = self.tile_shape
+		tile_j, row = divmod(j, th)
+		tile_i, column = divmod(i, tw)
+		
+		tile_key, tile = self.__last_tile
+		if tile_key != (tile_j, tile_i):
+			tile = self.get_tile(tile_j, tile_i)
+			self.__last_tile = ((tile_j, tile_i), tile)
+		
+		return tile[row, column]
+	
+	def __get_block(self, j_0, j_1, i_0, i_1):
+		th, tw = self.tile_shape
+		block = np.empty((max(j_1 - j_0, 0), max(i_1 - i_0, 0)), dtype=self.dtype)
+		
+		for tile_j in range(j_0 // th, -(-j_1 // th)):
+			for tile_i in range(i_0 // tw, -(-i_1 // tw)):
+				tj_0, tj_1, ti_0, ti_1 = self.source.get_tile_bounds(tile_j, tile_i)
+				bj_0, bj_1 = max(j_0, tj_0), min(j_1, tj_1)
+				bi_0, bi_1 = max(i_0, ti_0), min(i_1, ti_1)
+				block[bj_0-j_0:bj_1-j_0, bi_0-i_0:bi_1-i_0] = self.get_tile(tile_j, tile_i)[bj_0-tj_0:bj_1-tj_0, bi_0-ti_0:bi_1-ti_0]
+		
+		return block
+	
+	def __getitem__(self, key):
+		if not isinstance(key, tuple):
+			key = (key, slice(None))
+		if len(key) != 2:
+			raise IndexError("tiled arrays are indexed by a row and a column")
+		
+		j, i = key
+		ny, nx = self.shape
+		if isinstance(j, (int, np.integer)) and isinstance(i, (int, np.integer)) and 0 <= j < ny and 0 <= i < nx:
+			return self.__get_element(int(j), int(i))
+		
+		(j_0, j_1, j_step), j_scalar = _normalize_index(j, ny)
+		(i_0, i_1, i_step), i_scalar = _normalize_index(i, nx)
+		
+		if j_step != 1 or i_step != 1:
+			# Strided selections are read through the rectangle that encloses them
+			j_range = range(j_0, j_1, j_step)
+			i_range = range(i_0, i_1, i_step)
+			if len(j_range) == 0 or len(i_range) == 0:
+				return np.empty((len(j_range), len(i_range)), dtype=self.dtype)
+			j_low, i_low = (min(j_range), min(i_range))
+			block = self.__get_block(j_low, max(j_range) + 1, i_low, max(i_range) + 1)
+			block = block[j_range.start-j_low::j_step, i_range.start-i_low::i_step]
+		else:
+			block = self.__get_block(j_0, j_1, i_0, i_1)
+		
+		if j_scalar and i_scalar:
+			return block[0, 0]
+		elif j_scalar:
+			return block[0]
+		elif i_scalar:
+			return block[:,0]
+		return block
+	
+	def __array__(self, dtype=None, copy=None):
+		array = self.__get_block(0, self.shape[0], 0, self.shape[1])
+		return array if dtype is None else array.astype(dtype)
+
+# Tiled arrays of the values of the fields sampled on the grid of the 1D coordinate
+# arrays x and y; every component of fields(X, Y) is a tiled array
+def sample_tiled(fields, x, y, tile_shape=DEFAULT_TILE_SHAPE, store=None):
+	if store is None:
+		store = TileStore()
+	x = np.asarray(x, dtype=np.float64)
+	y = np.asarray(y, dtype=np.float64)
+	
+	def compute_tile(j_0, j_1, i_0, i_1):
+		X, Y = np.meshgrid(x[i_0:i_1], y[j_0:j_1])
+		return [np.array(np.broadcast_to(value, X.shape), dtype=np.float64) for value in fields(X, Y)]
+	
+	source = _TileSource(store, (len(y), len(x)), tuple(tile_shape), compute_tile)
+	component_count = len(compute_tile(0, min(1, len(y)), 0, min(1, len(x))))
+	
+	return tuple(TiledArray(source, component) for component in range(component_count))
+
+# Tiled arrays of the components of function(*tiles), computed tile by tile from
+# tiled arrays that share their tile layout
+def map_tiles(function, *arrays):
+	shape = arrays[0].shape
+	tile_shape = arrays[0].tile_shape
+	
+	def compute_tile(j_0, j_1, i_0, i_1):
+		tile_j = j_0 // tile_shape[0]
+		tile_i = i_0 // tile_shape[1]
+		return function(*[array.get_tile(tile_j, tile_i) for array in arrays])
+	
+	source = _TileSource(arrays[0].source.store, shape, tile_shape, compute_tile)
+	component_count = len(function(*[array[:1,:1] for array in arrays]))
+	
+	return tuple(TiledArray(source, component) for component in range(component_count))
+
+# Bounds (j_0, j_1, i_0, i_1) of the tiles of an array, row of tiles by row of tiles
+def get_tile_bounds(array):
+	tile_rows, tile_columns = array.get_tile_grid_shape()
+	for tile_j in range(tile_rows):
+		for tile_i in range(tile_columns):
+			yield array.source.get_tile_bounds(tile_j, tile_i)
+
+def test():
+	fields = lambda X, Y : (X + 10*Y, X*Y, 1.0)
+	x = np.linspace(-1, 1, 37)
+	y = np.linspace(-2, 2, 29)
+	X, Y = np.meshgrid(x, y)
+	
+	# A store holding at most two tiles of 8x8 values of the three components
+	tile_bytes = 3 * 8 * 8 * 8
+	store = TileStore(2 * tile_bytes)
+	A, B, C = sample_tiled(fields, x, y, tile_shape=(8, 8), store=store)
+	
+	test_results = []
+	test_results.append(A.shape == X.shape and A.size == X.size and A.get_tile_grid_shape() == (4, 5))
+	test_results.append(np.array_equal(np.asarray(A), X + 10*Y) and np.array_equal(np.asarray(B), X*Y))
+	test_results.append(np.array_equal(np.asarray(C), np.ones(X.shape)))
+	test_results.append(np.array_equal(A[3:21,5:30], (X + 10*Y)[3:21,5:30]) and np.array_equal(B[::3,-7::2], (X*Y)[::3,-7::2]))
+	test_results.append(A[28, 36] == (X + 10*Y)[28, 36] and np.array_equal(B[-1], (X*Y)[-1]) and np.array_equal(B[:,4], (X*Y)[:,4]))
+	
+	# The least recently used tile is evicted first
+	store.clear()
+	computed_tiles = store.computed_tiles
+	A.get_tile(0, 0)
+	A.get_tile(0, 1)
+	A.get_tile(0, 0)
+	A.get_tile(0, 2)
+	test_results.append(store.computed_tiles - computed_tiles == 3 and store.nbytes == 2 * tile_bytes)
+	A.get_tile(0, 0)
+	test_results.append(store.computed_tiles - computed_tiles == 3)
+	A.get_tile(0, 1)
+	test_results.append(store.computed_tiles - computed_tiles == 4 and store.nbytes <= store.max_bytes)
+	
+	D, = map_tiles(lambda a, b : (a - b,), A, B)
+	test_results.append(np.array_equal(np.asarray(D), X + 10*Y - X*Y))
+	
+	return all(test_results)
+
+if __name__ == '__main__':
+	print(test())